@@ -2,6 +2,7 @@ import logging
 from flask_restful import Resource
 from flask import request
 import json
+from emuvim.dcemulator.node import get_status_list
 
 logging.basicConfig(level=logging.INFO)
 
@@ -60,11 +61,11 @@ class ComputeList(Resource):
                 all_containers = []
                 for dc in dcs.itervalues():
                     all_containers += dc.listCompute()
-                return [(c.name, c.getStatus()) for c in all_containers], 200
+                return zip([c.name for c in all_containers], get_status_list(all_containers)), 200
             else:
                 # return list of compute nodes for specified DC
-                return [(c.name, c.getStatus())
-                    for c in dcs.get(dc_label).listCompute()], 200
+                containers = dcs.get(dc_label).listCompute()
+                return zip([c.name for c in containers], get_status_list(containers)), 200
         except Exception as ex:
             logging.exception("API error.")
             return ex.message, 500
@@ -8,6 +8,12 @@ logging.basicConfig(level=logging.INFO)
 net = None
 
 
+def _samples_requested():
+    """
+    ?samples=1/true/yes, anything else (e.g. 0 or false) does not include the samples
+    """
+    return request.args.get("samples", "0").lower() in ("1", "true", "yes")
+
 
 class MonitorInterfaceAction(Resource):
     """
@@ -19,6 +25,21 @@ class MonitorInterfaceAction(Resource):
     """
     global net
 
+    def get(self, vnf_name, vnf_interface, metric):
+        """
+        Latest value and rate of the monitored counter,
+        ?window=<seconds> adds the average rate over the window, ?samples=1 the samples
+        """
+        logging.debug("REST CALL: query monitored VNF interface")
+        try:
+            c = net.monitor_agent.query_metric(vnf_name, vnf_interface, metric,
+                                               window=request.args.get("window"),
+                                               include_samples=_samples_requested())
+            return c, 200
+        except Exception as ex:
+            logging.exception("API error.")
+            return ex.message, 500
+
     def put(self, vnf_name, vnf_interface, metric):
         logging.debug("REST CALL: start monitor VNF interface")
         try:
@@ -51,6 +72,21 @@ class MonitorFlowAction(Resource):
     """
     global net
 
+    def get(self, vnf_name, vnf_interface, metric, cookie):
+        """
+        Latest value and rate of the monitored flow counter,
+        ?window=<seconds> adds the average rate over the window, ?samples=1 the samples
+        """
+        logging.debug("REST CALL: query monitored flow")
+        try:
+            c = net.monitor_agent.query_metric(vnf_name, vnf_interface, metric, cookie,
+                                               window=request.args.get("window"),
+                                               include_samples=_samples_requested())
+            return c, 200
+        except Exception as ex:
+            logging.exception("API error.")
+            return ex.message, 500
+
     def put(self, vnf_name, vnf_interface, metric, cookie):
         logging.debug("REST CALL: start monitor VNF interface")
         try:
@@ -19,10 +19,14 @@ class SonataDummyGatekeeperEndpoint(object):
     topology.
     """
 
-    def __init__(self, listenip, port):
+    def __init__(self, listenip, port, placement=None):
+        """
+        :param placement: placement algorithm class of the dummy gatekeeper (default: FirstDcPlacement)
+        """
         self.dcs = {}
         self.ip = listenip
         self.port = port
+        self.placement = placement
         logging.debug("Created API endpoint %s" % self)
 
     def __repr__(self):
@@ -40,4 +44,4 @@ class SonataDummyGatekeeperEndpoint(object):
         logging.debug("Started API endpoint %s" % self)
 
     def _api_server_thread(self):
-        dgk.start_rest_api(self.ip, self.port, self.dcs)
+        dgk.start_rest_api(self.ip, self.port, self.dcs, placement=self.placement)
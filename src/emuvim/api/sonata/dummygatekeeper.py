@@ -11,6 +11,7 @@ import uuid
 import hashlib
 import zipfile
 import yaml
+import networkx as nx
 from docker import Client as DockerClient
 from flask import Flask, request
 import flask_restful as fr
@@ -34,12 +35,24 @@ GK_STANDALONE_MODE = False
 # should a new version of an image be pulled even if its available
 FORCE_PULL = False
 
+# flavor used for VNFs without resource requirements
+DEFAULT_FLAVOR = "small"
+
+# sizes of the OpenStack flavors after which the flavors of the resource models are named
+# (name, vcpus, memory in MB), used to map the resource requirements of the VDUs to a flavor
+VDU_FLAVORS = [("tiny", 1, 512), ("small", 1, 2048), ("medium", 2, 4096), ("large", 4, 8192), ("xlarge", 8, 16384)]
+
+# memory size units of the VNFDs in MB
+MEMORY_UNITS = {"KB": 1.0 / 1024, "MB": 1, "GB": 1024, "TB": 1024 ** 2}
+
 class Gatekeeper(object):
 
     def __init__(self):
         self.services = dict()
         self.dcs = dict()
         self.vnf_counter = 0  # used to generate short names for VNFs (Mininet limitation)
+        # placement algorithm (class) used to select the DCs of the VNFs of a service
+        self.placement = FirstDcPlacement
         LOG.info("Create SONATA dummy gatekeeper.")
 
     def register_service_package(self, service_uuid, service):
@@ -118,13 +131,26 @@ class Service(object):
 
         # 2. compute placement of this service instance (adds DC names to VNFDs)
         if not GK_STANDALONE_MODE:
-            self._calculate_placement(FirstDcPlacement)
+            self._calculate_placement(GK.placement)
         # iterate over all vnfds that we have to start
-        for vnfd in self.vnfds.itervalues():
-            vnfi = None
-            if not GK_STANDALONE_MODE:
-                vnfi = self._start_vnfd(vnfd)
-            self.instances[instance_uuid]["vnf_instances"].append(vnfi)
+        if GK_STANDALONE_MODE:
+            self.instances[instance_uuid]["vnf_instances"] = [None for vnfd in self.vnfds.itervalues()]
+        else:
+            # all containers of the service are created at once, if the resource models admit all of them
+            specs = [self._get_compute_spec(vnfd) for vnfd in self.vnfds.itervalues()]
+            network = specs[0].get("datacenter").net if len(specs) > 0 else None
+            results = network.startComputeBatch(specs, atomic=True) if network is not None else []
+            failed = [r for r in results if r.compute is None]
+            if len(failed) > 0:
+                for r in failed:
+                    LOG.error("Failed to start VNF %r: %s" % (r.name, r.error))
+                # do not leave a partially started service instance behind
+                for r in results:
+                    if r.compute is not None:
+                        r.compute.datacenter.stopCompute(r.compute.name)
+                del self.instances[instance_uuid]
+                raise Exception("Service %r could not be started: %s" % (self.uuid, failed[0].error))
+            self.instances[instance_uuid]["vnf_instances"] = [r.compute for r in results]
 
         # 3. Configure the chaining of the network functions (currently only E-Line links supported)
         nfid2name = defaultdict(lambda :"NotExistingNode", 
@@ -164,6 +190,16 @@ class Service(object):
         :param vnfd: vnfd descriptor dict
         :return:
         """
+        spec = self._get_compute_spec(vnfd)
+        target_dc = spec.pop("datacenter")
+        return target_dc.startCompute(**spec)
+
+    def _get_compute_spec(self, vnfd):
+        """
+        Prepare the arguments of the startCompute call of a single VNFD
+        :param vnfd: vnfd descriptor dict
+        :return: dict with the startCompute arguments and the target data center
+        """
         # iterate over all deployment units within each VNFDs
         for u in vnfd.get("virtual_deployment_units"):
             # 1. get the name of the docker image to start and the assigned DC
@@ -177,16 +213,18 @@ class Service(object):
             assert(target_dc is not None)
             if not self._check_docker_image_exists(docker_name):
                 raise Exception("Docker image %r not found. Abort." % docker_name)
-            # 3. do the dc.startCompute(name="foobar") call to run the container
-            # TODO consider flavors, and other annotations
+            # 3. prepare the dc.startCompute(name="foobar") call to run the container
+            # TODO consider other annotations
             intfs = vnfd.get("connection_points")
             self.vnfname2num[vnf_name] = GK.get_next_vnf_name()
             LOG.info("VNF "+vnf_name+" mapped to "+self.vnfname2num[vnf_name]+" on dc "+str(vnfd.get("dc")))
-            vnfi = target_dc.startCompute(self.vnfname2num[vnf_name], network=intfs, image=docker_name, flavor_name="small")
-            return vnfi
+            return {"datacenter": target_dc, "name": self.vnfname2num[vnf_name], "network": intfs,
+                    "image": docker_name, "flavor_name": get_flavor_name(vnfd)}
 
     def _trigger_emulator_start_scripts_in_vnfis(self, vnfi_list):
         for vnfi in vnfi_list:
+            if vnfi is None:
+                continue
             config = vnfi.dcinfo.get("Config", dict())
             env = config.get("Env", list())
             for env_var in env:
@@ -326,13 +364,221 @@ Some (simple) placement algorithms
 """
 
 
-class FirstDcPlacement(object):
+
+
+def get_flavor_name(vnfd):
+    """
+    Flavor with which a VNF is started: the smallest flavor that provides the
+    vcpus and memory required by the VDUs of the VNFD (summed up).
+    VNFDs without resource requirements get the DEFAULT_FLAVOR, VNFDs that
+    need more than the biggest flavor get the biggest one.
+    """
+    vcpus = 0.0
+    memory = 0.0
+    found = False
+    for u in vnfd.get("virtual_deployment_units", []):
+        req = u.get("resource_requirements")
+        if not req:
+            continue
+        found = True
+        vcpus += float(req.get("cpu", {}).get("vcpus", 0))
+        mem = req.get("memory", {})
+        memory += float(mem.get("size", 0)) * MEMORY_UNITS.get(str(mem.get("size_unit", "MB")).upper(), 1)
+    if not found:
+        return DEFAULT_FLAVOR
+    for name, fl_vcpus, fl_memory in VDU_FLAVORS:
+        if vcpus <= fl_vcpus and memory <= fl_memory:
+            return name
+    LOG.warning("VNF %r needs more resources than the biggest flavor." % vnfd.get("name"))
+    return VDU_FLAVORS[-1][0]
+
+
+class DcLoad(object):
+    """
+    Load of a data center while a service is placed: the allocations of its
+    resource model plus the VNFs placed on it so far.
+    DCs without (limiting) resource model have unlimited capacity.
+    """
+
+    def __init__(self, dc):
+        self.dc = dc
+        self.rm = dc.getResourceModel()
+        self.max_cu = getattr(self.rm, "dc_max_cu", None)
+        self.max_mu = getattr(self.rm, "dc_max_mu", None)
+        self.cu = getattr(self.rm, "dc_alloc_cu", 0) + getattr(self.rm, "dc_reserved_cu", 0)
+        self.mu = getattr(self.rm, "dc_alloc_mu", 0) + getattr(self.rm, "dc_reserved_mu", 0)
+        self.n = len(dc.containers)
+        # are the limits enforced by the resource model?
+        self.check_cu = (self.max_cu is not None and not getattr(self.rm, "deactivate_cpu_limit", False)
+                         and getattr(self.rm, "raise_no_cpu_resources_left", True))
+        self.check_mu = (self.max_mu is not None and not getattr(self.rm, "deactivate_mem_limit", False)
+                         and getattr(self.rm, "raise_no_mem_resources_left", True))
+
+    def demand(self, flavor_name):
+        """
+        :return: tuple (compute units, memory units) of a flavor in this DC
+        """
+        flavor = None if self.rm is None else self.rm.get_flavor(flavor_name)
+        if flavor is None:
+            return 0, 0
+        return flavor.get("compute") or 0, flavor.get("memory") or 0
+
+    def fits(self, flavor_name):
+        cu, mu = self.demand(flavor_name)
+        if self.check_cu and self.cu + cu > self.max_cu:
+            return False
+        if self.check_mu and self.mu + mu > self.max_mu:
+            return False
+        return True
+
+    def load(self):
+        """
+        Fraction of the capacity that is used (0 for DCs without limits).
+        """
+        load = 0.0
+        if self.max_cu:
+            load = max(load, float(self.cu) / self.max_cu)
+        if self.max_mu:
+            load = max(load, float(self.mu) / self.max_mu)
+        return load
+
+    def remaining_cu(self):
+        if not self.max_cu:
+            return float("inf")
+        return self.max_cu - self.cu
+
+    def add(self, flavor_name):
+        cu, mu = self.demand(flavor_name)
+        self.cu += cu
+        self.mu += mu
+        self.n += 1
+
+
+class CapacityAwarePlacement(object):
+    """
+    Base class of the placements that take the resource models of the DCs into account.
+    The VNFs are placed one after the other, each one on one of the DCs that still have
+    enough resources left (all DCs if none has). Subclasses select the DC, the first
+    one is used by default.
+    """
+
+    def place(self, nsd, vnfds, dcs):
+        loads = [DcLoad(dc) for dc in dcs.itervalues()]
+        # vnf name -> DcLoad
+        placed = dict()
+        for name, vnfd in self._order(vnfds, loads):
+            flavor_name = get_flavor_name(vnfd)
+            candidates = [l for l in loads if l.fits(flavor_name)]
+            if len(candidates) < 1:
+                LOG.warning("No data center has enough resources left for VNF %r" % name)
+                candidates = loads
+            selected = self._select(nsd, name, flavor_name, candidates, placed)
+            selected.add(flavor_name)
+            placed[name] = selected
+            vnfd["dc"] = selected.dc
+
+    def _order(self, vnfds, loads):
+        """
+        Order in which the VNFs are placed.
+        :return: list of (vnf name, vnfd)
+        """
+        return list(vnfds.iteritems())
+
+    def _select(self, nsd, name, flavor_name, candidates, placed):
+        """
+        :return: the DcLoad of the selected DC
+        """
+        return candidates[0]
+
+
+class FirstDcPlacement(CapacityAwarePlacement):
+    """
+    Placement: Use the first data center from the GK.dcs dict that has enough resources left.
+    """
+    pass
+
+
+class LeastLoadedPlacement(CapacityAwarePlacement):
+    """
+    Placement: Use the data center with the smallest fraction of used resources
+    (the one with the fewest containers if there are no limits).
+    """
+    def _select(self, nsd, name, flavor_name, candidates, placed):
+        return min(candidates, key=lambda l: (l.load(), l.n))
+
+
+class BinPackingPlacement(CapacityAwarePlacement):
+    """
+    Placement: Best fit decreasing, the biggest VNFs first, each one on the
+    data center with the fewest compute units left. Keeps other DCs free.
+    """
+    def _order(self, vnfds, loads):
+        def size(item):
+            demands = [l.demand(get_flavor_name(item[1])) for l in loads]
+            return max(demands) if len(demands) > 0 else (0, 0)
+        return sorted(vnfds.iteritems(), key=size, reverse=True)
+
+    def _select(self, nsd, name, flavor_name, candidates, placed):
+        return min(candidates, key=lambda l: (l.remaining_cu() - l.demand(flavor_name)[0], l.n))
+
+
+class DelayAwarePlacement(LeastLoadedPlacement):
     """
-    Placement: Always use one and the same data center from the GK.dcs dict.
+    Placement: Put each VNF on the data center with the smallest sum of link delays
+    (delay attributes of the DCNetwork_graph edges) to the data centers of the VNFs
+    it is connected to by a virtual link of the NSD. Ties are broken by the load.
     """
     def place(self, nsd, vnfds, dcs):
-        for name, vnfd in vnfds.iteritems():
-            vnfd["dc"] = list(dcs.itervalues())[0]
+        self._delays = self._get_dc_delays(dcs)
+        self._neighbours = self._get_neighbours(nsd)
+        super(DelayAwarePlacement, self).place(nsd, vnfds, dcs)
+
+    def _get_dc_delays(self, dcs):
+        """
+        :return: dict (dc switch, dc switch) -> delay of the shortest path
+        """
+        dc_list = list(dcs.itervalues())
+        if len(dc_list) < 1 or dc_list[0].net is None:
+            return dict()
+        # delays are stored as strings, keep the smallest one between two nodes
+        g = nx.Graph()
+        for src, dst, attr in dc_list[0].net.DCNetwork_graph.edges(data=True):
+            delay = float(attr.get("delay") or 0)
+            if not g.has_edge(src, dst) or g[src][dst]["delay"] > delay:
+                g.add_edge(src, dst, delay=delay)
+        delays = dict()
+        for dc in dc_list:
+            if dc.switch is None or dc.switch.name not in g:
+                continue
+            lengths = nx.single_source_dijkstra_path_length(g, dc.switch.name, weight="delay")
+            for other in dc_list:
+                if other.switch is not None and other.switch.name in lengths:
+                    delays[(dc.switch.name, other.switch.name)] = lengths[other.switch.name]
+        return delays
+
+    def _get_neighbours(self, nsd):
+        """
+        :return: dict vnf name -> set of the names of the VNFs connected to it
+        """
+        nfid2name = dict((nf["vnf_id"], nf["vnf_name"]) for nf in nsd.get("network_functions", []))
+        neighbours = defaultdict(set)
+        for link in nsd.get("virtual_links", []):
+            names = [nfid2name.get(ref.split(":")[0]) for ref in link.get("connection_points_reference", [])]
+            names = [n for n in names if n is not None]
+            for n in names:
+                neighbours[n].update(m for m in names if m != n)
+        return neighbours
+
+    def _delay(self, load, other):
+        if load.dc is other.dc:
+            return 0.0
+        if load.dc.switch is None or other.dc.switch is None:
+            return float("inf")
+        return self._delays.get((load.dc.switch.name, other.dc.switch.name), float("inf"))
+
+    def _select(self, nsd, name, flavor_name, candidates, placed):
+        others = [placed[n] for n in self._neighbours.get(name, []) if n in placed]
+        return min(candidates, key=lambda l: (sum(self._delay(l, o) for o in others), l.load(), l.n))
 
 
 """
@@ -404,7 +650,11 @@ class Instantiations(fr.Resource):
 
         if service_uuid in GK.services:
             # ok, we have a service uuid, lets start the service
-            service_instance_uuid = GK.services.get(service_uuid).start_service()
+            try:
+                service_instance_uuid = GK.services.get(service_uuid).start_service()
+            except Exception as ex:
+                LOG.exception("Service instantiation failed:")
+                return {"service_instance_uuid": None, "error": ex.message}, 500
             return {"service_instance_uuid": service_instance_uuid}
         return "Service not found", 404
 
@@ -428,8 +678,10 @@ api.add_resource(Packages, '/packages')
 api.add_resource(Instantiations, '/instantiations')
 
 
-def start_rest_api(host, port, datacenters=dict()):
+def start_rest_api(host, port, datacenters=dict(), placement=None):
     GK.dcs = datacenters
+    if placement is not None:
+        GK.placement = placement
     # start the Flask server (not the best performance but ok for our use case)
     app.run(host=host,
             port=port,
@@ -12,6 +12,8 @@ import ipaddress
 import time
 import gevent
 
+from emuvim.dcemulator.node import get_status_list
+
 logging.basicConfig(level=logging.INFO)
 
 
@@ -99,12 +101,11 @@ class MultiDatacenterApi(object):
                 all_containers = []
                 for dc in self.dcs.itervalues():
                     all_containers += dc.listCompute()
-                return [(c.name, c.getStatus())
-                        for c in all_containers]
+                return zip([c.name for c in all_containers], get_status_list(all_containers))
             else:
                 # return list of compute nodes for specified DC
-                return [(c.name, c.getStatus())
-                        for c in self.dcs.get(dc_label).listCompute()]
+                containers = self.dcs.get(dc_label).listCompute()
+                return zip([c.name for c in containers], get_status_list(containers))
         except Exception as ex:
             logging.exception("RPC error.")
             return ex.message
@@ -144,6 +144,16 @@ class DCNetworkApi(object):
             logging.exception("RPC error.")
             return ex.message
 
+    # latest value, rate and average rate of a monitored metric/flow
+    def query_metric(self, vnf_name, vnf_interface, metric, cookie=None, window=None):
+        logging.debug("RPC CALL: query metric")
+        try:
+            c = self.net.monitor_agent.query_metric(vnf_name, vnf_interface, metric, cookie, window)
+            return c
+        except Exception as ex:
+            logging.exception("RPC error.")
+            return ex.message
+
     # do prometheus query
     def prometheus(self, dc_label, vnf_name, vnf_interface, query):
         logging.debug("RPC CALL: query prometheus")
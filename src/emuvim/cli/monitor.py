@@ -71,6 +71,17 @@ class ZeroRpcClient(object):
             args.get("cookie"))
         pp.pprint(r)
 
+    def query_metric(self, args):
+        vnf_name = self._parse_vnf_name(args.get("vnf_name"))
+        vnf_interface = self._parse_vnf_interface(args.get("vnf_name"))
+        r = self.c.query_metric(
+            vnf_name,
+            vnf_interface,
+            args.get("metric"),
+            args.get("cookie"),
+            args.get("window"))
+        pp.pprint(r)
+
     def prometheus_zrpc(self, args):
         vnf_name = self._parse_vnf_name(args.get("vnf_name"))
         vnf_interface = self._parse_vnf_interface(args.get("vnf_name"))
@@ -109,8 +120,8 @@ class ZeroRpcClient(object):
 parser = argparse.ArgumentParser(description='son-emu monitor')
 parser.add_argument(
     "command",
-    choices=['setup_metric', 'stop_metric', 'setup_flow', 'stop_flow','prometheus'],
-    help="setup/stop a metric/flow to be monitored or query Prometheus")
+    choices=['setup_metric', 'stop_metric', 'setup_flow', 'stop_flow', 'query_metric', 'prometheus'],
+    help="setup/stop a metric/flow to be monitored, query its rate or query Prometheus")
 parser.add_argument(
     "--vnf_name", "-vnf", dest="vnf_name",
     help="vnf name:interface to be monitored")
@@ -123,6 +134,9 @@ parser.add_argument(
 parser.add_argument(
     "--query", "-q", dest="query",
     help="prometheus query")
+parser.add_argument(
+    "--window", "-w", dest="window", type=float,
+    help="query_metric: average the rate over the last <window> seconds")
 parser.add_argument(
     "--datacenter", "-d", dest="datacenter",
     help="Data center where the vnf is deployed")
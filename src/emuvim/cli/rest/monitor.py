@@ -67,6 +67,19 @@ class RestApiClient():
 
         pp.pprint(response.json())
 
+    def query_metric(self, args):
+        vnf_name = self._parse_vnf_name(args.get("vnf_name"))
+        vnf_interface = self._parse_vnf_interface(args.get("vnf_name"))
+
+        url = "%s/restapi/monitor/%s/%s/%s" % (args.get("endpoint"), vnf_name, vnf_interface, args.get("metric"))
+        if args.get("cookie") is not None:
+            url += "/%s" % args.get("cookie")
+        params = {}
+        if args.get("window") is not None:
+            params["window"] = args.get("window")
+        response = get(url, params=params)
+        pp.pprint(response.json())
+
     def _parse_vnf_name(self, vnf_name_str):
         vnf_name = vnf_name_str.split(':')[0]
         return vnf_name
@@ -82,8 +95,8 @@ class RestApiClient():
 parser = argparse.ArgumentParser(description='son-emu monitor')
 parser.add_argument(
     "command",
-    choices=['setup_metric', 'stop_metric', 'setup_flow', 'stop_flow','prometheus'],
-    help="setup/stop a metric/flow to be monitored or query Prometheus")
+    choices=['setup_metric', 'stop_metric', 'setup_flow', 'stop_flow', 'query_metric', 'prometheus'],
+    help="setup/stop a metric/flow to be monitored, query its rate or query Prometheus")
 parser.add_argument(
     "--vnf_name", "-vnf", dest="vnf_name",
     help="vnf name:interface to be monitored")
@@ -96,6 +109,9 @@ parser.add_argument(
 parser.add_argument(
     "--query", "-q", dest="query",
     help="prometheus query")
+parser.add_argument(
+    "--window", "-w", dest="window", type=float,
+    help="query_metric: average the rate over the last <window> seconds")
 parser.add_argument(
     "--datacenter", "-d", dest="datacenter",
     help="Data center where the vnf is deployed")
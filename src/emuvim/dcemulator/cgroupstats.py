@@ -0,0 +1,136 @@
+"""
+Distributed Cloud Emulator (dcemulator)
+Reading the cpu and memory usage of containers from their cgroup files
+(cgroup v1 and the v2 unified hierarchy).
+"""
+import os
+import logging
+
+LOG = logging.getLogger("dcemulator.cgroupstats")
+LOG.setLevel(logging.DEBUG)
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# resource -> (v1 controller, v1 file), (v2 file)
+_V1_FILES = {"cpu": ("cpuacct", "cpuacct.usage"),
+             "memory": ("memory", "memory.usage_in_bytes")}
+_V2_FILES = {"cpu": "cpu.stat",
+             "memory": "memory.current"}
+
+
+def is_cgroup_v2(root=CGROUP_ROOT):
+    return os.path.exists(os.path.join(root, "cgroup.controllers"))
+
+
+def _proc_cgroups(pid):
+    """
+    :return: dict controller -> cgroup path of a process ('' is the v2 hierarchy)
+    """
+    result = {}
+    try:
+        with open("/proc/%d/cgroup" % int(pid)) as f:
+            for line in f:
+                parts = line.strip().split(":", 2)
+                if len(parts) != 3:
+                    continue
+                for controller in parts[1].split(","):
+                    result[controller] = parts[2]
+    except (IOError, ValueError) as ex:
+        LOG.debug("Could not read the cgroups of pid %r: %s" % (pid, ex))
+    return result
+
+
+def find_cgroup_file(resource, container_id, pid=None, root=CGROUP_ROOT):
+    """
+    Find the usage file of a container.
+    The cgroup of the container's main process is tried first, then the
+    paths of Docker's cgroupfs and systemd cgroup drivers.
+    :param resource: 'cpu' or 'memory'
+    :param container_id: full Docker id of the container
+    :param pid: pid of the container's main process (optional)
+    :return: path of the file or None if not found
+    """
+    if is_cgroup_v2(root):
+        controller, filename, base = "", _V2_FILES[resource], root
+    else:
+        controller, filename = _V1_FILES[resource]
+        base = os.path.join(root, controller)
+    paths = []
+    if pid:
+        own = _proc_cgroups(pid).get(controller)
+        if own:
+            paths.append(own)
+    paths += ["docker/%s" % container_id,
+              "system.slice/docker-%s.scope" % container_id]
+    for path in paths:
+        f = os.path.join(base, path.lstrip("/"), filename)
+        if os.path.exists(f):
+            return f
+    return None
+
+
+def parse_cpu_usage(data, v2=False):
+    """
+    :param data: content of cpuacct.usage (v1) or cpu.stat (v2)
+    :return: consumed cpu time in nanoseconds or None
+    """
+    if not v2:
+        return int(data)
+    for line in data.splitlines():
+        if line.startswith("usage_usec"):
+            return int(line.split()[1]) * 1000
+    return None
+
+
+class CgroupReader(object):
+    """
+    Reads the cpu and memory usage of one container.
+    The files are opened once and read again from the start on each sample.
+    """
+
+    def __init__(self, container_id, pid=None, root=CGROUP_ROOT):
+        self.container_id = container_id
+        self.cpu_file = self._open(find_cgroup_file("cpu", container_id, pid, root))
+        self.memory_file = self._open(find_cgroup_file("memory", container_id, pid, root))
+        self.v2 = self.cpu_file is not None and self.cpu_file.name.endswith(_V2_FILES["cpu"])
+        if self.cpu_file is None and self.memory_file is None:
+            LOG.warning("No cgroup files found for container %s" % container_id)
+
+    def _open(self, path):
+        if path is None:
+            return None
+        try:
+            return open(path, "r")
+        except IOError as ex:
+            LOG.warning("Could not open %s: %s" % (path, ex))
+            return None
+
+    def _read(self, f):
+        if f is None:
+            return None
+        try:
+            f.seek(0)
+            return f.read()
+        except (IOError, ValueError):
+            # the cgroup is gone, e.g. the container was stopped
+            return None
+
+    def read(self):
+        """
+        :return: tuple (cpu time in ns, memory usage in bytes), None for values that can not be read
+        """
+        cpu = self._read(self.cpu_file)
+        memory = self._read(self.memory_file)
+        try:
+            cpu = parse_cpu_usage(cpu, self.v2) if cpu else None
+            memory = int(memory) if memory else None
+        except ValueError:
+            return None, None
+        return cpu, memory
+
+    def close(self):
+        for f in [self.cpu_file, self.memory_file]:
+            if f is not None:
+                f.close()
+        self.cpu_file = None
+        self.memory_file = None
@@ -2,18 +2,23 @@ __author__ = 'Administrator'
 
 import urllib2
 import logging
-from mininet.node import  OVSSwitch
-import ast
 import time
+import random
+from array import array
 from prometheus_client import start_http_server, Summary, Histogram, Gauge, Counter, REGISTRY, CollectorRegistry, \
-    pushadd_to_gateway, push_to_gateway, delete_from_gateway
+    pushadd_to_gateway, push_to_gateway, delete_from_gateway, generate_latest, CONTENT_TYPE_LATEST
 import threading
+import BaseHTTPServer
+import SocketServer
 from subprocess import Popen, PIPE
 import os
 
 import paramiko
 import gevent
 
+from emuvim.dcemulator import ryustats
+from emuvim.dcemulator.cgroupstats import CgroupReader
+
 logging.basicConfig(level=logging.INFO)
 
 """
@@ -21,7 +26,22 @@ class to read openflow stats from the Ryu controller of the DCNetwork
 """
 
 class DCNetworkMonitor():
-    def __init__(self, net):
+    def __init__(self, net, push=True, push_delta=False, metrics_port=None,
+                 interval=1.0, max_interval=10.0, jitter=0.5, history=300,
+                 sample_containers=True, cadvisor=False):
+        """
+        :param net: the DCNetwork
+        :param history: number of samples kept in memory per monitored metric (see query_metric)
+        :param sample_containers: sample the cpu and memory usage of all containers from their cgroups
+        :param cadvisor: start a cAdvisor container (only needed for Prometheus queries of cAdvisor metrics)
+        :param interval: default polling interval of a metric in seconds
+        :param max_interval: max. polling interval if a switch answers slowly
+        :param jitter: fraction of the interval over which the polling of the switches is spread
+        :param push: push the metrics to the Pushgateway (once per polling cycle)
+        :param push_delta: only push the metric families that changed since the last push
+        :param metrics_port: if given, serve the metrics on http://<host>:<metrics_port>/metrics
+                             so that Prometheus can scrape them (use push=False to disable all push traffic)
+        """
         self.net = net
 
         prometheus_ip = '127.0.0.1'
@@ -32,8 +52,13 @@ class DCNetworkMonitor():
 
         # helper variables to calculate the metrics
         self.pushgateway = 'localhost:9091'
-        # Start up the server to expose the metrics to Prometheus.
-        #start_http_server(8000)
+        self.push = push
+        self.push_delta = push_delta
+        # samples of each metric family at the last (delta) push
+        self._pushed_families = dict()
+        self._push_lock = threading.Lock()
+        # series were removed from the registry since the last push
+        self._removed_series = False
         # supported Prometheus metrics
         self.registry = CollectorRegistry()
         self.prom_tx_packet_count = Gauge('sonemu_tx_count_packets', 'Total number of packets sent',
@@ -48,23 +73,34 @@ class DCNetworkMonitor():
         self.prom_metrics={'tx_packets':self.prom_tx_packet_count, 'rx_packets':self.prom_rx_packet_count,
                            'tx_bytes':self.prom_tx_byte_count,'rx_bytes':self.prom_rx_byte_count}
 
-        # list of installed metrics to monitor
-        # each entry can contain this data
-        '''
-        {
-        switch_dpid = 0
-        vnf_name = None
-        vnf_interface = None
-        previous_measurement = 0
-        previous_monitor_time = 0
-        metric_key = None
-        mon_port = None
-        }
-        '''
+        # health of the polling threads
+        self.prom_cycle_duration = Gauge('sonemu_monitor_cycle_duration_seconds',
+                                         'Duration of the last polling cycle', ['poller'], registry=self.registry)
+        self.prom_missed_deadlines = Gauge('sonemu_monitor_missed_deadlines',
+                                           'Number of polls that started later than one interval after their deadline',
+                                           ['poller'], registry=self.registry)
+
+        # installed metrics to monitor (MonitoredMetric records), indexed by key and by switch dpid
+        # network metrics: (vnf_name, vnf_interface, metric), flow metrics: (vnf_name, vnf_interface, metric, cookie)
+        # the polling threads work on a snapshot of the per-dpid tuples without holding the lock during the REST calls
+        # the locks only serialize the changes of the tables and the Prometheus labels
         self.monitor_lock = threading.Lock()
         self.monitor_flow_lock = threading.Lock()
-        self.network_metrics = []
-        self.flow_metrics = []
+        self.network_metrics = MetricTable()
+        self.flow_metrics = MetricTable()
+        self.history = history
+
+        # Start up the server to expose the metrics to Prometheus.
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = self.start_metrics_server(metrics_port)
+
+        # when to poll which switch
+        self.network_scheduler = PollScheduler('network', interval=interval, max_interval=max_interval, jitter=jitter)
+        self.flow_scheduler = PollScheduler('flow', interval=interval, max_interval=max_interval, jitter=jitter)
+        # wake up the polling threads when metrics are added
+        self._wakeup_network = threading.Event()
+        self._wakeup_flow = threading.Event()
 
         # start monitoring thread
         self.start_monitoring = True
@@ -74,63 +110,44 @@ class DCNetworkMonitor():
         self.monitor_flow_thread = threading.Thread(target=self.get_flow_metrics)
         self.monitor_flow_thread.start()
 
+        # cpu and memory usage of the containers
+        self.cgroup_sampler = None
+        if sample_containers:
+            self.cgroup_sampler = CgroupSampler(net, self.registry, interval=interval, history=history,
+                                                on_sample=self.push_metrics)
+
         # helper tools
         #self.pushgateway_process = self.start_PushGateway()
         #self.prometheus_process = self.start_Prometheus()
-        self.cadvisor_process = self.start_cadvisor()
+        self.cadvisor_process = None
+        if cadvisor:
+            self.cadvisor_process = self.start_cadvisor()
 
     # first set some parameters, before measurement can start
-    def setup_flow(self, vnf_name, vnf_interface=None, metric='tx_packets', cookie=0):
-
-        flow_metric = {}
-
-        # check if port is specified (vnf:port)
-        if vnf_interface is None:
-            # take first interface by default
-            connected_sw = self.net.DCNetwork_graph.neighbors(vnf_name)[0]
-            link_dict = self.net.DCNetwork_graph[vnf_name][connected_sw]
-            vnf_interface = link_dict[0]['src_port_id']
-
-        flow_metric['vnf_name'] = vnf_name
-        flow_metric['vnf_interface'] = vnf_interface
-
-        vnf_switch = None
-        for connected_sw in self.net.DCNetwork_graph.neighbors(vnf_name):
-            link_dict = self.net.DCNetwork_graph[vnf_name][connected_sw]
-            for link in link_dict:
-                # logging.info("{0},{1}".format(link_dict[link],vnf_interface))
-                if link_dict[link]['src_port_id'] == vnf_interface:
-                    # found the right link and connected switch
-                    # logging.info("{0},{1}".format(link_dict[link]['src_port_id'], vnf_source_interface))
-                    vnf_switch = connected_sw
-                    flow_metric['mon_port'] = link_dict[link]['dst_port_nr']
-                    break
-
-        if not vnf_switch:
+    def setup_flow(self, vnf_name, vnf_interface=None, metric='tx_packets', cookie=0, interval=None):
+        """
+        :param interval: polling interval in seconds, the default interval of the monitor if None
+        """
+
+        # check if port is specified (vnf:port), take first interface by default
+        vnf_intf = self.net.getVnfInterface(vnf_name, vnf_interface)
+        if vnf_intf is None:
             logging.exception("vnf switch of {0}:{1} not found!".format(vnf_name, vnf_interface))
             return "vnf switch of {0}:{1} not found!".format(vnf_name, vnf_interface)
+        vnf_interface = vnf_intf.vnf_interface
 
         try:
             # default port direction to monitor
             if metric is None:
                 metric = 'tx_packets'
 
-            next_node = self.net.getNodeByName(vnf_switch)
+            flow_metric = MonitoredMetric(vnf_name, vnf_interface, metric,
+                                          vnf_intf.switch_dpid, vnf_intf.switch_port_nr, cookie=cookie,
+                                          interval=interval, history=self.history)
 
-            if not isinstance(next_node, OVSSwitch):
-                logging.info("vnf: {0} is not connected to switch".format(vnf_name))
-                return
-
-            flow_metric['previous_measurement'] = 0
-            flow_metric['previous_monitor_time'] = 0
-
-            flow_metric['switch_dpid'] = int(str(next_node.dpid), 16)
-            flow_metric['metric_key'] = metric
-            flow_metric['cookie'] = cookie
-
-            self.monitor_flow_lock.acquire()
-            self.flow_metrics.append(flow_metric)
-            self.monitor_flow_lock.release()
+            with self.monitor_flow_lock:
+                self.flow_metrics.add(flow_metric)
+            self._wakeup_flow.set()
 
             logging.info('Started monitoring flow:{3} {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric, cookie))
             return 'Started monitoring flow:{3} {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric, cookie)
@@ -140,90 +157,43 @@ class DCNetworkMonitor():
             return ex.message
 
     def stop_flow(self, vnf_name, vnf_interface=None, metric=None, cookie=0):
-        for flow_dict in self.flow_metrics:
-            if flow_dict['vnf_name'] == vnf_name and flow_dict['vnf_interface'] == vnf_interface \
-                    and flow_dict['metric_key'] == metric and flow_dict['cookie'] == cookie:
-
-                self.monitor_flow_lock.acquire()
-
-                self.flow_metrics.remove(flow_dict)
-
-                for collector in self.registry._collectors:
-                    if (vnf_name, vnf_interface, cookie) in collector._metrics:
-                        #logging.info('2 name:{0} labels:{1} metrics:{2}'.format(collector._name, collector._labelnames,
-                        #                                                        collector._metrics))
-                        collector.remove(vnf_name, vnf_interface, cookie)
-
-                delete_from_gateway(self.pushgateway, job='sonemu-SDNcontroller')
+        with self.monitor_flow_lock:
+            flow_metric = self.flow_metrics.remove((vnf_name, vnf_interface, metric, cookie))
+            if flow_metric is None:
+                return
+            self._remove_labels(flow_metric)
 
-                self.monitor_flow_lock.release()
+        self._series_removed()
 
-                logging.info('Stopped monitoring flow {3}: {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric, cookie))
-                return 'Stopped monitoring flow {3}: {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric, cookie)
+        logging.info('Stopped monitoring flow {3}: {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric, cookie))
+        return 'Stopped monitoring flow {3}: {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric, cookie)
 
 
     # first set some parameters, before measurement can start
-    def setup_metric(self, vnf_name, vnf_interface=None, metric='tx_packets'):
-
-        network_metric = {}
-
-        # check if port is specified (vnf:port)
-        if vnf_interface is None:
-            # take first interface by default
-            connected_sw = self.net.DCNetwork_graph.neighbors(vnf_name)[0]
-            link_dict = self.net.DCNetwork_graph[vnf_name][connected_sw]
-            vnf_interface = link_dict[0]['src_port_id']
-
-        network_metric['vnf_name'] = vnf_name
-        network_metric['vnf_interface'] = vnf_interface
-
-        for connected_sw in self.net.DCNetwork_graph.neighbors(vnf_name):
-            link_dict = self.net.DCNetwork_graph[vnf_name][connected_sw]
-            for link in link_dict:
-                # logging.info("{0},{1}".format(link_dict[link],vnf_interface))
-                if link_dict[link]['src_port_id'] == vnf_interface:
-                    # found the right link and connected switch
-                    # logging.info("{0},{1}".format(link_dict[link]['src_port_id'], vnf_source_interface))
-                    network_metric['mon_port'] = link_dict[link]['dst_port_nr']
-                    break
-
-        if 'mon_port' not in network_metric:
+    def setup_metric(self, vnf_name, vnf_interface=None, metric='tx_packets', interval=None):
+        """
+        :param interval: polling interval in seconds, the default interval of the monitor if None
+        """
+
+        # check if port is specified (vnf:port), take first interface by default
+        vnf_intf = self.net.getVnfInterface(vnf_name, vnf_interface)
+        if vnf_intf is None:
             logging.exception("vnf interface {0}:{1} not found!".format(vnf_name,vnf_interface))
             return "vnf interface {0}:{1} not found!".format(vnf_name,vnf_interface)
+        vnf_interface = vnf_intf.vnf_interface
 
         try:
             # default port direction to monitor
             if metric is None:
                 metric = 'tx_packets'
 
-            vnf_switch = self.net.DCNetwork_graph.neighbors(str(vnf_name))
-
-            if len(vnf_switch) > 1:
-                logging.info("vnf: {0} has multiple ports".format(vnf_name))
-                return
-            elif len(vnf_switch) == 0:
-                logging.info("vnf: {0} is not connected".format(vnf_name))
-                return
-            else:
-                vnf_switch = vnf_switch[0]
-            next_node = self.net.getNodeByName(vnf_switch)
-
-            if not isinstance(next_node, OVSSwitch):
-                logging.info("vnf: {0} is not connected to switch".format(vnf_name))
-                return
-
-            network_metric['previous_measurement'] = 0
-            network_metric['previous_monitor_time'] = 0
-
-
-            network_metric['switch_dpid'] = int(str(next_node.dpid), 16)
-            network_metric['metric_key'] = metric
-
-            self.monitor_lock.acquire()
-
-            self.network_metrics.append(network_metric)
-            self.monitor_lock.release()
+            network_metric = MonitoredMetric(vnf_name, vnf_interface, metric,
+                                             vnf_intf.switch_dpid, vnf_intf.switch_port_nr, interval=interval,
+                                             history=self.history)
 
+            with self.monitor_lock:
+                self.network_metrics.add(network_metric)
+            self._wakeup_network.set()
 
             logging.info('Started monitoring: {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric))
             return 'Started monitoring: {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric)
@@ -234,198 +204,339 @@ class DCNetworkMonitor():
 
     def stop_metric(self, vnf_name, vnf_interface=None, metric=None):
 
-        for metric_dict in self.network_metrics:
-            #logging.info('start Stopped monitoring: {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric_dict))
-            if metric_dict['vnf_name'] == vnf_name and metric_dict['vnf_interface'] == vnf_interface \
-                    and metric_dict['metric_key'] == metric:
-
-                self.monitor_lock.acquire()
-
-                self.network_metrics.remove(metric_dict)
-
-                #this removes the complete metric, all labels...
-                #REGISTRY.unregister(self.prom_metrics[metric_dict['metric_key']])
-                #self.registry.unregister(self.prom_metrics[metric_dict['metric_key']])
-
-                for collector in self.registry._collectors :
-                    #logging.info('name:{0} labels:{1} metrics:{2}'.format(collector._name, collector._labelnames, collector._metrics))
-                    """
-                    INFO:root:name:sonemu_rx_count_packets
-                    labels:('vnf_name', 'vnf_interface')
-                    metrics:{(u'tsrc', u'output'): < prometheus_client.core.Gauge
-                    object
-                    at
-                    0x7f353447fd10 >}
-                    """
-                    logging.info('{0}'.format(collector._metrics.values()))
-                    #if self.prom_metrics[metric_dict['metric_key']]
-                    if (vnf_name, vnf_interface, 'None') in collector._metrics:
-                        logging.info('2 name:{0} labels:{1} metrics:{2}'.format(collector._name, collector._labelnames,
-                                                                              collector._metrics))
-                        #collector._metrics = {}
-                        collector.remove(vnf_name, vnf_interface, 'None')
-
-                # set values to NaN, prometheus api currently does not support removal of metrics
-                #self.prom_metrics[metric_dict['metric_key']].labels(vnf_name, vnf_interface).set(float('nan'))
-
-                # this removes the complete metric, all labels...
-                # 1 single monitor job for all metrics of the SDN controller
-                # we can only  remove from the pushgateway grouping keys(labels) which we have defined for the add_to_pushgateway
-                # we can not specify labels from the metrics to be removed
-                # if we need to remove the metrics seperatelty, we need to give them a separate grouping key, and probably a diffferent registry also
-                delete_from_gateway(self.pushgateway, job='sonemu-SDNcontroller')
-
-                self.monitor_lock.release()
-
-                logging.info('Stopped monitoring: {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric))
-                return 'Stopped monitoring: {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric)
-
-            # delete everything from this vnf
-            elif metric_dict['vnf_name'] == vnf_name and vnf_interface is None and metric is None:
-                self.monitor_lock.acquire()
-                self.network_metrics.remove(metric_dict)
-                for collector in self.registry._collectors:
-                    collector_dict = collector._metrics.copy()
-                    for name, interface, id in collector_dict:
-                        if name == vnf_name:
-                            logging.info('3 name:{0} labels:{1} metrics:{2}'.format(collector._name, collector._labelnames,
-                                                                           collector._metrics))
-                            collector.remove(name, interface, 'None')
-
-                delete_from_gateway(self.pushgateway, job='sonemu-SDNcontroller')
-                self.monitor_lock.release()
-                logging.info('Stopped monitoring vnf: {0}'.format(vnf_name))
-                return 'Stopped monitoring: {0}'.format(vnf_name)
+        # delete everything from this vnf
+        if vnf_interface is None and metric is None:
+            return self._stop_vnf_metrics(vnf_name)
 
+        with self.monitor_lock:
+            network_metric = self.network_metrics.remove((vnf_name, vnf_interface, metric))
+            if network_metric is None:
+                return
+            self._remove_labels(network_metric)
+
+        self._series_removed()
+
+        logging.info('Stopped monitoring: {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric))
+        return 'Stopped monitoring: {2} on {0}:{1}'.format(vnf_name, vnf_interface, metric)
+
+    def _stop_vnf_metrics(self, vnf_name):
+        """
+        Stop all monitored metrics and flows of a vnf, e.g. when it is removed.
+        The metric tables are indexed by vnf, each metric owns one label set of its gauge.
+        """
+        with self.monitor_lock:
+            found = [self.network_metrics.remove(key) for key in self.network_metrics.keys_of_vnf(vnf_name)]
+            for network_metric in found:
+                self._remove_labels(network_metric)
+        with self.monitor_flow_lock:
+            found_flows = [self.flow_metrics.remove(key) for key in self.flow_metrics.keys_of_vnf(vnf_name)]
+            for flow_metric in found_flows:
+                self._remove_labels(flow_metric)
+        if len(found) + len(found_flows) < 1:
+            return
+
+        self._series_removed()
+        logging.info('Stopped monitoring vnf: {0}'.format(vnf_name))
+        return 'Stopped monitoring: {0}'.format(vnf_name)
+
+
+    def _remove_labels(self, metric):
+        """
+        Remove the label set of a stopped metric from its gauge.
+        Has to be called with the lock of the metric table held.
+        """
+        gauge = self.prom_metrics.get(metric.metric_key)
+        if gauge is None:
+            return
+        try:
+            gauge.remove(*metric.labels())
+        except KeyError:
+            # the metric was not polled yet
+            pass
+
+    def _series_removed(self):
+        """
+        The next push replaces the job in the Pushgateway, so that the removed series disappear there as well.
+        The polling threads are woken up to push even if no metric is due.
+        """
+        self._removed_series = True
+        self._wakeup_network.set()
+        self._wakeup_flow.set()
 
     # get all metrics defined in the list and export it to Prometheus
     def get_flow_metrics(self):
-        while self.start_monitoring:
-
-            self.monitor_flow_lock.acquire()
-
-            for flow_dict in self.flow_metrics:
-                data = {}
-
-                data['cookie'] = flow_dict['cookie']
-
-                if 'tx' in flow_dict['metric_key']:
-                    data['match'] = {'in_port':flow_dict['mon_port']}
-                elif 'rx' in flow_dict['metric_key']:
-                    data['out_port'] = flow_dict['mon_port']
-
-
-                # query Ryu
-                ret = self.net.ryu_REST('stats/flow', dpid=flow_dict['switch_dpid'], data=data)
-                flow_stat_dict = ast.literal_eval(ret)
-
-                #logging.info('received flow stat:{0} '.format(flow_stat_dict))
-                self.set_flow_metric(flow_dict, flow_stat_dict)
-
-            self.monitor_flow_lock.release()
-            time.sleep(1)
+        self._poll_loop(self.flow_metrics, self.monitor_flow_lock, self.flow_scheduler,
+                        self._wakeup_flow, self._poll_flow_stats)
 
     def get_network_metrics(self):
+        self._poll_loop(self.network_metrics, self.monitor_lock, self.network_scheduler,
+                        self._wakeup_network, self._poll_port_stats)
+
+    def _poll_loop(self, table, lock, scheduler, wakeup, poll_switch):
+        """
+        Poll the switches whose metrics are due, until the monitor is stopped.
+        :param table: MetricTable with the monitored metrics
+        :param lock: lock of the table
+        :param scheduler: PollScheduler of the table
+        :param wakeup: event that is set when metrics are added or the monitor is stopped
+        :param poll_switch: function(dpid, metrics) that queries one switch
+        """
         while self.start_monitoring:
+            wakeup.clear()
+
+            # snapshot of the monitored metrics per switch, the tuples are never changed
+            with lock:
+                metrics_by_dpid = table.by_dpid()
+
+            cycle_start = time.time()
+            due = scheduler.due(metrics_by_dpid, cycle_start)
+            for dpid, metrics in due.iteritems():
+                start = time.time()
+                try:
+                    poll_switch(dpid, metrics)
+                except Exception:
+                    # one failing switch must not stop the monitoring of the others
+                    logging.exception('polling switch {0} failed'.format(dpid))
+                scheduler.polled(dpid, metrics, time.time() - start, time.time())
+
+            if len(due) > 0:
+                scheduler.cycle_done(time.time() - cycle_start)
+                self.prom_cycle_duration.labels(scheduler.name).set(scheduler.last_cycle_duration)
+                self.prom_missed_deadlines.labels(scheduler.name).set(scheduler.missed_deadlines)
+            if len(due) > 0 or self._removed_series:
+                # all updates of this cycle are pushed at once
+                try:
+                    self.push_metrics()
+                except Exception:
+                    logging.exception('pushing the metrics failed')
+
+            wakeup.wait(scheduler.next_wakeup(metrics_by_dpid, time.time()))
+
+    def _poll_flow_stats(self, dpid, flow_metrics):
+        # all flow stats of a switch are queried at once
+        ret = self.net.ryu_REST('stats/flow', dpid=dpid)
+        if ret is None:
+            return
+        flow_stats = ryustats.parse_flow_stats(ret, dpid)
+        if flow_stats is None:
+            return
+
+        #logging.info('received flow stat:{0} '.format(flow_stats))
+        for flow_metric in flow_metrics:
+            self.set_flow_metric(flow_metric, flow_stats)
+
+    def _poll_port_stats(self, dpid, network_metrics):
+        # metrics are grouped by dpid to optimize the rest api calls
+        ret = self.net.ryu_REST('stats/port', dpid=dpid)
+        if ret is None:
+            return
+        # decode the reply once and index the monitored ports
+        port_stats = ryustats.parse_port_stats(
+            ret, dpid, ports=set(int(network_metric.mon_port) for network_metric in network_metrics))
+        if port_stats is None:
+            return
+
+        for network_metric in network_metrics:
+            self.set_network_metric(network_metric, port_stats)
+
+    def query_metric(self, vnf_name, vnf_interface=None, metric='tx_packets', cookie=None, window=None,
+                     include_samples=False):
+        """
+        Latest counter value and rate of a monitored metric, read from the samples kept by the monitor
+        (no Prometheus server needed).
+        :param vnf_name: name of the vnf
+        :param vnf_interface: interface id, the first interface of the vnf is used if None
+        :param metric: tx_bytes, rx_bytes, tx_packets, rx_packets
+        :param cookie: cookie of a monitored flow (see setup_flow), None for an interface metric (see setup_metric)
+        :param window: if given, also return the average rate over the last window seconds
+        :param include_samples: also return the samples (of the window) as list 'series'
+        :return: dict with the values or message string if the metric is not monitored
+        """
+        if vnf_interface is None:
+            vnf_intf = self.net.getVnfInterface(vnf_name)
+            if vnf_intf is not None:
+                vnf_interface = vnf_intf.vnf_interface
 
-            self.monitor_lock.acquire()
-
-            # group metrics by dpid to optimize the rest api calls
-            dpid_list = [metric_dict['switch_dpid'] for metric_dict in self.network_metrics]
-            dpid_set = set(dpid_list)
-
-            for dpid in dpid_set:
-
-                # query Ryu
-                ret = self.net.ryu_REST('stats/port', dpid=dpid)
-                port_stat_dict = ast.literal_eval(ret)
-
-                metric_list = [metric_dict for metric_dict in self.network_metrics
-                               if int(metric_dict['switch_dpid'])==int(dpid)]
-                #logging.info('1set prom packets:{0} '.format(self.network_metrics))
-                for metric_dict in metric_list:
-                    self.set_network_metric(metric_dict, port_stat_dict)
-
-            self.monitor_lock.release()
-            time.sleep(1)
+        if cookie is None:
+            with self.monitor_lock:
+                monitored = self.network_metrics.get((vnf_name, vnf_interface, metric))
+        else:
+            with self.monitor_flow_lock:
+                monitored = self.flow_metrics.get((vnf_name, vnf_interface, metric, cookie))
+        if monitored is None:
+            logging.info('metric {2} on {0}:{1} is not monitored'.format(vnf_name, vnf_interface, metric))
+            return 'metric {2} on {0}:{1} is not monitored'.format(vnf_name, vnf_interface, metric)
+
+        result = {'vnf_name': vnf_name, 'vnf_interface': vnf_interface, 'metric': metric, 'cookie': cookie,
+                  'time': None, 'counter': None, 'rate': None, 'samples': len(monitored.series)}
+        latest = monitored.series.latest()
+        if latest is not None:
+            result.update(latest)
+        if window is not None:
+            result['window'] = float(window)
+            result['average_rate'] = monitored.series.average_rate(float(window))
+        if include_samples:
+            result['series'] = monitored.series.samples(None if window is None else float(window))
+        return result
+
+    def get_scheduler_stats(self):
+        """
+        Counters of the polling threads.
+        """
+        return {"network": self.network_scheduler.get_stats(),
+                "flow": self.flow_scheduler.get_stats()}
 
     # add metric to the list to export to Prometheus, parse the Ryu port-stats reply
-    def set_network_metric(self, metric_dict, port_stat_dict):
+    def set_network_metric(self, network_metric, port_stats):
+        """
+        :param network_metric: MonitoredMetric of network_metrics
+        :param port_stats: decoded port-stats reply of the switch, indexed by port number
+        """
         # vnf tx is the datacenter switch rx and vice-versa
-        metric_key = self.switch_tx_rx(metric_dict['metric_key'])
-        switch_dpid = metric_dict['switch_dpid']
-        vnf_name = metric_dict['vnf_name']
-        vnf_interface = metric_dict['vnf_interface']
-        previous_measurement = metric_dict['previous_measurement']
-        previous_monitor_time = metric_dict['previous_monitor_time']
-        mon_port = metric_dict['mon_port']
-
-        for port_stat in port_stat_dict[str(switch_dpid)]:
-            if int(port_stat['port_no']) == int(mon_port):
-                port_uptime = port_stat['duration_sec'] + port_stat['duration_nsec'] * 10 ** (-9)
-                this_measurement = int(port_stat[metric_key])
-                #logging.info('set prom packets:{0} {1}:{2}'.format(this_measurement, vnf_name, vnf_interface))
-
-                # set prometheus metric
-                self.prom_metrics[metric_dict['metric_key']].\
+        metric_key = self.switch_tx_rx(network_metric.metric_key)
+        vnf_name = network_metric.vnf_name
+        vnf_interface = network_metric.vnf_interface
+
+        port_stat = port_stats.get(int(network_metric.mon_port))
+        if port_stat is not None and metric_key in port_stat:
+            port_uptime = ryustats.uptime(port_stat)
+            this_measurement = int(port_stat[metric_key])
+            #logging.info('set prom packets:{0} {1}:{2}'.format(this_measurement, vnf_name, vnf_interface))
+
+            # set prometheus metric, unless the metric was stopped while we were polling
+            with self.monitor_lock:
+                if self.network_metrics.get(network_metric.key) is not network_metric:
+                    return
+                self.prom_metrics[network_metric.metric_key].\
                     labels({'vnf_name': vnf_name, 'vnf_interface': vnf_interface, 'flow_id': None}).\
                     set(this_measurement)
-                #push_to_gateway(self.pushgateway, job='SDNcontroller',
-                #                grouping_key={'metric':metric_dict['metric_key']}, registry=self.registry)
-
-                # 1 single monitor job for all metrics of the SDN controller
-                pushadd_to_gateway(self.pushgateway, job='sonemu-SDNcontroller', registry=self.registry)
-
-                if previous_monitor_time <= 0 or previous_monitor_time >= port_uptime:
-                    metric_dict['previous_measurement'] = int(port_stat[metric_key])
-                    metric_dict['previous_monitor_time'] = port_uptime
-                    # do first measurement
-                    #logging.info('first measurement')
-                    time.sleep(1)
-                    self.monitor_lock.release()
-
-                    metric_rate = self.get_network_metrics()
-                    return metric_rate
-
-                else:
-                    time_delta = (port_uptime - metric_dict['previous_monitor_time'])
-                    metric_rate = (this_measurement - metric_dict['previous_measurement']) / float(time_delta)
-                    #logging.info('metric: {0} rate:{1}'.format(metric_dict['metric_key'], metric_rate))
-
-                metric_dict['previous_measurement'] = this_measurement
-                metric_dict['previous_monitor_time'] = port_uptime
-                return metric_rate
+            # the metrics are pushed to the gateway once at the end of the polling cycle
+            return self.update_rate(network_metric, this_measurement, port_uptime)
 
         logging.exception('metric {0} not found on {1}:{2}'.format(metric_key, vnf_name, vnf_interface))
         return 'metric {0} not found on {1}:{2}'.format(metric_key, vnf_name, vnf_interface)
 
-    def set_flow_metric(self, metric_dict, flow_stat_dict):
+    def set_flow_metric(self, flow_metric, flow_stats):
+        """
+        :param flow_metric: MonitoredMetric of flow_metrics
+        :param flow_stats: decoded flow-stats reply of the switch, grouped by cookie
+        """
         # vnf tx is the datacenter switch rx and vice-versa
-        #metric_key = self.switch_tx_rx(metric_dict['metric_key'])
-        metric_key = metric_dict['metric_key']
-        switch_dpid = metric_dict['switch_dpid']
-        vnf_name = metric_dict['vnf_name']
-        vnf_interface = metric_dict['vnf_interface']
-        previous_measurement = metric_dict['previous_measurement']
-        previous_monitor_time = metric_dict['previous_monitor_time']
-        cookie = metric_dict['cookie']
-
-        # TODO aggregate all found flow stats
-        flow_stat = flow_stat_dict[str(switch_dpid)][0]
+        #metric_key = self.switch_tx_rx(flow_metric.metric_key)
+        metric_key = flow_metric.metric_key
+        cookie = flow_metric.cookie
+
+        # sum up all flow entries of the cookie that match on (tx) or output to (rx) the monitored port
+        entries = flow_stats.get(int(cookie or 0), [])
+        if 'tx' in metric_key:
+            aggregate = ryustats.aggregate_flow_stats(entries, in_port=flow_metric.mon_port)
+        else:
+            aggregate = ryustats.aggregate_flow_stats(entries, out_port=flow_metric.mon_port)
+        if aggregate is None:
+            return
+        byte_count, packet_count, flow_uptime = aggregate
         if 'bytes' in  metric_key:
-            counter = flow_stat['byte_count']
-        elif 'packet' in metric_key:
-            counter = flow_stat['packet_count']
-
-        flow_uptime = flow_stat['duration_sec'] + flow_stat['duration_nsec'] * 10 ** (-9)
-
-        self.prom_metrics[metric_dict['metric_key']]. \
-            labels({'vnf_name': vnf_name, 'vnf_interface': vnf_interface, 'flow_id': cookie}). \
-            set(counter)
-        pushadd_to_gateway(self.pushgateway, job='sonemu-SDNcontroller', registry=self.registry)
+            counter = byte_count
+        else:
+            counter = packet_count
 
-        #logging.exception('metric {0} not found on {1}:{2}'.format(metric_key, vnf_name, vnf_interface))
-        #return 'metric {0} not found on {1}:{2}'.format(metric_key, vnf_name, vnf_interface)
+        # set prometheus metric, unless the flow was stopped while we were polling
+        with self.monitor_flow_lock:
+            if self.flow_metrics.get(flow_metric.key) is not flow_metric:
+                return
+            self.prom_metrics[metric_key]. \
+                labels({'vnf_name': flow_metric.vnf_name, 'vnf_interface': flow_metric.vnf_interface,
+                        'flow_id': cookie}). \
+                set(counter)
+
+        return self.update_rate(flow_metric, counter, flow_uptime)
+
+    def push_metrics(self):
+        """
+        Push the metrics to the Pushgateway, called once per polling cycle.
+        1 single monitor job for all metrics of the SDN controller.
+        After series were removed, the job is replaced (PUT) instead of being
+        added to, the other series stay available in the gateway.
+        """
+        if not self.push:
+            return
+        with self._push_lock:
+            try:
+                if self._removed_series:
+                    self._removed_series = False
+                    try:
+                        push_to_gateway(self.pushgateway, job='sonemu-SDNcontroller', registry=self.registry)
+                    except Exception:
+                        # try again with the next push
+                        self._removed_series = True
+                        raise
+                    if self.push_delta:
+                        self._pushed_families = dict((family.name, list(family.samples))
+                                                     for family in self.registry.collect())
+                    return
+                if not self.push_delta:
+                    pushadd_to_gateway(self.pushgateway, job='sonemu-SDNcontroller', registry=self.registry)
+                    return
+                # pushadd only replaces the metric families that are pushed, so the unchanged ones can be left out
+                changed = _ChangedFamilies(self.registry, self._pushed_families)
+                if len(changed.families) < 1:
+                    return
+                pushadd_to_gateway(self.pushgateway, job='sonemu-SDNcontroller', registry=changed)
+                self._pushed_families.update(changed.samples)
+            except Exception as ex:
+                logging.info('push to gateway failed: {0}'.format(ex))
+
+    def delete_from_gateway(self):
+        """
+        Remove the job of the SDN controller metrics from the Pushgateway.
+        """
+        if not self.push:
+            return
+        with self._push_lock:
+            # everything has to be pushed again by the next delta push
+            self._pushed_families = dict()
+            try:
+                delete_from_gateway(self.pushgateway, job='sonemu-SDNcontroller')
+            except Exception as ex:
+                logging.info('delete from gateway failed: {0}'.format(ex))
+
+    def start_metrics_server(self, port):
+        """
+        Serve the metrics of the registry over HTTP, so that Prometheus can scrape them.
+        """
+        class MetricsHandler(_MetricsHandler):
+            registry = self.registry
+
+        server = _ThreadingHTTPServer(('', port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logging.info('Serving metrics on port {0}'.format(port))
+        return server
+
+    def update_rate(self, metric, this_measurement, uptime):
+        """
+        Calculate the rate of a metric from the previous and the current sample.
+        The first sample only sets the baseline, the rate is available from
+        the next polling cycle on. The same happens if the counter or the
+        uptime of the port/flow was reset in the meantime.
+        :param metric: MonitoredMetric of network_metrics or flow_metrics
+        :param this_measurement: current value of the counter
+        :param uptime: current uptime of the port/flow in seconds
+        :return: rate per second or None if only the baseline was set
+        """
+        previous_monitor_time = metric.previous_monitor_time
+        previous_measurement = metric.previous_measurement
+        metric_rate = None
+        if 0 < previous_monitor_time < uptime and previous_measurement <= this_measurement:
+            time_delta = uptime - previous_monitor_time
+            metric_rate = (this_measurement - previous_measurement) / float(time_delta)
+            #logging.info('metric: {0} rate:{1}'.format(metric.metric_key, metric_rate))
+
+        metric.previous_measurement = this_measurement
+        metric.previous_monitor_time = uptime
+        metric.series.append(time.time(), this_measurement, uptime, metric_rate)
+        return metric_rate
 
     def query_Prometheus(self, query):
         '''
@@ -438,8 +549,8 @@ class DCNetworkMonitor():
         #logging.info('query:{0}'.format(url))
         req = urllib2.Request(url)
         ret = urllib2.urlopen(req).read()
-        ret = ast.literal_eval(ret)
-        if ret['status'] == 'success':
+        ret = ryustats.decode(ret)
+        if ret is not None and ret['status'] == 'success':
             #logging.info('return:{0}'.format(ret))
             try:
                 ret = ret['data']['result'][0]['value']
@@ -493,8 +604,16 @@ class DCNetworkMonitor():
     def stop(self):
         # stop the monitoring thread
         self.start_monitoring = False
+        self._wakeup_network.set()
+        self._wakeup_flow.set()
         self.monitor_thread.join()
         self.monitor_flow_thread.join()
+        if self.cgroup_sampler is not None:
+            self.cgroup_sampler.stop()
+
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
 
         '''
         if self.prometheus_process is not None:
@@ -549,17 +668,30 @@ class DCNetworkMonitor():
             stdin, stdout, stderr = ssh.exec_command(iperf_cmd)
 
         start_time = time.time()
-        query_cpu = '(sum(rate(container_cpu_usage_seconds_total{{id="/docker/{0}"}}[{1}s])))'.format(vnf_uuid, 1)
         while (time.time() - start_time) < 15:
-            data = self.query_Prometheus(query_cpu)
-            # logging.info('rate: {1} data:{0}'.format(data, rate))
             gevent.sleep(0)
             time.sleep(1)
 
-        query_cpu2 = '(sum(rate(container_cpu_usage_seconds_total{{id="/docker/{0}"}}[{1}s])))'.format(vnf_uuid, 8)
-        cpu_load = float(self.query_Prometheus(query_cpu2)[1])
-        output = 'rate: {1}Mbps; cpu_load: {0}%'.format(round(cpu_load * 100, 2), rate)
-        output_line = output
+        # cpu load over the last 8 seconds, from the cgroup samples or from cAdvisor
+        cpu_load = None
+        if self.cgroup_sampler is not None:
+            cpu_load = self.cgroup_sampler.get_cpu_load(vnf_uuid, window=8)
+        if cpu_load is None:
+            query_cpu2 = '(sum(rate(container_cpu_usage_seconds_total{{id="/docker/{0}"}}[{1}s])))'.format(vnf_uuid, 8)
+            try:
+                ret = self.query_Prometheus(query_cpu2)
+            except urllib2.URLError as ex:
+                logging.info('Prometheus query failed: {0}'.format(ex))
+                ret = None
+            if ret is not None:
+                cpu_load = float(ret[1])
+        if cpu_load is None and self.cgroup_sampler is not None:
+            # not enough samples in the window, use the load of the last sampling interval
+            cpu_load = self.cgroup_sampler.get_cpu_load(vnf_uuid)
+        if cpu_load is None:
+            output_line = 'rate: {1}Mbps; cpu_load of {0} not found'.format(vnf_uuid, rate)
+        else:
+            output_line = 'rate: {1}Mbps; cpu_load: {0}%'.format(round(cpu_load * 100, 2), rate)
         logging.info(output_line)
 
         stop_iperf = 'pkill -9 iperf'
@@ -567,3 +699,484 @@ class DCNetworkMonitor():
 
         return output_line
 
+
+class MonitoredMetric(object):
+    """
+    A monitored port counter (network metric) or flow counter (flow metric, with cookie).
+    """
+    __slots__ = ('vnf_name', 'vnf_interface', 'metric_key', 'cookie', 'switch_dpid', 'mon_port',
+                 'previous_measurement', 'previous_monitor_time', 'interval', 'next_poll', 'series')
+
+    def __init__(self, vnf_name, vnf_interface, metric_key, switch_dpid, mon_port, cookie=None, interval=None,
+                 history=300):
+        self.vnf_name = vnf_name
+        self.vnf_interface = vnf_interface
+        self.metric_key = metric_key
+        self.cookie = cookie
+        self.switch_dpid = switch_dpid
+        self.mon_port = mon_port
+        self.previous_measurement = 0
+        self.previous_monitor_time = 0
+        # polling interval (None: default of the monitor) and deadline of the next poll (0: not scheduled yet)
+        self.interval = interval
+        self.next_poll = 0
+        # the last samples of the counter and its rate
+        self.series = MetricSeries(history)
+
+    @property
+    def key(self):
+        if self.cookie is None:
+            return self.vnf_name, self.vnf_interface, self.metric_key
+        return self.vnf_name, self.vnf_interface, self.metric_key, self.cookie
+
+    def labels(self):
+        """
+        Label values of the Prometheus gauge (vnf_name, vnf_interface, flow_id).
+        """
+        return unicode(self.vnf_name), unicode(self.vnf_interface), unicode(self.cookie)
+
+
+class MetricSeries(object):
+    """
+    Ring buffer with the last samples of a monitored counter: time of the
+    poll, counter value, uptime of the port/flow and rate (NaN if unknown).
+    The memory is allocated once (arrays of doubles), the oldest samples are
+    overwritten. Written by the polling thread, read by the API threads.
+    """
+
+    def __init__(self, size=300):
+        self.size = max(int(size), 1)
+        self._time = array('d', [0.0]) * self.size
+        self._counter = array('d', [0.0]) * self.size
+        self._uptime = array('d', [0.0]) * self.size
+        self._rate = array('d', [0.0]) * self.size
+        # position of the next sample and number of valid samples
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, counter, uptime, rate=None):
+        with self._lock:
+            i = self._next
+            self._time[i] = timestamp
+            self._counter[i] = counter
+            self._uptime[i] = uptime
+            self._rate[i] = float('nan') if rate is None else rate
+            self._next = (i + 1) % self.size
+            self._count = min(self._count + 1, self.size)
+
+    def _indexes(self, since=None):
+        """
+        Positions of the samples, newest first. Has to be called with the lock held.
+        """
+        result = []
+        for n in xrange(self._count):
+            i = (self._next - 1 - n) % self.size
+            if since is not None and self._time[i] < since:
+                break
+            result.append(i)
+        return result
+
+    def _sample(self, i):
+        rate = self._rate[i]
+        return {'time': self._time[i],
+                'counter': int(self._counter[i]),
+                'rate': None if rate != rate else rate}
+
+    def latest(self):
+        """
+        :return: dict with time, counter and rate of the newest sample or None
+        """
+        with self._lock:
+            if self._count < 1:
+                return None
+            return self._sample((self._next - 1) % self.size)
+
+    def samples(self, window=None, now=None):
+        """
+        :param window: only the samples of the last window seconds, all samples if None
+        :return: list of sample dicts, oldest first
+        """
+        since = None
+        if window is not None:
+            since = (time.time() if now is None else now) - window
+        with self._lock:
+            return [self._sample(i) for i in reversed(self._indexes(since))]
+
+    def average_rate(self, window, now=None):
+        """
+        Average rate over the samples of the last window seconds (increase of
+        the counter divided by the increase of the uptime). Intervals in which
+        the counter or the uptime was reset are left out.
+        :return: rate per second or None if there are not enough samples in the window
+        """
+        since = (time.time() if now is None else now) - window
+        delta_counter = 0.0
+        delta_time = 0.0
+        with self._lock:
+            indexes = self._indexes(since)
+            for newer, older in zip(indexes, indexes[1:]):
+                counter = self._counter[newer] - self._counter[older]
+                uptime = self._uptime[newer] - self._uptime[older]
+                if counter >= 0 and uptime > 0:
+                    delta_counter += counter
+                    delta_time += uptime
+        if delta_time <= 0:
+            return None
+        return delta_counter / delta_time
+
+    def __len__(self):
+        return self._count
+
+
+class CgroupSampler(object):
+    """
+    Samples the cpu and memory usage of all compute instances of the DCNetwork
+    from their cgroup files and exports them to the registry of the monitor
+    (instead of running cAdvisor). The files of a container are opened once,
+    all containers are read in one pass per interval.
+    """
+
+    def __init__(self, net, registry, interval=1.0, history=300, on_sample=None):
+        """
+        :param net: the DCNetwork
+        :param registry: Prometheus registry of the monitor
+        :param interval: sampling interval in seconds
+        :param history: number of cpu samples kept per container
+        :param on_sample: called after each sampling cycle (e.g. to push the metrics)
+        """
+        self.net = net
+        self.interval = interval
+        self.history = history
+        self.on_sample = on_sample
+        self.prom_cpu_usage = Gauge('sonemu_container_cpu_usage_seconds', 'Total cpu time consumed by the container',
+                                    ['vnf_name'], registry=registry)
+        self.prom_cpu_load = Gauge('sonemu_container_cpu_load', 'Cpu usage of the container (1.0 = one core)',
+                                   ['vnf_name'], registry=registry)
+        self.prom_memory_usage = Gauge('sonemu_container_memory_usage_bytes', 'Memory usage of the container',
+                                       ['vnf_name'], registry=registry)
+        # container id -> _SampledContainer
+        self._containers = dict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            start = time.time()
+            try:
+                if self.sample() > 0 and self.on_sample is not None:
+                    self.on_sample()
+            except Exception:
+                logging.exception('cgroup sampling failed')
+            self._stopped.wait(max(self.interval - (time.time() - start), 0))
+
+    def _sync(self):
+        """
+        Open the files of new containers and close the ones of removed containers.
+        """
+        current = dict()
+        for dc in self.net.dcs.values():
+            for c in dc.containers.values():
+                did = c.dcinfo.get('Id')
+                if did is not None:
+                    current[did] = c
+        with self._lock:
+            removed = [self._containers.pop(did) for did in self._containers.keys() if did not in current]
+            added = [did for did in current if did not in self._containers]
+        for sampled in removed:
+            sampled.reader.close()
+            for gauge in [self.prom_cpu_usage, self.prom_cpu_load, self.prom_memory_usage]:
+                try:
+                    gauge.remove(sampled.name)
+                except KeyError:
+                    pass
+        for did in added:
+            c = current[did]
+            reader = CgroupReader(did, pid=c.dcinfo.get('State', {}).get('Pid'))
+            with self._lock:
+                self._containers[did] = _SampledContainer(c.name, reader, MetricSeries(self.history))
+
+    def sample(self):
+        """
+        Read the usage of all containers once.
+        :return: number of sampled containers
+        """
+        self._sync()
+        with self._lock:
+            containers = self._containers.values()
+        count = 0
+        for sampled in containers:
+            cpu, memory = sampled.reader.read()
+            now = time.time()
+            if cpu is not None:
+                # load in cores since the previous sample
+                load = None
+                previous = sampled.cpu.latest()
+                if previous is not None and now > previous['time'] and cpu >= previous['counter']:
+                    load = (cpu - previous['counter']) / (now - previous['time']) * 10 ** (-9)
+                sampled.cpu.append(now, cpu, now, load)
+                self.prom_cpu_usage.labels(sampled.name).set(cpu * 10 ** (-9))
+                if load is not None:
+                    self.prom_cpu_load.labels(sampled.name).set(load)
+            if memory is not None:
+                sampled.memory = memory
+                self.prom_memory_usage.labels(sampled.name).set(memory)
+            if cpu is not None or memory is not None:
+                count += 1
+        return count
+
+    def _find(self, container):
+        with self._lock:
+            sampled = self._containers.get(container)
+            if sampled is not None:
+                return sampled
+            for sampled in self._containers.itervalues():
+                if sampled.name == container:
+                    return sampled
+        return None
+
+    def get_cpu_load(self, container, window=None):
+        """
+        :param container: name or Docker id of the container
+        :param window: average over the last window seconds, the load of the last interval if None
+        :return: cpu load in cores or None if not sampled (yet)
+        """
+        sampled = self._find(container)
+        if sampled is None:
+            return None
+        if window is None:
+            latest = sampled.cpu.latest()
+            return None if latest is None else latest['rate']
+        rate = sampled.cpu.average_rate(window)
+        return None if rate is None else rate * 10 ** (-9)
+
+    def get_memory_usage(self, container):
+        """
+        :return: memory usage in bytes of the last sample or None
+        """
+        sampled = self._find(container)
+        return None if sampled is None else sampled.memory
+
+    def stop(self):
+        self._stopped.set()
+        self.thread.join()
+        with self._lock:
+            for sampled in self._containers.itervalues():
+                sampled.reader.close()
+            self._containers = dict()
+
+
+class _SampledContainer(object):
+    __slots__ = ('name', 'reader', 'cpu', 'memory')
+
+    def __init__(self, name, reader, cpu):
+        self.name = name
+        self.reader = reader
+        # cpu time in ns with the load in cores as rate
+        self.cpu = cpu
+        self.memory = None
+
+
+class MetricTable(object):
+    """
+    Monitored metrics indexed by key, by vnf and by switch dpid.
+    Changes have to be serialized by the caller. The per-dpid tuples are
+    replaced instead of being modified, so a copy of by_dpid() can be used
+    without holding a lock.
+    """
+
+    def __init__(self):
+        self._by_key = dict()
+        self._keys_by_vnf = dict()
+        self._by_dpid = dict()
+
+    def add(self, metric):
+        # the same metric is only monitored once
+        self.remove(metric.key)
+        self._by_key[metric.key] = metric
+        self._keys_by_vnf.setdefault(metric.vnf_name, set()).add(metric.key)
+        dpid = int(metric.switch_dpid)
+        self._by_dpid[dpid] = self._by_dpid.get(dpid, ()) + (metric,)
+
+    def get(self, key):
+        return self._by_key.get(key)
+
+    def remove(self, key):
+        """
+        :return: the removed metric or None
+        """
+        metric = self._by_key.pop(key, None)
+        if metric is None:
+            return None
+        keys = self._keys_by_vnf[metric.vnf_name]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_vnf[metric.vnf_name]
+        dpid = int(metric.switch_dpid)
+        metrics = tuple(m for m in self._by_dpid[dpid] if m is not metric)
+        if metrics:
+            self._by_dpid[dpid] = metrics
+        else:
+            del self._by_dpid[dpid]
+        return metric
+
+    def keys_of_vnf(self, vnf_name):
+        return list(self._keys_by_vnf.get(vnf_name, []))
+
+    def by_dpid(self):
+        """
+        :return: copy of the dict dpid -> tuple of metrics
+        """
+        return dict(self._by_dpid)
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def __iter__(self):
+        return self._by_key.itervalues()
+
+
+class PollScheduler(object):
+    """
+    Deadline based scheduling of the polling of monitored metrics.
+
+    The next deadline of a metric is its previous deadline plus its
+    interval, so the polling period does not drift with the duration of
+    the REST calls. If a deadline is missed by more than one interval, it is
+    not caught up, the metric continues one interval from now.
+    Switches whose requests get slow are polled less often: the interval
+    is stretched to latency_factor times the (moving average) request
+    latency of the switch, up to max_interval. Each switch starts with a
+    random phase, so that the switches are not all queried at the same time.
+    """
+
+    def __init__(self, name, interval=1.0, max_interval=10.0, jitter=0.5, latency_factor=10.0, alpha=0.3):
+        """
+        :param name: name of the poller, used as label of the exported counters
+        :param interval: default polling interval in seconds
+        :param max_interval: upper bound of the stretched interval
+        :param jitter: fraction of the interval used to spread the switches
+        :param latency_factor: min. ratio between the interval and the request latency of a switch
+        :param alpha: weight of the newest latency sample in the moving average
+        """
+        self.name = name
+        self.interval = interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.latency_factor = latency_factor
+        self.alpha = alpha
+        # dpid -> moving average of the request latency
+        self._latency = dict()
+        # dpid -> phase of the switch
+        self._phase = dict()
+        # counters
+        self.cycles = 0
+        self.missed_deadlines = 0
+        self.last_cycle_duration = 0.0
+
+    def effective_interval(self, metric):
+        interval = metric.interval or self.interval
+        latency = self._latency.get(int(metric.switch_dpid), 0.0)
+        return min(max(interval, latency * self.latency_factor), max(interval, self.max_interval))
+
+    def due(self, metrics_by_dpid, now):
+        """
+        :param metrics_by_dpid: dict dpid -> monitored metrics of the switch
+        :return: dict dpid -> list of the metrics that have to be polled now
+        """
+        # forget the switches that are no longer monitored
+        for dpid in [dpid for dpid in self._phase if dpid not in metrics_by_dpid]:
+            del self._phase[dpid]
+            self._latency.pop(dpid, None)
+        result = dict()
+        for dpid, metrics in metrics_by_dpid.iteritems():
+            if dpid not in self._phase:
+                self._phase[dpid] = random.uniform(0, self.jitter * self.interval)
+            due = []
+            for metric in metrics:
+                if metric.next_poll <= 0:
+                    # new metric
+                    metric.next_poll = now + self._phase[dpid]
+                if metric.next_poll <= now:
+                    due.append(metric)
+            if len(due) > 0:
+                result[dpid] = due
+        return result
+
+    def polled(self, dpid, metrics, latency, now):
+        """
+        Update the latency of the switch and the deadlines of the polled metrics.
+        """
+        previous = self._latency.get(dpid)
+        if previous is None:
+            self._latency[dpid] = latency
+        else:
+            self._latency[dpid] = self.alpha * latency + (1 - self.alpha) * previous
+        for metric in metrics:
+            interval = self.effective_interval(metric)
+            metric.next_poll += interval
+            if metric.next_poll <= now:
+                self.missed_deadlines += 1
+                metric.next_poll = now + interval
+
+    def cycle_done(self, duration):
+        self.cycles += 1
+        self.last_cycle_duration = duration
+
+    def next_wakeup(self, metrics_by_dpid, now):
+        """
+        :return: time in seconds until the next metric is due
+        """
+        deadlines = [metric.next_poll for metrics in metrics_by_dpid.itervalues() for metric in metrics
+                     if metric.next_poll > 0]
+        if len(deadlines) < 1:
+            return self.interval
+        return min(max(min(deadlines) - now, 0), self.max_interval)
+
+    def get_stats(self):
+        return {"cycles": self.cycles,
+                "missed_deadlines": self.missed_deadlines,
+                "last_cycle_duration": self.last_cycle_duration,
+                "latency": dict(self._latency)}
+
+
+class _ChangedFamilies(object):
+    """
+    Registry-like object that only collects the metric families whose samples
+    changed since the last push (used for delta pushes).
+    """
+
+    def __init__(self, registry, pushed_families):
+        self.families = []
+        self.samples = dict()
+        for family in registry.collect():
+            samples = list(family.samples)
+            if pushed_families.get(family.name) != samples:
+                self.families.append(family)
+                self.samples[family.name] = samples
+
+    def collect(self):
+        return self.families
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answers every GET request with the metrics of the registry in the Prometheus text format.
+    """
+    registry = None
+
+    def do_GET(self):
+        output = generate_latest(self.registry)
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE_LATEST)
+        self.end_headers()
+        self.wfile.write(output)
+
+    def log_message(self, format, *args):
+        return
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
@@ -6,11 +6,12 @@ import logging
 
 import site
 import time
-from subprocess import Popen
+from subprocess import Popen, PIPE, STDOUT
 import os
 import re
-import urllib2
 from functools import partial
+from multiprocessing.pool import ThreadPool
+from collections import namedtuple, OrderedDict
 
 from mininet.net import Containernet
 from mininet.node import Controller, DefaultController, OVSSwitch, OVSKernelSwitch, Docker, RemoteController
@@ -18,8 +19,258 @@ from mininet.cli import CLI
 from mininet.link import TCLink
 import networkx as nx
 from emuvim.dcemulator.monitoring import DCNetworkMonitor
-from emuvim.dcemulator.node import Datacenter, EmulatorCompute
+from emuvim.dcemulator.node import Datacenter, EmulatorCompute, start_compute_batch
 from emuvim.dcemulator.resourcemodel import ResourceModelRegistrar
+from emuvim.dcemulator.restclient import RestClient
+from emuvim.dcemulator.vlan import VlanAllocator
+
+
+class PathCache(object):
+    """
+    Cache for the shortest paths computed on a graph.
+    Entries are keyed by (src, dst, weight) and are only invalidated
+    if a change of the graph can affect them.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self._paths = dict()
+        # node name -> keys of all cached paths that traverse this node
+        self._keys_by_node = dict()
+
+    def shortest_path(self, src, dst, weight=None):
+        """
+        Return the cached shortest path or compute it.
+        Raises the networkx exceptions if no path exists.
+        """
+        key = (src, dst, weight)
+        path = self._paths.get(key)
+        if path is None:
+            path = nx.shortest_path(self.graph, src, dst, weight=weight)
+            self._paths[key] = path
+            for node in path:
+                self._keys_by_node.setdefault(node, set()).add(key)
+        return path
+
+    def edge_added(self, node1, node2):
+        """
+        Has to be called before an edge is added to the graph.
+        """
+        if (node1 not in self.graph or node2 not in self.graph
+                or self.graph.degree(node1) == 0 or self.graph.degree(node2) == 0):
+            # a node that only gets its first link is a dead end,
+            # it can not be part of a shorter path between other nodes
+            return
+        # the new edge might be a shortcut for any path
+        self.clear()
+
+    def edge_removed(self, node1, node2):
+        """
+        Drop all paths that use the link between node1 and node2.
+        """
+        keys = self._keys_by_node.get(node1, set()) & self._keys_by_node.get(node2, set())
+        for key in keys:
+            path = self._paths[key]
+            hops = zip(path[:-1], path[1:])
+            if (node1, node2) in hops or (node2, node1) in hops:
+                self._drop(key)
+
+    def _drop(self, key):
+        for node in self._paths.pop(key):
+            self._keys_by_node[node].discard(key)
+
+    def clear(self):
+        self._paths.clear()
+        self._keys_by_node.clear()
+
+    def __len__(self):
+        return len(self._paths)
+
+
+# attachment of a vnf interface to a switch port
+VnfInterface = namedtuple("VnfInterface", ["vnf_name", "vnf_interface", "intf_name",
+                                           "switch_name", "switch_port_nr", "switch_port_name", "switch_dpid"])
+
+
+class VnfInterfaceRegistry(object):
+    """
+    Index of all vnf interfaces that are connected to a switch.
+    Used by chaining and monitoring to find the switch port of a
+    vnf interface without searching the network graph.
+    """
+
+    def __init__(self):
+        # vnf_name -> {vnf_interface: VnfInterface}, in the order the interfaces were connected
+        self._interfaces = dict()
+
+    def add(self, vnf_intf):
+        self._interfaces.setdefault(vnf_intf.vnf_name, OrderedDict())[vnf_intf.vnf_interface] = vnf_intf
+
+    def get(self, vnf_name, vnf_interface=None):
+        """
+        :param vnf_name: name of the vnf (container)
+        :param vnf_interface: interface id, the first connected interface is used if None
+        :return: VnfInterface or None if not connected
+        """
+        interfaces = self._interfaces.get(vnf_name)
+        if not interfaces:
+            return None
+        if vnf_interface is None:
+            return next(interfaces.itervalues())
+        return interfaces.get(vnf_interface)
+
+    def lookup(self, key):
+        """
+        Get an interface by a vnf_name:vnf_interface string.
+        """
+        vnf_name, _, vnf_interface = key.partition(':')
+        return self.get(vnf_name, vnf_interface or None)
+
+    def list(self, vnf_name):
+        return list(self._interfaces.get(vnf_name, dict()).itervalues())
+
+    def remove_intf(self, vnf_name, intf_name):
+        """
+        Remove the interface with the given (Mininet) interface name.
+        """
+        interfaces = self._interfaces.get(vnf_name, dict())
+        for vnf_intf in interfaces.values():
+            if vnf_intf.intf_name == intf_name:
+                del interfaces[vnf_intf.vnf_interface]
+
+    def remove_vnf(self, vnf_name):
+        self._interfaces.pop(vnf_name, None)
+
+
+class Chain(object):
+    """
+    Bookkeeping of the flow entries that were installed for one
+    direction of a chain.
+    """
+
+    def __init__(self, chain_id, path, vlan=None):
+        # (vnf_src_name, vnf_src_interface, vnf_dst_name, vnf_dst_interface, cookie)
+        self.chain_id = chain_id
+        self.path = path
+        self.vlan = vlan
+        # list of (switch_name, entry) for each hop,
+        # entry is the Ryu flow dict or the ovs-ofctl match string
+        self.flow_entries = []
+
+    @property
+    def cookie(self):
+        return self.chain_id[4]
+
+    def as_dict(self):
+        return {"vnf_src_name": self.chain_id[0],
+                "vnf_src_interface": self.chain_id[1],
+                "vnf_dst_name": self.chain_id[2],
+                "vnf_dst_interface": self.chain_id[3],
+                "cookie": self.cookie,
+                "path": list(self.path),
+                "vlan": self.vlan}
+
+
+class ChainRegistry(object):
+    """
+    Index of all installed chains by chain id and by cookie.
+    """
+
+    def __init__(self):
+        self._chains = dict()
+        self._chain_ids_by_cookie = dict()
+
+    def add(self, chain):
+        old = self._chains.get(chain.chain_id)
+        if old is not None:
+            # the same chain was installed again, keep the old entries so that they are removed as well
+            chain.flow_entries = old.flow_entries + chain.flow_entries
+        self._chains[chain.chain_id] = chain
+        self._chain_ids_by_cookie.setdefault(chain.cookie, set()).add(chain.chain_id)
+
+    def get(self, chain_id):
+        return self._chains.get(chain_id)
+
+    def remove(self, chain_id):
+        """
+        :return: the removed chain or None
+        """
+        chain = self._chains.pop(chain_id, None)
+        if chain is not None:
+            chain_ids = self._chain_ids_by_cookie[chain.cookie]
+            chain_ids.discard(chain_id)
+            if not chain_ids:
+                del self._chain_ids_by_cookie[chain.cookie]
+        return chain
+
+    def remove_by_cookie(self, cookie):
+        """
+        :return: list of removed chains
+        """
+        chain_ids = self._chain_ids_by_cookie.pop(cookie, set())
+        return [self._chains.pop(chain_id) for chain_id in chain_ids]
+
+    def list(self):
+        return list(self._chains.itervalues())
+
+    def __len__(self):
+        return len(self._chains)
+
+
+# priority ovs-ofctl uses for flow entries that do not give one
+OFP_DEFAULT_PRIORITY = 32768
+
+
+def _run_ofctl(args, stdin=None):
+    """
+    :return: tuple (True if ovs-ofctl succeeded, output)
+    """
+    try:
+        p = Popen(args, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
+        out, _ = p.communicate(stdin)
+    except OSError as ex:
+        return False, str(ex)
+    return p.returncode == 0, out.strip()
+
+
+def _run_ofctl_batch(switch_name, cmd, opts, entries):
+    """
+    Apply a list of flow entries to a switch with a single ovs-ofctl call,
+    the entries are given to ovs-ofctl on stdin. If this call fails (e.g. older
+    OVS versions can not read del-flows from a file), each entry is applied
+    with its own ovs-ofctl call.
+    :return: True if all entries were applied
+    """
+    # add-flow -> add-flows, del-flows reads a file with '-' as well
+    batch_cmd = 'add-flows' if cmd == 'add-flow' else cmd
+    args = ['ovs-ofctl'] + opts.split() + [batch_cmd, switch_name, '-']
+    ok, out = _run_ofctl(args, '\n'.join(entries) + '\n')
+    if ok:
+        logging.info("{0} in switch: {1} ({2} flow entries)".format(batch_cmd, switch_name, len(entries)))
+        return True
+    logging.info("{0} failed: {1}, applying the flow entries one by one".format(' '.join(args), out))
+    ok = True
+    for entry in entries:
+        args = ['ovs-ofctl'] + opts.split() + [cmd, switch_name, entry]
+        entry_ok, out = _run_ofctl(args)
+        if not entry_ok:
+            logging.info("{0} failed: {1}".format(' '.join(args), out))
+            ok = False
+    logging.info("{0} in switch: {1} ({2} flow entries)".format(cmd, switch_name, len(entries)))
+    return ok
+
+
+def _run_switch_batches(batches):
+    """
+    Apply all batches of one switch, one after another in the given order.
+    :param batches: list of ((switch_name, cmd, options), entries)
+    :return: True if all batches succeeded
+    """
+    ok = True
+    for (switch_name, cmd, opts), entries in batches:
+        ok = _run_ofctl_batch(switch_name, cmd, opts, entries) and ok
+    return ok
+
 
 class DCNetwork(Containernet):
     """
@@ -33,10 +284,23 @@ class DCNetwork(Containernet):
                  enable_learning = True,   # in case of RemoteController (Ryu), learning switch behavior can be turned off/on
                  dc_emulation_max_cpu=1.0,  # fraction of overall CPU time for emulation
                  dc_emulation_max_mem=512,  # emulation max mem in MB
+                 ryu_rest_client=RestClient,  # RestClient or GeventRestClient
+                 ryu_rest_max_connections=8,  # max. parallel connections to Ryu's REST API
+                 ryu_rest_timeout=5.0,  # timeout in seconds for requests to Ryu's REST API
+                 dpctl_batch=True,  # in case of the default controller, use one ovs-ofctl call per switch and chain
+                 dpctl_workers=4,  # max. number of switches that are programmed in parallel
+                 monitor_push=True,  # push the monitored metrics to the Prometheus Pushgateway
+                 monitor_push_delta=False,  # only push the changed metric families
+                 monitor_metrics_port=None,  # serve the monitored metrics for Prometheus on this port
+                 monitor_interval=1.0,  # default polling interval of the monitored metrics in seconds
+                 monitor_cadvisor=False,  # start cAdvisor (the container cpu/mem usage is sampled from the cgroups)
                  **kwargs):
         """
         Create an extended version of a Containernet network
         :param dc_emulation_max_cpu: max. CPU time used by containers in data centers
+        :param ryu_rest_client: client class used to talk to Ryu's REST API
+        :param dpctl_batch: aggregate the flow entries of a chain per switch (only without Ryu)
+        :param dpctl_workers: number of worker threads that run ovs-ofctl
         :param kwargs: path through for Mininet parameters
         :return:
         """
@@ -58,18 +322,37 @@ class DCNetwork(Containernet):
 
         # graph of the complete DC network
         self.DCNetwork_graph = nx.MultiDiGraph()
+        # graph of the switch fabric only, used for path computation
+        # (does not change when containers are added or removed)
+        self.switch_graph = nx.MultiDiGraph()
+        self.path_cache = PathCache(self.switch_graph)
+        # switch ports to which the vnf interfaces are attached
+        self.vnf_interfaces = VnfInterfaceRegistry()
 
         # initialize pool of vlan tags to setup the SDN paths
-        self.vlans = range(4096)[::-1]
+        self.vlans = VlanAllocator()
+        # all installed chains
+        self.chains = ChainRegistry()
 
         # link to Ryu REST_API
-        ryu_ip = '0.0.0.0'
-        ryu_port = '8080'
-        self.ryu_REST_api = 'http://{0}:{1}'.format(ryu_ip, ryu_port)
+        self.ryu_ip = '0.0.0.0'
+        self.ryu_port = '8080'
+        self.ryu_REST_api = 'http://{0}:{1}'.format(self.ryu_ip, self.ryu_port)
+        # pooled keep-alive connections, shared by chaining and monitoring
+        self.ryu_client = ryu_rest_client(self.ryu_ip, self.ryu_port,
+                                          max_connections=ryu_rest_max_connections,
+                                          timeout=ryu_rest_timeout)
+
+        # batched flow programming with ovs-ofctl (without Ryu)
+        self.dpctl_batch = dpctl_batch and controller != RemoteController
+        self.dpctl_workers = dpctl_workers
+        self._dpctl_pool = None
 
         # monitoring agent
         if monitor:
-            self.monitor_agent = DCNetworkMonitor(self)
+            self.monitor_agent = DCNetworkMonitor(self, push=monitor_push, push_delta=monitor_push_delta,
+                                                  metrics_port=monitor_metrics_port, interval=monitor_interval,
+                                                  cadvisor=monitor_cadvisor)
         else:
             self.monitor_agent = None
 
@@ -77,12 +360,15 @@ class DCNetwork(Containernet):
         self.rm_registrar = ResourceModelRegistrar(
             dc_emulation_max_cpu, dc_emulation_max_mem)
 
-    def addDatacenter(self, label, metadata={}, resource_log_path=None):
+    def addDatacenter(self, label, metadata={}, resource_log_path=None, vlan_range=None):
         """
         Create and add a logical cloud data center to the network.
+        :param vlan_range: optional (first, last) tuple of vlan tags reserved for chains starting in this DC
         """
         if label in self.dcs:
             raise Exception("Data center label already exists: %s" % label)
+        if vlan_range is not None:
+            self.vlans.reserve_range(label, vlan_range[0], vlan_range[1])
         dc = Datacenter(label, metadata=metadata, resource_log_path=resource_log_path)
         dc.net = self  # set reference to network
         self.dcs[label] = dc
@@ -90,6 +376,26 @@ class DCNetwork(Containernet):
         logging.info("added data center: %s" % label)
         return dc
 
+    def startComputeBatch(self, specs, max_workers=4, atomic=False):
+        """
+        Start a number of containers in one or more data centers at once.
+        :param specs: list of dicts with the arguments of Datacenter.startCompute
+                      and the target data center (label or Datacenter object), e.g.,
+                      [{"datacenter": "dc1", "name": "vnf1", "network": [{"id": "intf1"}]}]
+        :param max_workers: max. number of images that are checked/pulled in parallel
+        :param atomic: start either all or none of the containers (resource model admission)
+        :return: list of ComputeResult(name, compute, error) in the order of the specs
+        """
+        jobs = []
+        for spec in specs:
+            dc = spec.get("datacenter")
+            if not isinstance(dc, Datacenter):
+                if dc not in self.dcs:
+                    raise Exception("Data center not found: %s" % dc)
+                dc = self.dcs[dc]
+            jobs.append((dc, spec))
+        return start_compute_batch(jobs, max_workers=max_workers, atomic=atomic)
+
     def addLink(self, node1, node2, **params):
         """
         Able to handle Datacenter objects as link
@@ -167,6 +473,9 @@ class DCNetwork(Containernet):
                       'dst_port_name': node2_port_name}
         attr_dict2.update(attr_dict)
         self.DCNetwork_graph.add_edge(node1.name, node2.name, attr_dict=attr_dict2)
+        if isinstance(node1, OVSSwitch) and isinstance(node2, OVSSwitch):
+            self.path_cache.edge_added(node1.name, node2.name)
+            self.switch_graph.add_edge(node1.name, node2.name, attr_dict=attr_dict2)
 
         attr_dict2 = {'src_port_id': node2_port_id, 'src_port_nr': node2.ports[link.intf2],
                       'src_port_name': node2_port_name,
@@ -174,9 +483,72 @@ class DCNetwork(Containernet):
                       'dst_port_name': node1_port_name}
         attr_dict2.update(attr_dict)
         self.DCNetwork_graph.add_edge(node2.name, node1.name, attr_dict=attr_dict2)
+        if isinstance(node1, OVSSwitch) and isinstance(node2, OVSSwitch):
+            self.switch_graph.add_edge(node2.name, node1.name, attr_dict=attr_dict2)
+
+        # the interfaces of the containers have changed
+        for node in [node1, node2]:
+            if isinstance(node, EmulatorCompute):
+                node.invalidateStatus()
+
+        # remember to which switch port a vnf interface is attached
+        if isinstance(node1, Docker) and isinstance(node2, OVSSwitch):
+            self.vnf_interfaces.add(VnfInterface(
+                node1.name, node1_port_id, node1_port_name,
+                node2.name, node2.ports[link.intf2], node2_port_name, int(str(node2.dpid), 16)))
+        if isinstance(node2, Docker) and isinstance(node1, OVSSwitch):
+            self.vnf_interfaces.add(VnfInterface(
+                node2.name, node2_port_id, node2_port_name,
+                node1.name, node1.ports[link.intf1], node1_port_name, int(str(node1.dpid), 16)))
 
         return link
 
+    def removeLink(self, link=None, node1=None, node2=None):
+        """
+        Wrapper for removeLink method to update graphs and vnf interfaces.
+        If only the nodes are given, the first link between them is removed (like Containernet does).
+        """
+        if link is None:
+            if isinstance(node1, basestring) and node1 in self.nameToNode:
+                node1 = self.nameToNode[node1]
+            if isinstance(node2, basestring) and node2 in self.nameToNode:
+                node2 = self.nameToNode[node2]
+            links = self.linksBetween(node1, node2)
+            if len(links) > 0:
+                link = links[0]
+        if link is not None:
+            self._removeLinkFromGraph(link)
+        return Containernet.removeLink(self, link=link, node1=node1, node2=node2)
+
+    def _removeLinkFromGraph(self, link):
+        n1 = link.intf1.node
+        n2 = link.intf2.node
+        edges = [(n1.name, n2.name, n1.ports.get(link.intf1)), (n2.name, n1.name, n2.ports.get(link.intf2))]
+        for graph in [self.DCNetwork_graph, self.switch_graph]:
+            for src, dst, src_port_nr in edges:
+                if not graph.has_edge(src, dst):
+                    continue
+                for key, attr in graph[src][dst].items():
+                    if attr.get('src_port_nr') == src_port_nr:
+                        graph.remove_edge(src, dst, key)
+        self.path_cache.edge_removed(n1.name, n2.name)
+        self.vnf_interfaces.remove_intf(n1.name, link.intf1.name)
+        self.vnf_interfaces.remove_intf(n2.name, link.intf2.name)
+        for node in [n1, n2]:
+            if isinstance(node, EmulatorCompute):
+                node.invalidateStatus()
+
+    def getVnfInterface(self, vnf_name, vnf_interface=None):
+        """
+        Look up the switch port to which a vnf interface is connected.
+        :param vnf_name: name of the vnf (container) or a vnf_name:vnf_interface string
+        :param vnf_interface: interface id, the first interface of the vnf is used if None
+        :return: VnfInterface or None if not connected
+        """
+        if vnf_interface is None and ':' in vnf_name:
+            return self.vnf_interfaces.lookup(vnf_name)
+        return self.vnf_interfaces.get(vnf_name, vnf_interface)
+
     def addDocker( self, label, **params ):
         """
         Wrapper for addDocker method to use custom container class.
@@ -189,6 +561,7 @@ class DCNetwork(Containernet):
         Wrapper for removeDocker method to update graph.
         """
         self.DCNetwork_graph.remove_node(label)
+        self.vnf_interfaces.remove_vnf(label)
         return Containernet.removeDocker(self, label, **params)
 
     def addSwitch( self, name, add_to_graph=True, **params ):
@@ -197,6 +570,7 @@ class DCNetwork(Containernet):
         """
         if add_to_graph:
             self.DCNetwork_graph.add_node(name)
+            self.switch_graph.add_node(name)
         return Containernet.addSwitch(self, name, protocols='OpenFlow10,OpenFlow12,OpenFlow13', **params)
 
     def getAllContainers(self):
@@ -220,11 +594,20 @@ class DCNetwork(Containernet):
         if self.monitor_agent is not None:
             self.monitor_agent.stop()
 
+        # finish pending work of the resource models and write their logs
+        self.rm_registrar.close()
+
         # stop emulator net
         Containernet.stop(self)
 
         # stop Ryu controller
         self.stopRyu()
+        self.ryu_client.close()
+
+        if self._dpctl_pool is not None:
+            self._dpctl_pool.close()
+            self._dpctl_pool.join()
+            self._dpctl_pool = None
 
 
     def CLI(self):
@@ -233,85 +616,248 @@ class DCNetwork(Containernet):
     # to remove chain do setChain( src, dst, cmd='del-flows')
     def setChain(self, vnf_src_name, vnf_dst_name, vnf_src_interface=None, vnf_dst_interface=None, **kwargs):
         cmd = kwargs.get('cmd')
+        # flow entries of all hops (and both directions) are collected first
+        # and then pushed to the controller in a single burst
+        flow_batch = []
+        # without Ryu, the entries are collected per switch and written by one ovs-ofctl call each
+        dpctl_batch = OrderedDict() if self.dpctl_batch else None
+        # the new chains are only registered if all of their flow entries were written
+        new_chains = []
         if cmd == 'add-flow':
-            ret = self._chainAddFlow(vnf_src_name, vnf_dst_name, vnf_src_interface, vnf_dst_interface, **kwargs)
+            ret = self._chainAddFlow(vnf_src_name, vnf_dst_name, vnf_src_interface, vnf_dst_interface,
+                                     flow_batch=flow_batch, dpctl_batch=dpctl_batch, new_chains=new_chains, **kwargs)
             if kwargs.get('bidirectional'):
-                ret = ret +'\n' + self._chainAddFlow(vnf_dst_name, vnf_src_name, vnf_dst_interface, vnf_src_interface, **kwargs)
+                ret = ret +'\n' + self._chainAddFlow(vnf_dst_name, vnf_src_name, vnf_dst_interface, vnf_src_interface,
+                                                      flow_batch=flow_batch, dpctl_batch=dpctl_batch,
+                                                      new_chains=new_chains, **kwargs)
 
-        elif cmd == 'del-flows':  # TODO: del-flow to be implemented
-            ret = self._chainAddFlow(vnf_src_name, vnf_dst_name, vnf_src_interface, vnf_dst_interface, **kwargs)
+        elif cmd == 'del-flows':
+            ret = self._chainDelFlow(vnf_src_name, vnf_dst_name, vnf_src_interface, vnf_dst_interface,
+                                     flow_batch=flow_batch, dpctl_batch=dpctl_batch, **kwargs)
             if kwargs.get('bidirectional'):
-                ret = ret + '\n' + self._chainAddFlow(vnf_dst_name, vnf_src_name, vnf_dst_interface, vnf_src_interface, **kwargs)
+                ret = ret + '\n' + self._chainDelFlow(vnf_dst_name, vnf_src_name, vnf_dst_interface, vnf_src_interface,
+                                                       flow_batch=flow_batch, dpctl_batch=dpctl_batch, **kwargs)
 
         else:
             ret = "Command unknown"
 
+        failed = []
+        if len(flow_batch) > 0:
+            report, failed_switches = self._push_flow_batch(flow_batch, cmd)
+            ret = ret + '\n' + report
+            failed += failed_switches
+        if dpctl_batch:
+            report, failed_switches = self._push_dpctl_batch(dpctl_batch)
+            ret = ret + '\n' + report
+            failed += failed_switches
+
+        if failed and new_chains:
+            ret = ret + '\n' + self._rollbackChains(new_chains)
+        else:
+            for chain in new_chains:
+                self.chains.add(chain)
+
         return ret
 
+    def delChainsByCookie(self, cookie):
+        """
+        Remove all chains that were installed with the given cookie.
+        """
+        flow_batch = []
+        dpctl_batch = OrderedDict() if self.dpctl_batch else None
+        chains = self.chains.remove_by_cookie(self._getCookie(cookie))
+        for chain in chains:
+            self.vlans.release_owner(chain.chain_id)
+            self._removeChainFlows(chain, flow_batch, dpctl_batch)
+        ret = "removed {0} chains with cookie {1}".format(len(chains), cookie)
+        return ret + self._pushDelFlows(flow_batch, dpctl_batch)
+
+    def _rollbackChains(self, chains):
+        """
+        Remove the flow entries of chains that could not be installed completely
+        and give their vlan tags back. The chains are not registered.
+        """
+        flow_batch = []
+        dpctl_batch = OrderedDict() if self.dpctl_batch else None
+        for chain in chains:
+            if chain.vlan is not None:
+                self.vlans.release(chain.vlan)
+            self._removeChainFlows(chain, flow_batch, dpctl_batch)
+        ret = "rolled back {0} chains".format(len(chains))
+        logging.warning(ret)
+        return ret + self._pushDelFlows(flow_batch, dpctl_batch)
+
+    def _pushDelFlows(self, flow_batch, dpctl_batch):
+        ret = ''
+        if len(flow_batch) > 0:
+            ret = ret + '\n' + self._push_flow_batch(flow_batch, 'del-flows')[0]
+        if dpctl_batch:
+            ret = ret + '\n' + self._push_dpctl_batch(dpctl_batch)[0]
+        return ret
+
+    def listChains(self):
+        """
+        Return a list of dicts describing all installed chains.
+        """
+        return [chain.as_dict() for chain in self.chains.list()]
+
+    def _getCookie(self, cookie):
+        # cookies are given as int or string, flow entries use int
+        if cookie:
+            return int(cookie)
+        return None
+
+    def _getChainId(self, vnf_src_name, vnf_dst_name, vnf_src_interface, vnf_dst_interface, cookie):
+        """
+        Build the id of a chain, resolves the default interfaces if they are not given.
+        """
+        src_intf = self.vnf_interfaces.get(vnf_src_name, vnf_src_interface)
+        if src_intf is not None:
+            vnf_src_interface = src_intf.vnf_interface
+        dst_intf = self.vnf_interfaces.get(vnf_dst_name, vnf_dst_interface)
+        if dst_intf is not None:
+            vnf_dst_interface = dst_intf.vnf_interface
+        return (vnf_src_name, vnf_src_interface, vnf_dst_name, vnf_dst_interface, self._getCookie(cookie))
+
+    def _chainDelFlow(self, vnf_src_name, vnf_dst_name, vnf_src_interface=None, vnf_dst_interface=None, **kwargs):
+        """
+        Remove exactly the flow entries that were installed for a chain (no new path computation).
+        """
+        vnf_dst_name = vnf_dst_name.split(':')[0]
+        chain_id = self._getChainId(vnf_src_name, vnf_dst_name, vnf_src_interface, vnf_dst_interface,
+                                    kwargs.get('cookie'))
+        chain = self.chains.remove(chain_id)
+        if chain is None:
+            logging.info("No chain installed between {0} and {1}".format(vnf_src_name, vnf_dst_name))
+            return "No chain installed between {0} and {1}".format(vnf_src_name, vnf_dst_name)
+        self.vlans.release_owner(chain.chain_id)
+        self._removeChainFlows(chain, kwargs.get('flow_batch'), kwargs.get('dpctl_batch'))
+        return "path del-flows between {0} and {1}".format(vnf_src_name, vnf_dst_name)
+
+    def _removeChainFlows(self, chain, flow_batch=None, dpctl_batch=None):
+        for switch_name, entry in chain.flow_entries:
+            if self.controller == RemoteController:
+                # strict delete only matches the installed entry (same match and priority)
+                flow = {'dpid': entry['dpid'], 'match': entry['match']}
+                if 'cookie' in entry:
+                    flow['cookie'] = entry['cookie']
+                    flow['cookie_mask'] = int('0xffffffffffffffff', 16)
+                if flow_batch is not None:
+                    flow_batch.append((switch_name, 'stats/flowentry/delete_strict', flow))
+                else:
+                    self.ryu_REST('stats/flowentry/delete_strict', data=flow)
+            elif dpctl_batch is not None:
+                # strict delete only matches the installed entry, not all entries of the same in_port
+                dpctl_batch.setdefault((switch_name, 'del-flows', '--strict'), []).append(entry)
+            else:
+                self.getNodeByName(switch_name).dpctl('del-flows', '--strict', entry)
+                logging.info("del-flows in switch: {0} match: {1}".format(switch_name, entry))
+
+    def _push_flow_batch(self, flow_batch, cmd):
+        """
+        Push all collected flow entries of a chain to the Ryu controller.
+        :param flow_batch: list of (switch_name, prefix, flow) tuples
+        :param cmd: add-flow or del-flows
+        :return: tuple (report string, list of the switches in which entries failed)
+        """
+        results = self.ryu_REST_batch([(prefix, flow) for (switch_name, prefix, flow) in flow_batch])
+        failed = [switch_name for (switch_name, prefix, flow), ok in zip(flow_batch, results) if not ok]
+        report = "{0}: {1}/{2} flow entries done".format(cmd, len(flow_batch) - len(failed), len(flow_batch))
+        if failed:
+            report += ", failed in switches: {0}".format(', '.join(failed))
+            logging.warning(report)
+        else:
+            logging.info(report)
+        return report, failed
+
+    def _push_dpctl_batch(self, dpctl_batch):
+        """
+        Write the collected flow entries with one ovs-ofctl call per switch and
+        command. The switches are programmed in parallel, the calls for the same
+        switch are made one after another in the order of the batch.
+        :param dpctl_batch: dict (switch_name, cmd, options) -> list of flow entries
+        :return: tuple (report string, list of the switches that failed)
+        """
+        if self._dpctl_pool is None:
+            self._dpctl_pool = ThreadPool(self.dpctl_workers)
+        batches_by_switch = OrderedDict()
+        for key, entries in dpctl_batch.iteritems():
+            batches_by_switch.setdefault(key[0], []).append((key, entries))
+        results = self._dpctl_pool.map(_run_switch_batches, batches_by_switch.values())
+        failed = [switch_name for switch_name, ok in zip(batches_by_switch, results) if not ok]
+        n_entries = sum(len(entries) for entries in dpctl_batch.itervalues())
+        report = "dpctl: {0} flow entries in {1} batches, {2}/{3} switches done".format(
+            n_entries, len(dpctl_batch), len(batches_by_switch) - len(failed), len(batches_by_switch))
+        if failed:
+            report += ", failed in switches: {0}".format(', '.join(failed))
+            logging.warning(report)
+        else:
+            logging.info(report)
+        return report, failed
 
     def _chainAddFlow(self, vnf_src_name, vnf_dst_name, vnf_src_interface=None, vnf_dst_interface=None, **kwargs):
 
-        # TODO: this needs to be cleaned up
-        #check if port is specified (vnf:port)
-        if vnf_src_interface is None:
-            # take first interface by default
-            connected_sw = self.DCNetwork_graph.neighbors(vnf_src_name)[0]
-            link_dict = self.DCNetwork_graph[vnf_src_name][connected_sw]
-            vnf_src_interface = link_dict[0]['src_port_id']
-
-        for connected_sw in self.DCNetwork_graph.neighbors(vnf_src_name):
-            link_dict = self.DCNetwork_graph[vnf_src_name][connected_sw]
-            for link in link_dict:
-                if link_dict[link]['src_port_id'] == vnf_src_interface:
-                    # found the right link and connected switch
-                    src_sw = connected_sw
-
-                    src_sw_inport_nr = link_dict[link]['dst_port_nr']
-                    break
-
-        if vnf_dst_interface is None:
-            # take first interface by default
-            connected_sw = self.DCNetwork_graph.neighbors(vnf_dst_name)[0]
-            link_dict = self.DCNetwork_graph[connected_sw][vnf_dst_name]
-            vnf_dst_interface = link_dict[0]['dst_port_id']
+        # check if port is specified (vnf:port), take first interface by default
+        src_intf = self.vnf_interfaces.get(vnf_src_name, vnf_src_interface)
+        if src_intf is None:
+            logging.info("vnf interface {0}:{1} not found".format(vnf_src_name, vnf_src_interface))
+            return "vnf interface {0}:{1} not found".format(vnf_src_name, vnf_src_interface)
+        vnf_src_interface = src_intf.vnf_interface
+        src_sw = src_intf.switch_name
+        src_sw_inport_nr = src_intf.switch_port_nr
 
         vnf_dst_name = vnf_dst_name.split(':')[0]
-        for connected_sw in self.DCNetwork_graph.neighbors(vnf_dst_name):
-            link_dict = self.DCNetwork_graph[connected_sw][vnf_dst_name]
-            for link in link_dict:
-                if link_dict[link]['dst_port_id'] == vnf_dst_interface:
-                    # found the right link and connected switch
-                    dst_sw = connected_sw
-                    dst_sw_outport_nr = link_dict[link]['src_port_nr']
-                    break
+        dst_intf = self.vnf_interfaces.get(vnf_dst_name, vnf_dst_interface)
+        if dst_intf is None:
+            logging.info("vnf interface {0}:{1} not found".format(vnf_dst_name, vnf_dst_interface))
+            return "vnf interface {0}:{1} not found".format(vnf_dst_name, vnf_dst_interface)
+        vnf_dst_interface = dst_intf.vnf_interface
+        dst_sw = dst_intf.switch_name
+        dst_sw_outport_nr = dst_intf.switch_port_nr
 
 
         # get shortest path
         try:
             # returns the first found shortest path
             # if all shortest paths are wanted, use: all_shortest_paths
-            path = nx.shortest_path(self.DCNetwork_graph, src_sw, dst_sw, weight=kwargs.get('weight'))
+            path = self.path_cache.shortest_path(src_sw, dst_sw, weight=kwargs.get('weight'))
         except:
             logging.info("No path could be found between {0} and {1}".format(vnf_src_name, vnf_dst_name))
             return "No path could be found between {0} and {1}".format(vnf_src_name, vnf_dst_name)
 
         logging.info("Path between {0} and {1}: {2}".format(vnf_src_name, vnf_dst_name, path))
 
+        # all hops have to be switches, otherwise nothing is installed
+        for hop in path[1:]:
+            if not isinstance(self.getNodeByName(hop), OVSSwitch):
+                logging.info("Next node: {0} is not a switch".format(hop))
+                return "Next node: {0} is not a switch".format(hop)
+
         current_hop = src_sw
         switch_inport_nr = src_sw_inport_nr
 
         # choose free vlan if path contains more than 1 switch
         cmd = kwargs.get('cmd')
         vlan = None
+        chain = None
         if cmd == 'add-flow':
+            chain_id = (vnf_src_name, vnf_src_interface, vnf_dst_name, vnf_dst_interface,
+                        self._getCookie(kwargs.get('cookie')))
             if len(path) > 1:
-                vlan = self.vlans.pop()
-
+                # the vlan tags are owned by the chain, so they can be given back when it is deleted
+                vlan = self.vlans.allocate(chain_id, pool=self._getVlanPool(vnf_src_name))
+                if vlan is None:
+                    logging.info("No free vlan tag for path between {0} and {1}".format(vnf_src_name, vnf_dst_name))
+                    return "No free vlan tag for path between {0} and {1}".format(vnf_src_name, vnf_dst_name)
+            # remember the installed flow entries, so that the chain can be removed without routing again
+            chain = Chain(chain_id, path, vlan)
+
+        # current_hop is always path[i], so the position of a hop is known without searching the path
         for i in range(0,len(path)):
             current_node = self.getNodeByName(current_hop)
 
-            if path.index(current_hop) < len(path)-1:
-                next_hop = path[path.index(current_hop)+1]
+            if i < len(path)-1:
+                next_hop = path[i+1]
             else:
                 #last switch reached
                 next_hop = vnf_dst_name
@@ -321,13 +867,10 @@ class DCNetwork(Containernet):
             if next_hop == vnf_dst_name:
                 switch_outport_nr = dst_sw_outport_nr
                 logging.info("end node reached: {0}".format(vnf_dst_name))
-            elif not isinstance( next_node, OVSSwitch ):
-                logging.info("Next node: {0} is not a switch".format(next_hop))
-                return "Next node: {0} is not a switch".format(next_hop)
             else:
                 # take first link between switches by default
                 index_edge_out = 0
-                switch_outport_nr = self.DCNetwork_graph[current_hop][next_hop][index_edge_out]['src_port_nr']
+                switch_outport_nr = self.switch_graph[current_hop][next_hop][index_edge_out]['src_port_nr']
 
 
            # set of entry via ovs-ofctl
@@ -335,6 +878,8 @@ class DCNetwork(Containernet):
                 kwargs['vlan'] = vlan
                 kwargs['path'] = path
                 kwargs['current_hop'] = current_hop
+                kwargs['current_hop_index'] = i
+                kwargs['chain'] = chain
 
                 if self.controller == RemoteController:
                     ## set flow entry via ryu rest api
@@ -347,11 +892,28 @@ class DCNetwork(Containernet):
 
             # take first link between switches by default
             if isinstance( next_node, OVSSwitch ):
-                switch_inport_nr = self.DCNetwork_graph[current_hop][next_hop][0]['dst_port_nr']
+                switch_inport_nr = self.switch_graph[current_hop][next_hop][0]['dst_port_nr']
                 current_hop = next_hop
 
+        if chain is not None:
+            new_chains = kwargs.get('new_chains')
+            if new_chains is not None:
+                # registered by setChain once the flow entries are written
+                new_chains.append(chain)
+            else:
+                self.chains.add(chain)
+
         return "path {2} between {0} and {1}".format(vnf_src_name, vnf_dst_name, cmd)
 
+    def _getVlanPool(self, vnf_name):
+        """
+        Chains use the vlan range reserved for the DC of their source vnf (if any).
+        """
+        dc = getattr(self.getNodeByName(vnf_name), 'datacenter', None)
+        if dc is None:
+            return None
+        return dc.label
+
     def _set_flow_entry_ryu_rest(self, node, switch_inport_nr, switch_outport_nr, **kwargs):
         match = 'in_port=%s' % switch_inport_nr
 
@@ -359,7 +921,7 @@ class DCNetwork(Containernet):
         match_input = kwargs.get('match')
         cmd = kwargs.get('cmd')
         path = kwargs.get('path')
-        current_hop = kwargs.get('current_hop')
+        current_hop_index = kwargs.get('current_hop_index')
         vlan = kwargs.get('vlan')
 
         s = ','
@@ -380,7 +942,7 @@ class DCNetwork(Containernet):
         if cmd == 'add-flow':
             prefix = 'stats/flowentry/add'
             if vlan != None:
-                if path.index(current_hop) == 0:  # first node
+                if current_hop_index == 0:  # first node
                     action = {}
                     action['type'] = 'PUSH_VLAN'  # Push a new VLAN tag if a input frame is non-VLAN-tagged
                     action['ethertype'] = 33024   # Ethertype 0x8100(=33024): IEEE 802.1Q VLAN-tagged frame
@@ -390,7 +952,7 @@ class DCNetwork(Containernet):
                     action['field'] = 'vlan_vid'
                     action['value'] = vlan
                     flow['actions'].append(action)
-                elif path.index(current_hop) == len(path) - 1:  # last node
+                elif current_hop_index == len(path) - 1:  # last node
                     match += ',dl_vlan=%s' % vlan
                     action = {}
                     action['type'] = 'POP_VLAN'
@@ -416,41 +978,71 @@ class DCNetwork(Containernet):
             flow['actions'].append(action)
 
         flow['match'] = self._parse_match(match)
-        self.ryu_REST(prefix, data=flow)
+
+        chain = kwargs.get('chain')
+        if chain is not None:
+            chain.flow_entries.append((node.name, flow))
+
+        flow_batch = kwargs.get('flow_batch')
+        if flow_batch is not None:
+            # the complete chain is pushed at once by setChain
+            flow_batch.append((node.name, prefix, flow))
+        else:
+            self.ryu_REST(prefix, data=flow)
 
     def _set_flow_entry_dpctl(self, node, switch_inport_nr, switch_outport_nr, **kwargs):
-        match = 'in_port=%s' % switch_inport_nr
+        # the priority is always given, so the entry can be deleted with a strict match
+        match = 'priority=%s,in_port=%s' % (kwargs.get('priority', OFP_DEFAULT_PRIORITY), switch_inport_nr)
 
         cookie = kwargs.get('cookie')
         match_input = kwargs.get('match')
         cmd = kwargs.get('cmd')
         path = kwargs.get('path')
-        current_hop = kwargs.get('current_hop')
+        current_hop_index = kwargs.get('current_hop_index')
         vlan = kwargs.get('vlan')
 
         s = ','
+        # del-flows only matches a cookie if the mask is given
+        del_match = match
         if cookie:
+            del_match = s.join(['cookie=%s/-1' % cookie, match])
             cookie = 'cookie=%s' % cookie
             match = s.join([cookie, match])
         if match_input:
             match = s.join([match, match_input])
+            del_match = s.join([del_match, match_input])
         if cmd == 'add-flow':
             action = 'action=%s' % switch_outport_nr
             if vlan != None:
-                if path.index(current_hop) == 0:  # first node
+                if current_hop_index == 0:  # first node
                     action = ('action=mod_vlan_vid:%s' % vlan) + (',output=%s' % switch_outport_nr)
                     match = '-O OpenFlow13 ' + match
-                elif path.index(current_hop) == len(path) - 1:  # last node
+                elif current_hop_index == len(path) - 1:  # last node
                     match += ',dl_vlan=%s' % vlan
+                    del_match += ',dl_vlan=%s' % vlan
                     action = 'action=strip_vlan,output=%s' % switch_outport_nr
                 else:  # middle nodes
                     match += ',dl_vlan=%s' % vlan
+                    del_match += ',dl_vlan=%s' % vlan
             ofcmd = s.join([match, action])
+            chain = kwargs.get('chain')
+            if chain is not None:
+                chain.flow_entries.append((node.name, del_match))
         elif cmd == 'del-flows':
             ofcmd = match
         else:
             ofcmd = ''
 
+        dpctl_batch = kwargs.get('dpctl_batch')
+        if dpctl_batch is not None:
+            # ovs-ofctl options can not be given in the batch file, so they are part of the key
+            opts = ''
+            if ofcmd.startswith('-O OpenFlow13 '):
+                opts = '-O OpenFlow13'
+                ofcmd = ofcmd[len('-O OpenFlow13 '):]
+            dpctl_batch.setdefault((node.name, cmd, opts), []).append(ofcmd)
+            return
+
         node.dpctl(cmd, ofcmd)
         logging.info("{3} in switch: {0} in_port: {1} out_port: {2}".format(node.name, switch_inport_nr,
                                                                                  switch_outport_nr, cmd))
@@ -480,22 +1072,38 @@ class DCNetwork(Containernet):
             self.ryu_process.kill()
 
     def ryu_REST(self, prefix, dpid=None, data=None):
-        try:
-            if dpid:
-                url = self.ryu_REST_api + '/' + str(prefix) + '/' + str(dpid)
-            else:
-                url = self.ryu_REST_api + '/' + str(prefix)
-            if data:
-                #logging.info('POST: {0}'.format(str(data)))
-                req = urllib2.Request(url, str(data))
-            else:
-                req = urllib2.Request(url)
+        if dpid:
+            path = '/' + str(prefix) + '/' + str(dpid)
+        else:
+            path = '/' + str(prefix)
+        if data:
+            #logging.info('POST: {0}'.format(str(data)))
+            status, ret = self.ryu_client.request('POST', path, str(data))
+        else:
+            status, ret = self.ryu_client.request('GET', path)
 
-            ret = urllib2.urlopen(req).read()
-            return ret
-        except:
-            logging.info('error url: {0}'.format(str(url)))
+        if status != 200:
+            logging.info('error url: {0}'.format(self.ryu_REST_api + path))
             if data: logging.info('error POST: {0}'.format(str(data)))
+            return None
+        return ret
+
+    def ryu_REST_batch(self, requests):
+        """
+        Send a list of POST requests to the Ryu REST API back to back
+        over one persistent (keep-alive) HTTP connection.
+        :param requests: list of (prefix, data) tuples
+        :return: list of booleans, True if the request was accepted by Ryu
+        """
+        replies = self.ryu_client.request_many(
+            'POST', [('/' + str(prefix), str(data)) for prefix, data in requests])
+        results = []
+        for (prefix, data), (status, ret) in zip(requests, replies):
+            if status != 200:
+                logging.info('error url: {0}'.format(self.ryu_REST_api + '/' + str(prefix)))
+                logging.info('error POST: {0}'.format(str(data)))
+            results.append(status == 200)
+        return results
 
     # need to respect that some match fields must be integers
     # http://ryu.readthedocs.io/en/latest/app/ofctl_rest.html#description-of-match-and-actions
@@ -5,6 +5,9 @@ Distributed Cloud Emulator (dcemulator)
 from mininet.node import Docker
 from mininet.link import Link
 from emuvim.dcemulator.resourcemodel import NotEnoughResourcesAvailable
+from multiprocessing.pool import ThreadPool
+from collections import namedtuple
+import docker
 import logging
 import time
 import json
@@ -15,6 +18,143 @@ LOG.setLevel(logging.DEBUG)
 
 DCDPID_BASE = 1000  # start of switch dpid's used for data center switches
 
+STATUS_CACHE_TTL = 2.0  # seconds for which the status of a compute instance is cached
+
+# result of a single container of startComputeBatch, compute is None if the start failed
+ComputeResult = namedtuple("ComputeResult", ["name", "compute", "error"])
+
+
+def start_compute_batch(jobs, max_workers=4, atomic=False):
+    """
+    Start a number of containers, possibly in different data centers.
+    The resources are reserved at the resource models before any Docker work.
+    The image checks (and pulls) run in a pool of worker threads. The containers
+    are created, allocated and connected one after another in the calling thread,
+    because Containernet registers the node (IP, name) and sets up its shell and
+    network namespace while the container is created.
+    :param jobs: list of (datacenter, spec) tuples, spec is a dict with the
+                 arguments of Datacenter.startCompute (name, image, command, network, flavor_name)
+    :param max_workers: max. number of images that are checked/pulled in parallel
+    :param atomic: start either all or none of the containers if the resource models
+                   can not admit all of them (e.g. the VNFs of a service)
+    :return: list of ComputeResult in the order of the jobs
+    """
+    results = [None] * len(jobs)
+    prepared = []
+    names = set()
+    # 1. check the arguments
+    for i, (dc, spec) in enumerate(jobs):
+        name = spec.get("name")
+        try:
+            if name in names:
+                raise Exception("Container with name %s already exists." % name)
+            image, network = dc._checkComputeArgs(name, spec.get("image"), spec.get("network"))
+        except Exception as ex:
+            results[i] = ComputeResult(name, None, str(ex))
+            continue
+        names.add(name)
+        prepared.append((i, dc, name, image, spec.get("command"), network, spec.get("flavor_name", "tiny")))
+    if len(prepared) < 1:
+        return results
+
+    # 2. admission control: reserve the resources, containers that are not admitted are not created
+    reservations, prepared = _reserve_compute_batch(prepared, results, atomic)
+    if len(prepared) < 1:
+        return results
+
+    # 3. make sure that all images are available (each image only once)
+    images = list(set(p[3] for p in prepared))
+    pool = ThreadPool(min(max_workers, len(images)))
+    try:
+        image_errors = dict(zip(images, pool.map(_pull_image, images)))
+    finally:
+        pool.close()
+        pool.join()
+
+    # 4. create, allocate and connect the containers, serialized
+    for i, dc, name, image, command, network, flavor_name in prepared:
+        d, error = None, image_errors[image]
+        if error is None:
+            try:
+                d = dc._createCompute(name, image, command, flavor_name)
+            except Exception as ex:
+                LOG.exception("Creation of container %r failed." % name)
+                error = str(ex)
+        if d is not None:
+            d = dc._connectCompute(d, network, reservation=reservations.get(i))
+            if d is None:
+                error = "Allocation of container %s was blocked by resource model." % name
+        else:
+            dc._abortReservation(reservations.get(i))
+        results[i] = ComputeResult(name, d, error)
+    return results
+
+
+def _reserve_compute_batch(prepared, results, atomic):
+    """
+    Reserve the resources of the prepared jobs of start_compute_batch.
+    The jobs that are not admitted get an error result.
+    :return: tuple (dict job index -> reservation id, list of admitted jobs)
+    """
+    reservations = dict()
+    if not atomic:
+        admitted = []
+        for p in prepared:
+            i, dc, name = p[0], p[1], p[2]
+            try:
+                reservations[i] = dc._reserveCompute(p[6])
+            except (NotEnoughResourcesAvailable, Exception) as ex:
+                LOG.warning("Allocation of container %r was blocked by resource model." % name)
+                results[i] = ComputeResult(name, None, str(ex))
+                continue
+            admitted.append(p)
+        return reservations, admitted
+
+    # all jobs of a resource model are reserved at once
+    by_rm = dict()
+    for p in prepared:
+        rm = p[1].getResourceModel()
+        if rm is not None:
+            by_rm.setdefault(rm, []).append(p)
+    done = []
+    try:
+        for rm, ps in by_rm.iteritems():
+            ids = rm.reserve_many([p[6] for p in ps])
+            done.append((rm, ids))
+            reservations.update(zip([p[0] for p in ps], ids))
+    except (NotEnoughResourcesAvailable, Exception) as ex:
+        LOG.warning("Allocation of the batch was blocked by resource model: %s" % ex)
+        for rm, ids in done:
+            for r in ids:
+                rm.abort(r)
+        for p in prepared:
+            results[p[0]] = ComputeResult(p[2], None, str(ex))
+        return dict(), []
+    return reservations, prepared
+
+
+def _pull_image(image):
+    """
+    Pull the image if it is not available locally.
+    :return: None or an error message
+    """
+    try:
+        dcli = docker.Client()
+        if ":" in image.split("/")[-1]:
+            repo, tag = image.rsplit(":", 1)
+        else:
+            repo, tag = image, "latest"
+        if len(dcli.images(name="%s:%s" % (repo, tag))) > 0:
+            return None
+        LOG.info("Pulling image %r" % image)
+        dcli.pull(repo, tag=tag)
+        if len(dcli.images(name="%s:%s" % (repo, tag))) > 0:
+            return None
+        return "Docker image %s not found." % image
+    except Exception as ex:
+        LOG.warning("Check of image %r failed: %s" % (image, ex))
+        return str(ex)
+
 
 class EmulatorCompute(Docker):
     """
@@ -29,6 +169,9 @@ class EmulatorCompute(Docker):
             self, name, dimage, **kwargs):
         self.datacenter = kwargs.get("datacenter")  # pointer to current DC
         self.flavor_name = kwargs.get("flavor_name")
+        # cached parts of getStatus that need Docker API calls or shell commands
+        self._status_cache = None
+        self._status_time = 0
         LOG.debug("Starting compute instance %r in data center %r" % (name, str(self.datacenter)))
         # call original Docker.__init__
         Docker.__init__(self, name, dimage, **kwargs)
@@ -42,13 +185,45 @@ class EmulatorCompute(Docker):
         return [{'intf_name':str(i), 'ip':i.IP(), 'mac':i.MAC(), 'up':i.isUp(), 'status':i.status()}
                 for i in self.intfList()]
 
-    def getStatus(self):
+    def invalidateStatus(self):
+        """
+        Drop the cached status, e.g., after the links of this instance have changed.
+        """
+        self._status_cache = None
+
+    def refreshStatus(self, info=None):
+        """
+        Query Docker (one inspect call) and the interfaces of this instance.
+        :param info: result of inspect_container if it is already known
+        """
+        if info is None:
+            info = self.dcli.inspect_container(self.dc)
+        self._status_cache = {"state": info["State"],
+                              "id": info["Id"],
+                              "network": self.getNetworkStatus()}
+        self._status_time = time.time()
+
+    def refreshNetworkStatus(self):
+        """
+        Query the interfaces of this instance again, the cached Docker information is kept.
+        """
+        self._status_cache["network"] = self.getNetworkStatus()
+        self._status_time = time.time()
+
+    def getStatus(self, max_age=STATUS_CACHE_TTL):
         """
         Helper method to receive information about this compute instance.
+        :param max_age: max. age in seconds of the cached Docker and network information
         """
+        if self._status_cache is None or time.time() - self._status_time > max_age:
+            self.refreshStatus()
+        return self._buildStatus()
+
+    def _buildStatus(self):
+        cache = self._status_cache
         status = {}
         status["name"] = self.name
-        status["network"] = self.getNetworkStatus()
+        status["network"] = list(cache["network"])
         status["docker_network"] = self.dcinfo['NetworkSettings']['IPAddress']
         status["image"] = self.dimage
         status["flavor_name"] = self.flavor_name
@@ -58,13 +233,75 @@ class EmulatorCompute(Docker):
         status["cpuset"] = self.cpuset
         status["mem_limit"] = self.mem_limit
         status["memswap_limit"] = self.memswap_limit
-        status["state"] = self.dcli.inspect_container(self.dc)["State"]
-        status["id"] = self.dcli.inspect_container(self.dc)["Id"]
+        status["state"] = cache["state"]
+        status["id"] = cache["id"]
         status["datacenter"] = (None if self.datacenter is None
                                 else self.datacenter.label)
         return status
 
 
+def get_status_list(computes, max_age=STATUS_CACHE_TTL):
+    """
+    Return the status of many compute instances at once.
+    Instead of inspecting each container, the states of all containers are
+    fetched with a single Docker API call. Only instances whose cached status
+    is outdated and whose state has changed are inspected again, the interfaces
+    of all instances with an outdated status are queried again.
+    :param computes: list of EmulatorCompute
+    :param max_age: max. age in seconds of the cached status
+    :return: list of status dicts in the order of computes
+    """
+    if len(computes) < 1:
+        return []
+    now = time.time()
+    try:
+        states = dict((c.get("Id"), _summary_state(c))
+                      for c in computes[0].dcli.containers(all=True))
+    except Exception as ex:
+        LOG.warning("Could not list containers: %s" % ex)
+        states = dict()
+    result = []
+    for c in computes:
+        cache = c._status_cache
+        if cache is None or now - c._status_time > max_age:
+            did = c.dcinfo.get("Id")
+            if cache is not None and did in states and _inspect_state(cache["state"]) == states[did]:
+                # nothing changed since the last inspect
+                c.refreshNetworkStatus()
+            else:
+                c.refreshStatus()
+        result.append(c._buildStatus())
+    return result
+
+
+def _summary_state(summary):
+    """
+    State of a container as given by the container list (e.g. 'running' or 'exited').
+    Older Docker versions only return the human readable status ('Up 5 minutes').
+    """
+    if "State" in summary:
+        return summary["State"]
+    status = summary.get("Status", "")
+    if status.startswith("Up"):
+        return "paused" if "(Paused)" in status else "running"
+    if status.startswith("Exited"):
+        return "exited"
+    return status
+
+
+def _inspect_state(state):
+    """
+    Same representation of the State dict of inspect_container.
+    """
+    if "Status" in state:
+        return state["Status"]
+    if state.get("Paused"):
+        return "paused"
+    if state.get("Running"):
+        return "running"
+    return "exited"
+
+
 class Datacenter(object):
     """
     Represents a logical data center to which compute resources
@@ -128,6 +365,39 @@ class Datacenter(object):
         :param flavor_name: name of the flavor for this compute container
         :return:
         """
+        image, network = self._checkComputeArgs(name, image, network)
+        # admission control before any Docker work
+        try:
+            reservation = self._reserveCompute(flavor_name)
+        except NotEnoughResourcesAvailable as ex:
+            LOG.warning("Allocation of container %r was blocked by resource model." % name)
+            LOG.info(ex.message)
+            return None
+        # create the container
+        try:
+            d = self._createCompute(name, image, command, flavor_name)
+        except:
+            self._abortReservation(reservation)
+            raise
+        return self._connectCompute(d, network, reservation=reservation)
+
+    def startComputeBatch(self, specs, max_workers=4, atomic=False):
+        """
+        Create a number of containers at once and connect them to this
+        data center. The images are checked and pulled in parallel.
+        :param specs: list of dicts with the arguments of startCompute, e.g.,
+                      [{"name": "vnf1", "image": "ubuntu:trusty", "network": [{"id": "intf1"}]}]
+        :param max_workers: max. number of images that are checked/pulled in parallel
+        :param atomic: start either all or none of the containers (resource model admission)
+        :return: list of ComputeResult(name, compute, error), compute is None if the start failed
+        """
+        return start_compute_batch([(self, spec) for spec in specs], max_workers=max_workers, atomic=atomic)
+
+    def _checkComputeArgs(self, name, image, network):
+        """
+        Check the arguments of startCompute and set the defaults.
+        :return: tuple (image, network)
+        """
         assert name is not None
         # no duplications
         if name in [c.name for c in self.net.getAllContainers()]:
@@ -142,9 +412,28 @@ class Datacenter(object):
         if isinstance(network, list):
             if len(network) < 1:
                 network.append({})
+        return image, network
 
-        # create the container
-        d = self.net.addDocker(
+    def _reserveCompute(self, flavor_name):
+        """
+        Reserve the resources of a container at the resource model.
+        Raises NotEnoughResourcesAvailable if the container is not admitted.
+        :return: reservation id or None if there is no resource model
+        """
+        if self._resource_model is None:
+            return None
+        return self._resource_model.reserve(flavor_name)
+
+    def _abortReservation(self, reservation):
+        if reservation is not None and self._resource_model is not None:
+            self._resource_model.abort(reservation)
+
+    def _createCompute(self, name, image, command, flavor_name):
+        """
+        Create the container and register it as Mininet host.
+        Not thread safe: Containernet assigns the IP and sets up the shell of the node.
+        """
+        return self.net.addDocker(
             "%s" % (name),
             dimage=image,
             dcmd=command,
@@ -152,10 +441,20 @@ class Datacenter(object):
             flavor_name=flavor_name
         )
 
+    def _connectCompute(self, d, network, reservation=None):
+        """
+        Apply the resource limits and connect the container to the data center switch.
+        :param reservation: reservation id of the resources (see _reserveCompute)
+        :return: the container or None if the resource model blocked it (container is removed)
+        """
+        name = d.name
         # apply resource limits to container if a resource model is defined
         if self._resource_model is not None:
             try:
-                self._resource_model.allocate(d)
+                if reservation is not None:
+                    self._resource_model.commit(reservation, d)
+                else:
+                    self._resource_model.allocate(d)
                 self._resource_model.write_allocation_log(d, self.resource_log_path)
             except NotEnoughResourcesAvailable as ex:
                 LOG.warning("Allocation of container %r was blocked by resource model." % name)
@@ -221,6 +520,12 @@ class Datacenter(object):
             "metadata": self.metadata
         }
 
+    def getResourceModel(self):
+        """
+        Return the resource model assigned to this DC (None if there is none).
+        """
+        return self._resource_model
+
     def assignResourceModel(self, rm):
         """
         Assign a resource model to this DC.
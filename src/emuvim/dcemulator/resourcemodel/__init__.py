@@ -2,7 +2,12 @@
 Base classes needed for resource models support.
 """
 
+import time
+import json
+import Queue
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
 LOG = logging.getLogger("resourcemodel")
 LOG.setLevel(logging.DEBUG)
 
@@ -17,6 +22,11 @@ class ResourceModelRegistrar(object):
         self.e_mem = dc_emulation_max_mem
         # pointer to all resource models assigned to DCs
         self._resource_models = dict()
+        # cached sums of the capacities of all resource models (None = recalculate)
+        self._sum_max_cu = None
+        self._sum_max_mu = None
+        # writes the allocation logs of all resource models (they can share a log file)
+        self.log_writer = ResourceLogWriter()
         LOG.info("Resource model registrar created with dc_emulation_max_cpu=%r and dc_emulation_max_mem=%r"
                  % (dc_emulation_max_cpu, dc_emulation_max_mem))
 
@@ -32,8 +42,48 @@ class ResourceModelRegistrar(object):
         self._resource_models[dc] = rm
         rm.registrar = self
         rm.dcs.append(dc)
+        self.invalidate()
         LOG.info("Registrar: Added resource model: %r" % rm)
 
+    def invalidate(self):
+        """
+        Drop the cached capacity sums. Called when a resource model is registered
+        or the capacity of a resource model changes.
+        :return: None
+        """
+        self._sum_max_cu = None
+        self._sum_max_mu = None
+
+    @property
+    def sum_max_cu(self):
+        """
+        Total number of compute units of all registered resource models
+        :return:
+        """
+        if self._sum_max_cu is None:
+            self._sum_max_cu = sum([getattr(rm, "dc_max_cu", 0) for rm in self._resource_models.itervalues()])
+        return self._sum_max_cu
+
+    @property
+    def sum_max_mu(self):
+        """
+        Total memory of all registered resource models
+        :return:
+        """
+        if self._sum_max_mu is None:
+            self._sum_max_mu = sum([getattr(rm, "dc_max_mu", 0) for rm in self._resource_models.itervalues()])
+        return self._sum_max_mu
+
+    def close(self):
+        """
+        Finish the pending work of all resource models and write the queued log records.
+        Called when the emulation stops.
+        :return: None
+        """
+        for rm in self._resource_models.itervalues():
+            rm.close()
+        self.log_writer.close()
+
     @property
     def resource_models(self):
         """
@@ -77,6 +127,10 @@ class BaseResourceModel(object):
         self.registrar = None  # pointer to registrar
         self.dcs = list()
         self._allocated_compute_instances = dict()
+        # reservation id -> flavor name of the reserved but not yet created containers
+        self._reservations = dict()
+        self._reservation_counter = 0
+        self._reservation_lock = threading.Lock()
         LOG.info("Resource model %r initialized" % self)
 
     def __repr__(self):
@@ -107,6 +161,82 @@ class BaseResourceModel(object):
             raise Exception("Flavor with name %r already exists!" % fl.name)
         self._flavors[fl.name] = fl
 
+    def get_flavor(self, flavor_name):
+        """
+        Return the flavor with the given name.
+        :param flavor_name: name of the flavor
+        :return: flavor object or None
+        """
+        return self._flavors.get(flavor_name)
+
+    def reserve(self, flavor_name):
+        """
+        Reserve the resources of a flavor before the container is created.
+        Raises NotEnoughResourcesAvailable if they are not available.
+        :param flavor_name: name of the flavor
+        :return: reservation id, to be passed to commit or abort
+        """
+        return self.reserve_many([flavor_name])[0]
+
+    def reserve_many(self, flavor_names):
+        """
+        Reserve the resources of several containers at once (e.g. a whole service).
+        Either all or none of them are reserved.
+        Raises NotEnoughResourcesAvailable if they are not available.
+        :param flavor_names: list of flavor names
+        :return: list of reservation ids
+        """
+        flavor_names = list(flavor_names)
+        with self._reservation_lock:
+            self._book_reservation(flavor_names)
+            ids = []
+            for flavor_name in flavor_names:
+                self._reservation_counter += 1
+                self._reservations[self._reservation_counter] = flavor_name
+                ids.append(self._reservation_counter)
+            return ids
+
+    def commit(self, reservation, d):
+        """
+        Allocate the reserved resources for the created container.
+        :param reservation: reservation id
+        :param d: container object
+        """
+        with self._reservation_lock:
+            flavor_name = self._reservations.pop(reservation, None)
+            if flavor_name is None:
+                raise Exception("Reservation %r does not exist." % reservation)
+            self._release_reservation(flavor_name)
+            self.allocate(d)
+
+    def abort(self, reservation):
+        """
+        Release reserved resources, e.g. because the container could not be created.
+        :param reservation: reservation id
+        """
+        with self._reservation_lock:
+            flavor_name = self._reservations.pop(reservation, None)
+            if flavor_name is not None:
+                self._release_reservation(flavor_name)
+
+    def _book_reservation(self, flavor_names):
+        """
+        Check and book the resources of a reservation.
+        Has to be overwritten by a real resource model that limits resources.
+        :param flavor_names: list of flavor names
+        """
+        for flavor_name in flavor_names:
+            if flavor_name not in self._flavors:
+                raise Exception("Flavor %r does not exist" % flavor_name)
+
+    def _release_reservation(self, flavor_name):
+        """
+        Release the booked resources of a single reserved container.
+        Has to be overwritten by a real resource model that limits resources.
+        :param flavor_name: flavor name
+        """
+        pass
+
     def allocate(self, d):
         """
         This method has to be overwritten by a real resource model.
@@ -159,6 +289,260 @@ class BaseResourceModel(object):
         """
         pass
 
+    def close(self):
+        """
+        Finish pending work of the resource model, called when the emulation stops.
+        :return: None
+        """
+        pass
+
+
+class LimitApplier(object):
+    """
+    Applies the cpu/memory limit changes of the containers of a resource model.
+    The changes of an allocation event are collected per container (a later
+    change of the same container replaces an earlier one) and applied at once,
+    by up to max_workers threads. With a window > 0, the changes of all events
+    within the window are coalesced and applied in the background.
+    """
+
+    def __init__(self, max_workers=4, window=0.0):
+        """
+        :param max_workers: max. number of containers updated in parallel
+        :param window: seconds to wait for more changes before applying them, 0 = apply at the end of each event
+        """
+        self.max_workers = max_workers
+        self.window = window
+        # container name -> [container, (cpu_period, cpu_quota) or None, mem_limit or None]
+        self._pending = dict()
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pool = None
+        # statistics
+        self.applied = 0
+        self.coalesced = 0
+        self.last_apply_count = 0
+        self.last_apply_latency = 0.0
+        self.total_apply_latency = 0.0
+
+    def _entry(self, d):
+        entry = self._pending.get(d.name)
+        if entry is None:
+            entry = [d, None, None]
+            self._pending[d.name] = entry
+        return entry
+
+    def set_cpu(self, d, cpu_period, cpu_quota):
+        """
+        Request a CFS limit for a container, nothing is done if it is already set.
+        """
+        with self._lock:
+            if d.cpu_period == cpu_period and d.cpu_quota == cpu_quota:
+                # the limit is already set, drop an older change
+                if d.name in self._pending:
+                    self._pending[d.name][1] = None
+                return
+            entry = self._entry(d)
+            if entry[1] is not None:
+                self.coalesced += 1
+            entry[1] = (cpu_period, cpu_quota)
+
+    def set_mem(self, d, mem_limit):
+        """
+        Request a memory limit for a container, nothing is done if it is already set.
+        """
+        with self._lock:
+            if d.mem_limit == mem_limit:
+                if d.name in self._pending:
+                    self._pending[d.name][2] = None
+                return
+            entry = self._entry(d)
+            if entry[2] is not None:
+                self.coalesced += 1
+            entry[2] = mem_limit
+
+    def discard(self, d):
+        """
+        Drop the pending changes of a container, e.g. because it was removed.
+        """
+        with self._lock:
+            self._pending.pop(d.name, None)
+
+    def apply(self):
+        """
+        End of an allocation event: apply the pending changes now or after the window.
+        """
+        if self.window <= 0:
+            self.flush()
+            return
+        with self._lock:
+            if self._timer is not None or len(self._pending) < 1:
+                return
+            self._timer = threading.Timer(self.window, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+        Apply all pending changes.
+        :return: number of updated containers
+        """
+        with self._lock:
+            self._timer = None
+            entries = [e for e in self._pending.itervalues() if e[1] is not None or e[2] is not None]
+            self._pending = dict()
+        if len(entries) < 1:
+            return 0
+        start = time.time()
+        if len(entries) == 1 or self.max_workers <= 1:
+            for entry in entries:
+                self._apply_entry(entry)
+        else:
+            if self._pool is None:
+                self._pool = ThreadPool(self.max_workers)
+            self._pool.map(self._apply_entry, entries)
+        latency = time.time() - start
+        with self._lock:
+            self.applied += len(entries)
+            self.last_apply_count = len(entries)
+            self.last_apply_latency = latency
+            self.total_apply_latency += latency
+        LOG.debug("Applied the limits of %d containers in %.3fs" % (len(entries), latency))
+        return len(entries)
+
+    def _apply_entry(self, entry):
+        d, cpu, mem_limit = entry
+        try:
+            if cpu is not None:
+                d.updateCpuLimit(cpu_period=int(cpu[0]), cpu_quota=int(cpu[1]))
+            if mem_limit is not None:
+                d.updateMemoryLimit(mem_limit=mem_limit)
+        except Exception as ex:
+            # e.g. the container was removed in the meantime
+            LOG.warning("Could not update the limits of %r: %s" % (d.name, ex))
+
+    def get_stats(self):
+        return {"applied": self.applied,
+                "coalesced": self.coalesced,
+                "last_apply_count": self.last_apply_count,
+                "last_apply_latency": self.last_apply_latency,
+                "total_apply_latency": self.total_apply_latency}
+
+    def close(self):
+        """
+        Apply the pending changes and stop the worker threads.
+        """
+        with self._lock:
+            timer = self._timer
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+class ResourceLogWriter(object):
+    """
+    Appends the log records of resource models (e.g. for experiments) in a
+    background thread. The records are queued (bounded, write() blocks if the
+    queue is full) and written in batches as JSON lines to long-lived file
+    handles, one per log path.
+    """
+    _STOP = object()
+
+    def __init__(self, max_queue=10000, batch_size=256):
+        """
+        :param max_queue: max. number of records waiting to be written
+        :param batch_size: max. number of records written at once
+        """
+        self.batch_size = batch_size
+        self._queue = Queue.Queue(max_queue)
+        # log path -> open file
+        self._files = dict()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+
+    def write(self, path, record):
+        """
+        Queue a record.
+        :param path: log file to which the record is appended
+        :param record: dict, must not be changed afterwards
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put((path, record))
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            try:
+                while len(items) < self.batch_size:
+                    items.append(self._queue.get_nowait())
+            except Queue.Empty:
+                pass
+            try:
+                stop = self._write_batch(items)
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, items):
+        """
+        :return: True if the writer was stopped
+        """
+        stop = False
+        lines = dict()
+        for item in items:
+            if item is self._STOP:
+                stop = True
+                continue
+            path, record = item
+            try:
+                lines.setdefault(path, []).append(json.dumps(record, separators=(",", ":")))
+            except (TypeError, ValueError) as ex:
+                LOG.warning("Could not serialize log record: %s" % ex)
+        for path, l in lines.iteritems():
+            try:
+                f = self._files.get(path)
+                if f is None:
+                    f = open(path, "a")
+                    self._files[path] = f
+                f.write("\n".join(l) + "\n")
+                f.flush()
+                self.written += len(l)
+            except IOError as ex:
+                LOG.warning("Could not write to log %r: %s" % (path, ex))
+        return stop
+
+    def flush(self):
+        """
+        Wait until all queued records are written.
+        """
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """
+        Write all queued records, stop the thread and close the files.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(self._STOP)
+            thread.join()
+        for f in self._files.itervalues():
+            f.close()
+        self._files = dict()
+
 
 class NotEnoughResourcesAvailable(BaseException):
     pass
@@ -2,9 +2,8 @@
 Playground for resource models created by University of Paderborn.
 """
 import time
-import json
 import logging
-from emuvim.dcemulator.resourcemodel import BaseResourceModel, NotEnoughResourcesAvailable
+from emuvim.dcemulator.resourcemodel import BaseResourceModel, NotEnoughResourcesAvailable, LimitApplier
 
 LOG = logging.getLogger("rm.upb.simple")
 LOG.setLevel(logging.DEBUG)
@@ -22,17 +21,28 @@ class UpbSimpleCloudDcRM(BaseResourceModel):
 
     def __init__(self, max_cu=32, max_mu=1024,
                  deactivate_cpu_limit=False,
-                 deactivate_mem_limit=False):
+                 deactivate_mem_limit=False,
+                 limit_workers=4,
+                 limit_window=0.0,
+                 log_format="full"):
         """
         Initialize model.
         :param max_cu: Maximum number of compute units available in this DC.
         :param max_mu: Maximum memory of entire dc.
+        :param limit_workers: max. number of containers whose limits are updated in parallel
+        :param limit_window: coalesce the limit updates of all allocations within this many seconds
+                             (0 = the limits are set before allocate/free returns)
+        :param log_format: "full" logs the container status and the complete state of the model per event,
+                           "delta" only the limits of the changed container and the allocation counters
         :return:
         """
         self.dc_max_cu = max_cu
         self.dc_max_mu = max_mu
         self.dc_alloc_cu = 0
         self.dc_alloc_mu = 0
+        # resources of reserved containers that are not yet created (see reserve)
+        self.dc_reserved_cu = 0
+        self.dc_reserved_mu = 0
         self.deactivate_cpu_limit = deactivate_cpu_limit
         self.deactivate_mem_limit = deactivate_mem_limit
         self.single_cu = 0
@@ -41,8 +51,35 @@ class UpbSimpleCloudDcRM(BaseResourceModel):
         self.mem_op_factor = 1.0
         self.raise_no_cpu_resources_left = True
         self.raise_no_mem_resources_left = True
+        # (single_cu, single_mu) used for the limits that are currently applied
+        self._applied_factors = None
+        # collects the limit changes of an allocation event and applies them at once
+        self.limit_applier = LimitApplier(max_workers=limit_workers, window=limit_window)
+        # the allocation log (see _write_log) is written in the background by the registrar's log writer
+        self.log_format = log_format
         super(UpbSimpleCloudDcRM, self).__init__()
 
+    @property
+    def dc_max_cu(self):
+        return self._dc_max_cu
+
+    @dc_max_cu.setter
+    def dc_max_cu(self, value):
+        # the compute unit of all DCs depends on the total capacity
+        self._dc_max_cu = value
+        if getattr(self, "registrar", None) is not None:
+            self.registrar.invalidate()
+
+    @property
+    def dc_max_mu(self):
+        return self._dc_max_mu
+
+    @dc_max_mu.setter
+    def dc_max_mu(self, value):
+        self._dc_max_mu = value
+        if getattr(self, "registrar", None) is not None:
+            self.registrar.invalidate()
+
     def allocate(self, d):
         """
         Allocate resources for the given container.
@@ -55,7 +92,7 @@ class UpbSimpleCloudDcRM(BaseResourceModel):
             self._allocate_cpu(d)
         if not self.deactivate_mem_limit:
             self._allocate_mem(d)
-        self._apply_limits()
+        self._apply_limits(changed=[d])
 
     def _allocate_cpu(self, d):
         """
@@ -65,7 +102,7 @@ class UpbSimpleCloudDcRM(BaseResourceModel):
         """
         fl_cu = self._get_flavor(d).get("compute")
         # check for over provisioning
-        if self.dc_alloc_cu + fl_cu > self.dc_max_cu and self.raise_no_cpu_resources_left:
+        if self.dc_alloc_cu + self.dc_reserved_cu + fl_cu > self.dc_max_cu and self.raise_no_cpu_resources_left:
             raise NotEnoughResourcesAvailable("Not enough compute resources left.")
         self.dc_alloc_cu += fl_cu
 
@@ -77,10 +114,45 @@ class UpbSimpleCloudDcRM(BaseResourceModel):
         """
         fl_mu = self._get_flavor(d).get("memory")
         # check for over provisioning
-        if self.dc_alloc_mu + fl_mu > self.dc_max_mu and self.raise_no_mem_resources_left:
+        if self.dc_alloc_mu + self.dc_reserved_mu + fl_mu > self.dc_max_mu and self.raise_no_mem_resources_left:
             raise NotEnoughResourcesAvailable("Not enough memory resources left.")
         self.dc_alloc_mu += fl_mu
 
+    def _book_reservation(self, flavor_names):
+        """
+        Check if the flavors fit in addition to the allocated and reserved resources, and book them.
+        :param flavor_names: list of flavor names
+        :return:
+        """
+        cu = 0
+        mu = 0
+        for flavor_name in flavor_names:
+            if flavor_name not in self._flavors:
+                raise Exception("Flavor %r does not exist" % flavor_name)
+            cu += self._flavors[flavor_name].get("compute")
+            mu += self._flavors[flavor_name].get("memory")
+        if not self.deactivate_cpu_limit:
+            if self.dc_alloc_cu + self.dc_reserved_cu + cu > self.dc_max_cu and self.raise_no_cpu_resources_left:
+                raise NotEnoughResourcesAvailable("Not enough compute resources left.")
+        if not self.deactivate_mem_limit:
+            if self.dc_alloc_mu + self.dc_reserved_mu + mu > self.dc_max_mu and self.raise_no_mem_resources_left:
+                raise NotEnoughResourcesAvailable("Not enough memory resources left.")
+        if not self.deactivate_cpu_limit:
+            self.dc_reserved_cu += cu
+        if not self.deactivate_mem_limit:
+            self.dc_reserved_mu += mu
+
+    def _release_reservation(self, flavor_name):
+        """
+        Release the booked resources of a reserved container.
+        :param flavor_name: flavor name
+        :return:
+        """
+        if not self.deactivate_cpu_limit:
+            self.dc_reserved_cu -= self._flavors[flavor_name].get("compute")
+        if not self.deactivate_mem_limit:
+            self.dc_reserved_mu -= self._flavors[flavor_name].get("memory")
+
     def free(self, d):
         """
         Free resources allocated to the given container.
@@ -88,11 +160,12 @@ class UpbSimpleCloudDcRM(BaseResourceModel):
         :return:
         """
         del self._allocated_compute_instances[d.name]
+        self.limit_applier.discard(d)
         if not self.deactivate_cpu_limit:
             self._free_cpu(d)
         if not self.deactivate_mem_limit:
             self._free_mem(d)
-        self._apply_limits()
+        self._apply_limits(changed=[])
 
     def _free_cpu(self, d):
         """
@@ -110,37 +183,59 @@ class UpbSimpleCloudDcRM(BaseResourceModel):
         """
         self.dc_alloc_mu -= self._get_flavor(d).get("memory")
 
-    def _apply_limits(self):
-        """
-        Recalculate real resource limits for all allocated containers and apply them
-        to their cgroups.
-        We have to recalculate for all containers to allow e.g. over provisioning models.
+    def _apply_limits(self, changed=None):
+        """
+        Recalculate real resource limits and apply them to the cgroups of the containers.
+        The share of a single CU/MU is calculated once. If it did not change since
+        the limits were last applied, only the given containers are updated.
+        Otherwise all allocated containers are recalculated (e.g. over provisioning models,
+        or another DC changed the total capacity).
+        :param changed: containers that were just allocated, None = all allocated containers
         :return:
         """
-        for d in self._allocated_compute_instances.itervalues():
+        # calculate cpu time and memory fraction of a single compute/memory unit
+        if not self.deactivate_cpu_limit:
+            self.single_cu = self._compute_single_cu()
+        if not self.deactivate_mem_limit:
+            self.single_mu = self._compute_single_mu()
+        factors = (self.single_cu, self.single_mu)
+        if changed is None or factors != self._applied_factors:
+            changed = self._allocated_compute_instances.values()
+        self._applied_factors = factors
+        # limits per flavor
+        cpu_limits = dict()
+        mem_limits = dict()
+        for d in changed:
             if not self.deactivate_cpu_limit:
-                self._apply_cpu_limits(d)
+                self._apply_cpu_limits(d, cpu_limits)
             if not self.deactivate_mem_limit:
-                self._apply_mem_limits(d)
+                self._apply_mem_limits(d, mem_limits)
+        self.limit_applier.apply()
 
-    def _apply_cpu_limits(self, d):
+    def _apply_cpu_limits(self, d, cache=None):
         """
         Calculate real CPU limit (CFS bandwidth) and apply.
+        Uses the share of a single CU calculated by _apply_limits.
         :param d: container
+        :param cache: dict flavor name -> CFS values, filled for the next containers
         :return:
         """
-        number_cu = self._get_flavor(d).get("compute")
-        # calculate cpu time fraction of a single compute unit
-        self.single_cu = self._compute_single_cu()
-        # calculate cpu time fraction for container with given flavor
-        cpu_time_percentage = self.single_cu * number_cu
-        # calculate input values for CFS scheduler bandwidth limitation
-        cpu_period, cpu_quota = self._calculate_cpu_cfs_values(cpu_time_percentage)
-        # apply limits to container if changed
+        if cache is not None and d.flavor_name in cache:
+            cpu_time_percentage, cpu_period, cpu_quota = cache[d.flavor_name]
+        else:
+            number_cu = self._get_flavor(d).get("compute")
+            # calculate cpu time fraction for container with given flavor
+            cpu_time_percentage = self.single_cu * number_cu
+            # calculate input values for CFS scheduler bandwidth limitation
+            cpu_period, cpu_quota = self._calculate_cpu_cfs_values(cpu_time_percentage)
+            if cache is not None:
+                cache[d.flavor_name] = (cpu_time_percentage, cpu_period, cpu_quota)
+        # apply limits to container if changed (at the end of the event, see LimitApplier)
+        cpu_period, cpu_quota = int(cpu_period), int(cpu_quota)
         if d.cpu_period != cpu_period or d.cpu_quota != cpu_quota:
             LOG.debug("Setting CPU limit for %r: cpu_quota = cpu_period * limit = %f * %f = %f (op_factor=%f)" % (
                       d.name, cpu_period, cpu_time_percentage, cpu_quota, self.cpu_op_factor))
-            d.updateCpuLimit(cpu_period=int(cpu_period), cpu_quota=int(cpu_quota))
+        self.limit_applier.set_cpu(d, cpu_period, cpu_quota)
 
     def _compute_single_cu(self):
         """
@@ -150,7 +245,17 @@ class UpbSimpleCloudDcRM(BaseResourceModel):
         # get cpu time fraction for entire emulation
         e_cpu = self.registrar.e_cpu
         # calculate
-        return float(e_cpu) / sum([rm.dc_max_cu for rm in list(self.registrar.resource_models)])
+        return float(e_cpu) / self.registrar.sum_max_cu
+
+    def _compute_single_mu(self):
+        """
+        Calculate the amount of memory of a single MU unit.
+        :return:
+        """
+        # get memory amount for entire emulation
+        e_mem = self.registrar.e_mem
+        # calculate
+        return float(e_mem) / self.registrar.sum_max_mu
 
     def _calculate_cpu_cfs_values(self, cpu_time_percentage):
         """
@@ -168,25 +273,28 @@ class UpbSimpleCloudDcRM(BaseResourceModel):
             LOG.warning("Increased CPU quota to avoid system error.")
         return cpu_period, cpu_quota
 
-    def _apply_mem_limits(self, d):
+    def _apply_mem_limits(self, d, cache=None):
         """
         Calculate real mem limit and apply.
+        Uses the amount of memory of a single MU calculated by _apply_limits.
         :param d: container
+        :param cache: dict flavor name -> mem limit, filled for the next containers
         :return:
         """
-        number_mu = self._get_flavor(d).get("memory")
-        # get memory amount for entire emulation
-        e_mem = self.registrar.e_mem
-        # calculate amount of memory for a single mu
-        self.single_mu = float(e_mem) / sum([rm.dc_max_mu for rm in list(self.registrar.resource_models)])
-        # calculate mem for given flavor
-        mem_limit = self.single_mu * number_mu
-        mem_limit = self._calculate_mem_limit_value(mem_limit)
-        # apply to container if changed
+        if cache is not None and d.flavor_name in cache:
+            mem_limit = cache[d.flavor_name]
+        else:
+            number_mu = self._get_flavor(d).get("memory")
+            # calculate mem for given flavor
+            mem_limit = self.single_mu * number_mu
+            mem_limit = self._calculate_mem_limit_value(mem_limit)
+            if cache is not None:
+                cache[d.flavor_name] = mem_limit
+        # apply to container if changed (at the end of the event, see LimitApplier)
         if d.mem_limit != mem_limit:
             LOG.debug("Setting MEM limit for %r: mem_limit = %f MB (op_factor=%f)" %
                       (d.name, mem_limit/1024/1024, self.mem_op_factor))
-            d.updateMemoryLimit(mem_limit=mem_limit)
+        self.limit_applier.set_mem(d, mem_limit)
 
     def _calculate_mem_limit_value(self, mem_limit):
         """
@@ -225,13 +333,23 @@ class UpbSimpleCloudDcRM(BaseResourceModel):
         r["dc_max_mu"] = self.dc_max_mu
         r["dc_alloc_cu"] = self.dc_alloc_cu
         r["dc_alloc_mu"] = self.dc_alloc_mu
+        r["dc_reserved_cu"] = self.dc_reserved_cu
+        r["dc_reserved_mu"] = self.dc_reserved_mu
         r["single_cu_percentage"] = self.single_cu
         r["single_mu_percentage"] = self.single_mu
         r["cpu_op_factor"] = self.cpu_op_factor
         r["mem_op_factor"] = self.mem_op_factor
         r["allocation_state"] = allocation_state
+        r["limit_updates"] = self.limit_applier.get_stats()
         return r
 
+    def close(self):
+        """
+        Apply the pending limit changes and stop the worker threads.
+        :return:
+        """
+        self.limit_applier.close()
+
     def _get_flavor(self, d):
         """
         Get flavor assigned to given container.
@@ -256,12 +374,42 @@ class UpbSimpleCloudDcRM(BaseResourceModel):
         # we have a path: write out RM info
         l = dict()
         l["t"] = time.time()
-        l["container_state"] = d.getStatus()
         l["action"] = action
-        l["rm_state"] = self.get_state_dict()
-        # append to logfile
-        with open(path, "a") as f:
-            f.write("%s\n" % json.dumps(l))
+        if self.log_format == "delta":
+            l["container"] = self._get_container_limits(d)
+            l["rm_counters"] = self._get_counters()
+        else:
+            l["container_state"] = d.getStatus()
+            l["rm_state"] = self.get_state_dict()
+        # appended to the logfile in the background
+        self.registrar.log_writer.write(path, l)
+
+    def _get_container_limits(self, d):
+        """
+        Limits of a single container, used by the delta log format.
+        :param d: container
+        :return:
+        """
+        return {"name": d.name,
+                "flavor_name": d.flavor_name,
+                "cpu_period": d.cpu_period,
+                "cpu_quota": d.cpu_quota,
+                "mem_limit": d.mem_limit}
+
+    def _get_counters(self):
+        """
+        Aggregated allocation state, used by the delta log format.
+        :return:
+        """
+        return {"dc_alloc_cu": self.dc_alloc_cu,
+                "dc_alloc_mu": self.dc_alloc_mu,
+                "dc_reserved_cu": self.dc_reserved_cu,
+                "dc_reserved_mu": self.dc_reserved_mu,
+                "n_allocated": len(self._allocated_compute_instances),
+                "single_cu_percentage": self.single_cu,
+                "single_mu_percentage": self.single_mu,
+                "cpu_op_factor": self.cpu_op_factor,
+                "mem_op_factor": self.mem_op_factor}
 
 
 class UpbOverprovisioningCloudDcRM(UpbSimpleCloudDcRM):
@@ -287,7 +435,7 @@ class UpbOverprovisioningCloudDcRM(UpbSimpleCloudDcRM):
         # calculate over provisioning scale factor
         self.cpu_op_factor = float(self.dc_max_cu) / (max(self.dc_max_cu, self.dc_alloc_cu))
         # calculate
-        return float(e_cpu) / sum([rm.dc_max_cu for rm in list(self.registrar.resource_models)]) * self.cpu_op_factor
+        return float(e_cpu) / self.registrar.sum_max_cu * self.cpu_op_factor
 
 
 class UpbDummyRM(UpbSimpleCloudDcRM):
@@ -298,7 +446,7 @@ class UpbDummyRM(UpbSimpleCloudDcRM):
         super(UpbDummyRM, self).__init__(*args, **kvargs)
         self.raise_no_cpu_resources_left = False
 
-    def _apply_limits(self):
+    def _apply_limits(self, changed=None):
         # do nothing here
         pass
 
@@ -0,0 +1,173 @@
+"""
+Distributed Cloud Emulator (dcemulator)
+HTTP client used to talk to the REST API of the SDN controller (Ryu).
+"""
+import httplib
+import select
+import socket
+import time
+import logging
+import threading
+import Queue
+
+LOG = logging.getLogger("dcemulator.restclient")
+LOG.setLevel(logging.DEBUG)
+
+
+class RestClient(object):
+    """
+    Thread-safe HTTP client that keeps a pool of persistent (keep-alive)
+    connections to a single REST API.
+    The number of connections that are used at the same time is bounded,
+    callers block until a connection becomes available.
+    """
+
+    # requests that can be sent again if a pooled connection was closed by the server
+    IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+    def __init__(self, host, port, max_connections=8, timeout=5.0, max_idle=2.0):
+        """
+        :param host: IP or hostname of the REST API
+        :param port: port of the REST API
+        :param max_connections: max. number of concurrently used connections
+        :param timeout: socket timeout in seconds for each request
+        :param max_idle: idle connections older than this (in seconds) are not reused
+        """
+        self.host = host
+        self.port = int(port)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_idle = max_idle
+        # idle connections, LIFO to reuse the connections that are most likely still open
+        self._idle = self._create_queue()
+        self._slots = self._create_semaphore(max_connections)
+
+    def _create_queue(self):
+        return Queue.LifoQueue()
+
+    def _create_semaphore(self, value):
+        return threading.BoundedSemaphore(value)
+
+    def _create_connection(self):
+        return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            conn = self._idle.get_nowait()
+        except Queue.Empty:
+            return self._create_connection()
+        # the server might have closed an idle connection, a request sent on it
+        # fails and can not be retried if it is not idempotent
+        if conn.sock is not None and (time.time() - conn.last_used > self.max_idle or _closed_by_peer(conn.sock)):
+            # httplib reconnects on the next request
+            conn.close()
+        return conn
+
+    def _release(self, conn):
+        conn.last_used = time.time()
+        self._idle.put(conn)
+        self._slots.release()
+
+    def request(self, method, path, body=None):
+        """
+        Send a single request.
+        :param method: HTTP method, e.g., GET or POST
+        :param path: URL path, e.g., /stats/port/1
+        :param body: request body (string) or None
+        :return: tuple (status, data), status is None if the request failed
+        """
+        return self.request_many(method, [(path, body)])[0]
+
+    def request_many(self, method, requests):
+        """
+        Send a list of requests back to back over one pooled connection.
+        :param method: HTTP method used for all requests
+        :param requests: list of (path, body) tuples
+        :return: list of (status, data) tuples, one for each request
+        """
+        results = []
+        conn = self._acquire()
+        try:
+            for path, body in requests:
+                results.append(self._send(conn, method, path, body))
+        finally:
+            self._release(conn)
+        return results
+
+    def _send(self, conn, method, path, body):
+        headers = {'Connection': 'keep-alive'}
+        # a pooled connection might have been closed by the server in the meantime,
+        # so we retry once on a fresh connection (but not after a timeout).
+        # Requests that were sent completely are only retried if they are idempotent,
+        # the server might have processed them (e.g. a flow entry would be added twice).
+        reused = conn.sock is not None
+        while True:
+            sent = False
+            try:
+                conn.request(method, path, body, headers)
+                sent = True
+                response = conn.getresponse()
+                # the response has to be read completely before the connection can be reused
+                return response.status, response.read()
+            except socket.timeout as ex:
+                conn.close()
+                LOG.info("%s %s timed out: %s" % (method, path, ex))
+                break
+            except (httplib.HTTPException, socket.error) as ex:
+                # httplib reconnects on the next request
+                conn.close()
+                if not reused or (sent and method not in self.IDEMPOTENT_METHODS):
+                    LOG.info("%s %s failed: %s" % (method, path, ex))
+                    break
+                reused = False
+        return None, None
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Queue.Empty:
+                break
+
+
+def _closed_by_peer(sock):
+    """
+    An idle keep-alive socket only becomes readable if the server closed it
+    (or sent something we did not ask for), so it must not be reused.
+    """
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return True
+    return len(readable) > 0
+
+
+class _GeventHTTPConnection(httplib.HTTPConnection):
+
+    def connect(self):
+        import gevent.socket
+        self.sock = gevent.socket.create_connection((self.host, self.port), self.timeout)
+
+
+class GeventRestClient(RestClient):
+    """
+    RestClient variant that only uses gevent primitives. Waiting for a free
+    connection or a reply yields to other greenlets instead of blocking
+    the whole process (e.g. when used from zerorpc handlers).
+    gevent is only imported if this client is used.
+    """
+
+    def _create_queue(self):
+        import gevent.queue
+        return gevent.queue.LifoQueue()
+
+    def _create_semaphore(self, value):
+        import gevent.lock
+        return gevent.lock.BoundedSemaphore(value)
+
+    def _create_connection(self):
+        return _GeventHTTPConnection(self.host, self.port, timeout=self.timeout)
@@ -0,0 +1,109 @@
+"""
+Distributed Cloud Emulator (dcemulator)
+Decoding of the statistics replies of Ryu's ofctl_rest API.
+"""
+import json
+import logging
+
+LOG = logging.getLogger("dcemulator.ryustats")
+LOG.setLevel(logging.DEBUG)
+
+
+def decode(payload):
+    """
+    Decode a JSON reply of Ryu (or Prometheus).
+    :param payload: reply body (string)
+    :return: decoded object or None if the payload is no valid JSON
+    """
+    try:
+        return json.loads(payload)
+    except ValueError as ex:
+        LOG.info("Could not decode reply: %s" % ex)
+        return None
+
+
+def parse_port_stats(payload, dpid, ports=None):
+    """
+    Decode a stats/port reply and index it by port number.
+    :param payload: reply body of stats/port/<dpid>
+    :param dpid: dpid of the switch (int)
+    :param ports: optional set of port numbers, all other ports are skipped
+    :return: dict port_no -> port stats dict, None if the payload could not be decoded
+    """
+    stats = decode(payload)
+    if stats is None:
+        return None
+    result = {}
+    for port_stat in stats.get(str(dpid), []):
+        try:
+            port_no = int(port_stat['port_no'])
+        except (KeyError, TypeError, ValueError):
+            # e.g. the LOCAL port
+            continue
+        if ports is not None and port_no not in ports:
+            continue
+        result[port_no] = port_stat
+    return result
+
+
+def uptime(stat):
+    """
+    Uptime in seconds of a port or flow stats entry.
+    """
+    return stat['duration_sec'] + stat['duration_nsec'] * 10 ** (-9)
+
+
+def parse_flow_stats(payload, dpid):
+    """
+    Decode a stats/flow reply (all flows of a switch) and group the entries by cookie.
+    :param payload: reply body of stats/flow/<dpid>
+    :param dpid: dpid of the switch (int)
+    :return: dict cookie -> list of flow stats dicts, None if the payload could not be decoded
+    """
+    stats = decode(payload)
+    if stats is None:
+        return None
+    result = {}
+    for flow_stat in stats.get(str(dpid), []):
+        result.setdefault(int(flow_stat.get('cookie', 0)), []).append(flow_stat)
+    return result
+
+
+def output_ports(flow_stat):
+    """
+    Ports to which a flow entry sends its packets (OUTPUT actions).
+    """
+    ports = set()
+    for action in flow_stat.get('actions', []):
+        if isinstance(action, basestring) and action.startswith('OUTPUT:'):
+            try:
+                ports.add(int(action[len('OUTPUT:'):]))
+            except ValueError:
+                # e.g. OUTPUT:CONTROLLER
+                continue
+    return ports
+
+
+def aggregate_flow_stats(flow_stats, in_port=None, out_port=None):
+    """
+    Sum up the counters of all flow entries that match the given ports.
+    :param flow_stats: list of flow stats dicts (e.g. all entries of one cookie)
+    :param in_port: only count entries that match on this in_port
+    :param out_port: only count entries that output to this port
+    :return: tuple (byte_count, packet_count, uptime) or None if no entry matches,
+             uptime is the one of the oldest entry
+    """
+    byte_count = 0
+    packet_count = 0
+    max_uptime = None
+    for flow_stat in flow_stats:
+        if in_port is not None and str(flow_stat.get('match', {}).get('in_port')) != str(in_port):
+            continue
+        if out_port is not None and int(out_port) not in output_ports(flow_stat):
+            continue
+        byte_count += int(flow_stat['byte_count'])
+        packet_count += int(flow_stat['packet_count'])
+        max_uptime = max(max_uptime, uptime(flow_stat))
+    if max_uptime is None:
+        return None
+    return byte_count, packet_count, max_uptime
@@ -0,0 +1,176 @@
+"""
+Distributed Cloud Emulator (dcemulator)
+Allocation of the VLAN tags used to isolate the SDN paths of chains.
+"""
+import logging
+
+LOG = logging.getLogger("dcemulator.vlan")
+LOG.setLevel(logging.DEBUG)
+
+
+class VlanAllocator(object):
+    """
+    Keeps track of the VLAN tags in use with a bitmap and remembers
+    the owner (e.g. a chain) of each allocated tag, so that tags can be
+    given back when the owner is removed.
+
+    Ranges of tags can be reserved for a pool (e.g. a data center label).
+    Tags of a reserved range are only handed out to allocations for
+    this pool, all other allocations use the remaining (shared) tags.
+    """
+
+    def __init__(self, first=1, last=4094):
+        """
+        :param first: lowest usable tag (0 is the 802.1Q priority tag)
+        :param last: highest usable tag (4095 is reserved by 802.1Q)
+        """
+        self.first = first
+        self.last = last
+        size = (last >> 3) + 1
+        # one bit per tag: tag in use / tag belongs to a reserved range
+        self._used = bytearray(size)
+        self._reserved = bytearray(size)
+        # tag -> owner and owner -> set of tags
+        self._owners = dict()
+        self._tags_by_owner = dict()
+        # pool -> (first, last)
+        self._ranges = dict()
+        # pool -> tag at which the search for a free tag starts,
+        # rotating avoids that a just released tag is handed out again immediately
+        self._cursors = dict()
+        # counters
+        self.n_allocations = 0
+        self.n_releases = 0
+        self.n_failures = 0
+        self.high_watermark = 0
+
+    def reserve_range(self, pool, first, last):
+        """
+        Reserve the tags first..last (inclusive) for the given pool.
+        """
+        if pool in self._ranges:
+            raise Exception("VLAN range for %r already reserved." % pool)
+        if first < self.first or last > self.last or first > last:
+            raise Exception("Invalid VLAN range %d-%d." % (first, last))
+        for tag in range(first, last + 1):
+            if self._is_set(self._reserved, tag):
+                raise Exception("VLAN range %d-%d overlaps with another reserved range." % (first, last))
+            if self._is_set(self._used, tag):
+                raise Exception("VLAN %d of range %d-%d is already in use." % (tag, first, last))
+        for tag in range(first, last + 1):
+            self._set(self._reserved, tag)
+        self._ranges[pool] = (first, last)
+        LOG.info("Reserved VLAN range %d-%d for %r" % (first, last, pool))
+
+    def allocate(self, owner, pool=None):
+        """
+        Allocate a free tag.
+        :param owner: hashable identifier of the user of the tag
+        :param pool: use the reserved range of this pool, shared tags are used if it has none
+        :return: tag or None if no tag is left
+        """
+        if pool in self._ranges:
+            first, last = self._ranges[pool]
+            tag = self._find_free(pool, first, last, self._used)
+        else:
+            pool = None
+            tag = self._find_free(pool, self.first, self.last, self._used, self._reserved)
+        if tag is None:
+            self.n_failures += 1
+            LOG.warning("No free VLAN tag left (pool %r)" % pool)
+            return None
+        self._set(self._used, tag)
+        self._owners[tag] = owner
+        self._tags_by_owner.setdefault(owner, set()).add(tag)
+        self._cursors[pool] = tag + 1
+        self.n_allocations += 1
+        self.high_watermark = max(self.high_watermark, len(self._owners))
+        return tag
+
+    def release(self, tag):
+        """
+        Give back a single tag.
+        """
+        owner = self._owners.pop(tag, None)
+        if owner is None:
+            return
+        self._clear(self._used, tag)
+        tags = self._tags_by_owner[owner]
+        tags.discard(tag)
+        if not tags:
+            del self._tags_by_owner[owner]
+        self.n_releases += 1
+
+    def release_owner(self, owner):
+        """
+        Give back all tags of the given owner.
+        :return: list of released tags
+        """
+        tags = list(self._tags_by_owner.get(owner, []))
+        for tag in tags:
+            self.release(tag)
+        return tags
+
+    def owner(self, tag):
+        return self._owners.get(tag)
+
+    def tags(self, owner):
+        return sorted(self._tags_by_owner.get(owner, []))
+
+    def get_stats(self):
+        """
+        Utilization counters, e.g., for monitoring.
+        """
+        total = self.last - self.first + 1
+        pools = dict()
+        for pool, (first, last) in self._ranges.iteritems():
+            pools[pool] = {"total": last - first + 1,
+                           "allocated": self._count(self._used, first, last)}
+        return {"total": total,
+                "allocated": len(self._owners),
+                "free": total - len(self._owners),
+                "high_watermark": self.high_watermark,
+                "allocations": self.n_allocations,
+                "releases": self.n_releases,
+                "failures": self.n_failures,
+                "pools": pools}
+
+    def __len__(self):
+        return len(self._owners)
+
+    def _find_free(self, pool, first, last, *bitmaps):
+        """
+        Search a tag in first..last that is not set in any of the bitmaps,
+        starting at the cursor of the pool and wrapping around.
+        """
+        start = min(max(self._cursors.get(pool, first), first), last + 1)
+        for lo, hi in [(start, last), (first, start - 1)]:
+            tag = lo
+            while tag <= hi:
+                # skip 8 tags at once if the whole byte is occupied
+                if tag & 7 == 0 and tag + 7 <= hi:
+                    mask = 0
+                    for bm in bitmaps:
+                        mask |= bm[tag >> 3]
+                    if mask == 0xff:
+                        tag += 8
+                        continue
+                if not any(self._is_set(bm, tag) for bm in bitmaps):
+                    return tag
+                tag += 1
+        return None
+
+    def _count(self, bitmap, first, last):
+        return sum(1 for tag in range(first, last + 1) if self._is_set(bitmap, tag))
+
+    @staticmethod
+    def _is_set(bitmap, tag):
+        return bitmap[tag >> 3] & (1 << (tag & 7)) != 0
+
+    @staticmethod
+    def _set(bitmap, tag):
+        bitmap[tag >> 3] |= 1 << (tag & 7)
+
+    @staticmethod
+    def _clear(bitmap, tag):
+        bitmap[tag >> 3] &= ~(1 << (tag & 7)) & 0xff
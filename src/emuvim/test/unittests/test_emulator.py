@@ -6,9 +6,26 @@ Python API.
 Does not test API endpoints. This is done in separated test suites.
 """
 
+import os
 import time
+import shutil
+import httplib
+import tempfile
+import json
+import socket
 import unittest
-from emuvim.dcemulator.node import EmulatorCompute
+import networkx as nx
+from emuvim.dcemulator.node import EmulatorCompute, get_status_list
+from emuvim.dcemulator.net import Chain, ChainRegistry, PathCache, VnfInterface, VnfInterfaceRegistry, \
+    _run_switch_batches
+from emuvim.dcemulator import monitoring
+from emuvim.dcemulator.monitoring import DCNetworkMonitor, MetricSeries, MetricTable, MonitoredMetric, \
+    PollScheduler
+from emuvim.dcemulator.vlan import VlanAllocator
+from emuvim.dcemulator.resourcemodel.upb.simple import UpbSimpleCloudDcRM
+from emuvim.dcemulator.restclient import RestClient
+from emuvim.dcemulator.ryustats import parse_port_stats, parse_flow_stats, aggregate_flow_stats
+from emuvim.dcemulator.cgroupstats import CgroupReader, find_cgroup_file, is_cgroup_v2
 from emuvim.test.base import SimpleTestTopology
 from mininet.node import RemoteController
 
@@ -88,6 +105,66 @@ class testEmulatorTopology( SimpleTestTopology ):
         # stop Mininet network
         self.stopNet()
 
+    def testRemoveParallelLink(self):
+        """
+        Create two links between the same switches and remove one of them
+        by its end points. The graphs have to keep the other link.
+        """
+        # create network
+        self.createNet(nswitches=2, ndatacenter=0, nhosts=0, ndockers=0)
+        # setup links
+        self.net.addLink(self.s[0], self.s[1])
+        link2 = self.net.addLink(self.s[0], self.s[1])
+        self.net.removeLink(node1=self.s[0], node2=self.s[1])
+        # only the first link is removed
+        self.assertEqual(self.net.linksBetween(self.s[0], self.s[1]), [link2])
+        for graph in [self.net.DCNetwork_graph, self.net.switch_graph]:
+            self.assertEqual(graph.number_of_edges('s1', 's2'), 1)
+            self.assertEqual(graph.number_of_edges('s2', 's1'), 1)
+            edge = graph['s1']['s2'].values()[0]
+            self.assertEqual(edge['src_port_nr'], self.s[0].ports[link2.intf1])
+
+    def testSwitchGraph(self):
+        """
+        Paths are computed on a graph that only contains the switches,
+        adding and removing containers does not change it. The switch port
+        of each vnf interface is indexed when its link is added.
+        """
+        # create network
+        self.createNet(nswitches=1, ndatacenter=2, nhosts=0, ndockers=0)
+        # setup links
+        self.net.addLink(self.dc[0], self.s[0])
+        self.net.addLink(self.s[0], self.dc[1])
+        # start Mininet network
+        self.startNet()
+        sw1 = self.dc[0].switch.name
+        sw2 = self.dc[1].switch.name
+        path = self.net.path_cache.shortest_path(sw1, sw2)
+        self.assertEqual(path, [sw1, 's1', sw2])
+        n_edges = self.net.switch_graph.number_of_edges()
+        # add compute resources
+        self.dc[0].startCompute("vnf1", network=[{'id': 'intf1', 'ip': '10.0.10.1/24'}])
+        self.dc[1].startCompute("vnf2", network=[{'id': 'intf2', 'ip': '10.0.10.2/24'}])
+        self.assertTrue("vnf1" in self.net.DCNetwork_graph)
+        self.assertFalse("vnf1" in self.net.switch_graph)
+        self.assertEqual(self.net.switch_graph.number_of_edges(), n_edges)
+        # attachment of the vnf interfaces
+        intf = self.net.getVnfInterface("vnf1")
+        self.assertEqual(intf.vnf_interface, 'intf1')
+        self.assertEqual(intf.switch_name, sw1)
+        edge = self.net.DCNetwork_graph["vnf1"][sw1].values()[0]
+        self.assertEqual(intf.switch_port_nr, edge['dst_port_nr'])
+        self.assertEqual(self.net.getVnfInterface("vnf2:intf2").switch_name, sw2)
+        self.assertTrue(self.net.getVnfInterface("vnf2", "intf1") is None)
+        # removing a container keeps the switch graph and the cached paths
+        self.dc[1].stopCompute("vnf2")
+        self.assertTrue(self.net.getVnfInterface("vnf2") is None)
+        self.assertEqual(self.net.switch_graph.number_of_edges(), n_edges)
+        self.assertEqual(len(self.net.path_cache), 1)
+        self.assertTrue(self.net.path_cache.shortest_path(sw1, sw2) is path)
+        # stop Mininet network
+        self.stopNet()
+
 class testEmulatorNetworking( SimpleTestTopology ):
 
     def testSDNChainingSingleService(self):
@@ -195,6 +272,67 @@ class testEmulatorNetworking( SimpleTestTopology ):
         # stop Mininet network
         self.stopNet()
 
+    def testSDNChainingRollback(self):
+        """
+        Create a two data centers and interconnect them with additional
+        switches between them.
+        Uses Ryu SDN controller.
+        A chain whose flow entries can not be installed is not registered
+        and gives its vlan tag back.
+        """
+        # create network
+        self.createNet(
+            nswitches=3, ndatacenter=2, nhosts=0, ndockers=0,
+            autolinkswitches=True,
+            controller=RemoteController,
+            enable_learning=False)
+        # setup links
+        self.net.addLink(self.dc[0], self.s[0])
+        self.net.addLink(self.s[2], self.dc[1])
+        # start Mininet network
+        self.startNet()
+
+        # add compute resources
+        self.dc[0].startCompute("vnf1", network=[{'id': 'intf1', 'ip': '10.0.10.1/24'}])
+        self.dc[1].startCompute("vnf2", network=[{'id': 'intf2', 'ip': '10.0.10.2/24'}])
+        # the controller does not accept flow entries anymore
+        self.net.stopRyu()
+        self.net.setChain('vnf1', 'vnf2', 'intf1', 'intf2', bidirectional=True, cmd='add-flow', cookie=1)
+        self.assertEqual(self.net.listChains(), [])
+        self.assertEqual(len(self.net.vlans), 0)
+        # stop Mininet network
+        self.stopNet()
+
+    def testSDNChainingDpctlDelete(self):
+        """
+        Create two data centers without an SDN controller, the chains are
+        installed with ovs-ofctl.
+        Two chains leave vnf1 on the same port, deleting the first one
+        does not remove the flow entries of the second one.
+        """
+        # create network
+        self.createNet(nswitches=0, ndatacenter=2, nhosts=0, ndockers=0)
+        # setup links
+        self.net.addLink(self.dc[0], self.dc[1])
+        # start Mininet network
+        self.startNet()
+
+        # add compute resources
+        self.dc[0].startCompute("vnf1", network=[{'id': 'intf1', 'ip': '10.0.10.1/24'}])
+        self.dc[1].startCompute("vnf2", network=[{'id': 'intf2', 'ip': '10.0.10.2/24'}])
+        self.dc[1].startCompute("vnf3", network=[{'id': 'intf3', 'ip': '10.0.10.3/24'}])
+        self.net.setChain('vnf1', 'vnf2', 'intf1', 'intf2', cmd='add-flow')
+        self.net.setChain('vnf1', 'vnf3', 'intf1', 'intf3', cmd='add-flow',
+                          match='dl_type=0x0800,nw_dst=10.0.10.3')
+        self.assertTrue('nw_dst=10.0.10.3' in self.dc[0].switch.dpctl('dump-flows'))
+        # delete the first chain
+        self.net.setChain('vnf1', 'vnf2', 'intf1', 'intf2', cmd='del-flows')
+        self.assertEqual(len(self.net.listChains()), 1)
+        # the entry of the second chain in the first hop is still installed
+        self.assertTrue('nw_dst=10.0.10.3' in self.dc[0].switch.dpctl('dump-flows'))
+        # stop Mininet network
+        self.stopNet()
+
 #@unittest.skip("disabled compute tests for development")
 class testEmulatorCompute( SimpleTestTopology ):
     """
@@ -291,6 +429,35 @@ class testEmulatorCompute( SimpleTestTopology ):
         # stop Mininet network
         self.stopNet()
 
+    def testGetStatusCache(self):
+        """
+        Check that the cached status of compute instances is
+        refreshed after its TTL.
+        """
+        # create network
+        self.createNet(nswitches=0, ndatacenter=1, nhosts=1, ndockers=0)
+        # setup links
+        self.net.addLink(self.dc[0], self.h[0])
+        # start Mininet network
+        self.startNet()
+        # add compute resources
+        vnf1 = self.dc[0].startCompute("vnf1", network=[{'id': 'intf1', 'ip': '10.0.10.1/24'}])
+        s = get_status_list([vnf1])[0]
+        self.assertTrue(s["state"]["Running"])
+        self.assertTrue(s["network"][0]['ip'] == '10.0.10.1')
+        # change the interface without invalidating the cache
+        vnf1.setIP('10.0.10.5', prefixLen=24, intf='intf1')
+        # the cached status is used within the TTL
+        s = get_status_list([vnf1], max_age=60)[0]
+        self.assertTrue(s["network"][0]['ip'] == '10.0.10.1')
+        # the container state did not change, but the interfaces are queried again
+        time.sleep(0.1)
+        s = get_status_list([vnf1], max_age=0.05)[0]
+        self.assertTrue(s["state"]["Running"])
+        self.assertTrue(s["network"][0]['ip'] == '10.0.10.5')
+        # stop Mininet network
+        self.stopNet()
+
     def testConnectivityMultiDC(self):
         """
         Test if compute instances started in different data centers
@@ -373,5 +540,842 @@ class testEmulatorCompute( SimpleTestTopology ):
         # stop Mininet network
         self.stopNet()
 
+    def testStartComputeBatch(self):
+        """
+        Start several compute instances in two DCs with one batch and
+        check that each of them gets its own name and IP.
+        """
+        # create network
+        self.createNet(
+            nswitches=3, ndatacenter=2, nhosts=0, ndockers=0,
+            autolinkswitches=True)
+        # setup links
+        self.net.addLink(self.dc[0], self.s[0])
+        self.net.addLink(self.dc[1], self.s[2])
+        # start Mininet network
+        self.startNet()
+        # add compute resources
+        specs = [{"datacenter": self.dc[i % 2], "name": "vnf%d" % i} for i in range(6)]
+        results = self.net.startComputeBatch(specs)
+        self.assertEqual([r.name for r in results], ["vnf%d" % i for i in range(6)])
+        self.assertTrue(all(r.error is None for r in results))
+        # check number of running nodes
+        self.assertTrue(len(self.getContainernetContainers()) == 6)
+        self.assertTrue(len(self.net.hosts) == 6)
+        self.assertTrue(len(self.dc[0].listCompute()) == 3)
+        self.assertTrue(len(self.dc[1].listCompute()) == 3)
+        # names and IPs are unique
+        vnfs = [r.compute for r in results]
+        self.assertEqual(len(set(v.name for v in vnfs)), 6)
+        ips = [v.getStatus()["network"][0]["ip"] for v in vnfs]
+        self.assertEqual(len(set(ips)), 6)
+        self.assertEqual(len(set(v.IP() for v in vnfs)), 6)
+        # a name can not be used twice
+        results = self.net.startComputeBatch([{"datacenter": self.dc[0], "name": "vnf0"}])
+        self.assertTrue(results[0].compute is None)
+        # check connectivity by using ping
+        self.assertTrue(self.net.ping([vnfs[0], vnfs[5]]) <= 0.0)
+        # stop Mininet network
+        self.stopNet()
+
+    def testStartComputeBatchAdmission(self):
+        """
+        Containers that are not admitted by the resource model of
+        their DC get an error result and are not created.
+        """
+        # create network
+        self.createNet(nswitches=0, ndatacenter=2, nhosts=0, ndockers=0)
+        self.net.addLink(self.dc[0], self.dc[1])
+        # the first DC fits a single small container
+        rm = UpbSimpleCloudDcRM(max_cu=1, max_mu=1024)
+        self.dc[0].assignResourceModel(rm)
+        # start Mininet network
+        self.startNet()
+        specs = [{"datacenter": self.dc[0], "name": "vnf0", "flavor_name": "small"},
+                 {"datacenter": self.dc[0], "name": "vnf1", "flavor_name": "small"},
+                 {"datacenter": self.dc[1], "name": "vnf2", "flavor_name": "small"}]
+        results = self.net.startComputeBatch(specs)
+        self.assertTrue(results[0].compute is not None)
+        self.assertTrue(results[1].compute is None and results[1].error is not None)
+        self.assertTrue(results[2].compute is not None)
+        self.assertEqual(sorted(h.name for h in self.net.hosts), ["vnf0", "vnf2"])
+        # atomic: nothing is started if one container is not admitted
+        specs = [{"datacenter": self.dc[1], "name": "vnf3", "flavor_name": "small"},
+                 {"datacenter": self.dc[0], "name": "vnf4", "flavor_name": "tiny"}]
+        results = self.net.startComputeBatch(specs, atomic=True)
+        self.assertTrue(all(r.compute is None and r.error is not None for r in results))
+        self.assertEqual(sorted(h.name for h in self.net.hosts), ["vnf0", "vnf2"])
+        self.assertEqual(rm.dc_reserved_cu, 0)
+        self.assertEqual(rm.dc_alloc_cu, 1)
+        # stop Mininet network
+        self.stopNet()
+
+
+class testVlanAllocator(unittest.TestCase):
+    """
+    Test the allocation of vlan tags used for chaining.
+    """
+
+    def testAllocateRelease(self):
+        v = VlanAllocator(first=1, last=16)
+        tags = [v.allocate(("chain", i)) for i in range(16)]
+        self.assertEqual(sorted(tags), range(1, 17))
+        # all tags in use
+        self.assertTrue(v.allocate("other") is None)
+        self.assertEqual(v.get_stats()["failures"], 1)
+        # tags of deleted chains can be reused
+        self.assertEqual(v.release_owner(("chain", 3)), [4])
+        self.assertEqual(v.allocate("other"), 4)
+        self.assertEqual(v.owner(4), "other")
+        self.assertEqual(v.get_stats()["allocated"], 16)
+
+    def testReservedRange(self):
+        v = VlanAllocator(first=1, last=16)
+        v.reserve_range("dc1", 1, 4)
+        # shared allocations never use the reserved range
+        shared = [v.allocate(i) for i in range(12)]
+        self.assertTrue(all(t > 4 for t in shared))
+        self.assertTrue(v.allocate("shared") is None)
+        # the pool still has its own tags
+        self.assertEqual(v.allocate("c1", pool="dc1"), 1)
+        self.assertEqual(v.get_stats()["pools"]["dc1"]["allocated"], 1)
+        # overlapping ranges are rejected
+        self.assertRaises(Exception, v.reserve_range, "dc2", 4, 8)
+
+
+class testChainRegistry(unittest.TestCase):
+    """
+    Test the bookkeeping of installed chains.
+    """
+
+    def testAddRemove(self):
+        r = ChainRegistry()
+        c1 = Chain(("vnf1", "intf1", "vnf2", "intf1", 10), ["s1", "s2"], vlan=1)
+        c1.flow_entries.append(("s1", "in_port=1"))
+        c2 = Chain(("vnf2", "intf1", "vnf1", "intf1", 10), ["s2", "s1"], vlan=2)
+        c3 = Chain(("vnf1", "intf1", "vnf3", "intf1", None), ["s1"])
+        for c in [c1, c2, c3]:
+            r.add(c)
+        self.assertEqual(len(r), 3)
+        # installing the same chain again keeps the old flow entries
+        c1b = Chain(c1.chain_id, ["s1", "s2"], vlan=1)
+        c1b.flow_entries.append(("s1", "in_port=2"))
+        r.add(c1b)
+        self.assertEqual(len(r.get(c1.chain_id).flow_entries), 2)
+        # remove all chains of a cookie
+        removed = r.remove_by_cookie(10)
+        self.assertEqual(len(removed), 2)
+        self.assertEqual(len(r), 1)
+        self.assertTrue(r.remove(c1.chain_id) is None)
+        self.assertEqual(r.remove(c3.chain_id), c3)
+        self.assertEqual(r.list(), [])
+
+
+class testPathCache(unittest.TestCase):
+    """
+    Test the cache of the shortest paths and its invalidation.
+    """
+
+    def setUp(self):
+        self.g = nx.Graph()
+        for n1, n2 in [("s1", "s2"), ("s2", "s3"), ("s3", "s4"), ("s1", "s5"), ("s5", "s6"), ("s6", "s4")]:
+            self.g.add_edge(n1, n2)
+        self.cache = PathCache(self.g)
+
+    def testCacheHit(self):
+        p = self.cache.shortest_path("s1", "s4")
+        self.assertEqual(len(p), 4)
+        # the graph is not consulted again for a cached path
+        self.g.remove_node("s2")
+        self.assertTrue(self.cache.shortest_path("s1", "s4") is p)
+        self.assertEqual(len(self.cache), 1)
+
+    def testEdgeAdded(self):
+        self.cache.shortest_path("s1", "s4")
+        self.cache.shortest_path("s1", "s2")
+        # a new dead end does not affect the cached paths
+        self.cache.edge_added("s1", "h1")
+        self.g.add_edge("s1", "h1")
+        self.assertEqual(len(self.cache), 2)
+        # a link between connected nodes might be a shortcut
+        self.cache.edge_added("s1", "s4")
+        self.g.add_edge("s1", "s4")
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.shortest_path("s1", "s4"), ["s1", "s4"])
+
+    def testEdgeRemoved(self):
+        p = self.cache.shortest_path("s1", "s4")
+        self.cache.shortest_path("s1", "s2")
+        self.cache.shortest_path("s5", "s6")
+        n1, n2 = p[1], p[2]
+        self.g.remove_edge(n1, n2)
+        self.cache.edge_removed(n1, n2)
+        # only the path that used the link is dropped
+        self.assertEqual(len(self.cache), 2)
+        self.assertNotEqual(self.cache.shortest_path("s1", "s4"), p)
+        self.assertEqual(len(self.cache), 3)
+
+
+class testVnfInterfaceRegistry(unittest.TestCase):
+    """
+    Test the index of the vnf interfaces connected to switches.
+    """
+
+    def _intf(self, vnf_name, vnf_interface, port):
+        return VnfInterface(vnf_name, vnf_interface, "%s-%s" % (vnf_name, vnf_interface),
+                            "s1", port, "s1-eth%d" % port, 1)
+
+    def testAddRemove(self):
+        r = VnfInterfaceRegistry()
+        self.assertTrue(r.get("vnf1") is None)
+        r.add(self._intf("vnf1", "intf1", 1))
+        r.add(self._intf("vnf1", "intf0", 2))
+        r.add(self._intf("vnf2", "intf1", 3))
+        # the first connected interface is the default
+        self.assertEqual(r.get("vnf1").switch_port_nr, 1)
+        self.assertEqual(r.get("vnf1", "intf0").switch_port_nr, 2)
+        self.assertTrue(r.get("vnf1", "intf2") is None)
+        self.assertEqual(r.lookup("vnf1:intf0").switch_port_nr, 2)
+        self.assertEqual(r.lookup("vnf2").switch_port_nr, 3)
+        self.assertEqual([i.vnf_interface for i in r.list("vnf1")], ["intf1", "intf0"])
+        self.assertEqual(r.list("vnf3"), [])
+        # remove by the Mininet interface name
+        r.remove_intf("vnf1", "vnf1-intf1")
+        self.assertEqual(r.get("vnf1").vnf_interface, "intf0")
+        r.remove_vnf("vnf1")
+        self.assertTrue(r.get("vnf1") is None)
+        self.assertEqual(len(r.list("vnf2")), 1)
+
+
+class testRyuStats(unittest.TestCase):
+    """
+    Test the decoding of Ryu's stats replies.
+    """
+
+    def _flow(self, cookie, in_port, actions, byte_count, duration_sec):
+        return {"cookie": cookie, "match": {"in_port": in_port}, "actions": actions,
+                "byte_count": byte_count, "packet_count": byte_count / 100,
+                "duration_sec": duration_sec, "duration_nsec": 500000000}
+
+    def testPortStats(self):
+        payload = json.dumps({"1": [{"port_no": "LOCAL", "rx_bytes": 1},
+                                    {"port_no": 1, "rx_bytes": 10},
+                                    {"port_no": 2, "rx_bytes": 20}]})
+        stats = parse_port_stats(payload, 1)
+        # the LOCAL port is skipped
+        self.assertEqual(sorted(stats.keys()), [1, 2])
+        self.assertEqual(stats[2]["rx_bytes"], 20)
+        self.assertEqual(parse_port_stats(payload, 1, ports={2}).keys(), [2])
+        self.assertEqual(parse_port_stats(payload, 2), {})
+        self.assertTrue(parse_port_stats("<html>", 1) is None)
+
+    def testFlowStats(self):
+        payload = json.dumps({"1": [self._flow(10, 1, ["OUTPUT:2"], 100, 1),
+                                    self._flow(10, 2, ["OUTPUT:1"], 200, 1),
+                                    self._flow(11, 1, ["OUTPUT:3"], 300, 1),
+                                    {"match": {}, "actions": ["OUTPUT:CONTROLLER"]}]})
+        stats = parse_flow_stats(payload, 1)
+        # grouped by cookie, entries without cookie have cookie 0
+        self.assertEqual(sorted(stats.keys()), [0, 10, 11])
+        self.assertEqual(len(stats[10]), 2)
+        self.assertTrue(parse_flow_stats("", 1) is None)
+
+    def testAggregateFlowStats(self):
+        flows = [self._flow(10, 1, ["OUTPUT:2"], 100, 1),
+                 self._flow(10, 1, ["OUTPUT:3"], 200, 5),
+                 self._flow(10, 2, ["OUTPUT:CONTROLLER", "OUTPUT:1"], 400, 3)]
+        self.assertEqual(aggregate_flow_stats(flows), (700, 7, 5.5))
+        self.assertEqual(aggregate_flow_stats(flows, in_port=1), (300, 3, 5.5))
+        self.assertEqual(aggregate_flow_stats(flows, in_port="2"), (400, 4, 3.5))
+        self.assertEqual(aggregate_flow_stats(flows, out_port=2), (100, 1, 1.5))
+        self.assertEqual(aggregate_flow_stats(flows, in_port=1, out_port=3), (200, 2, 5.5))
+        # OUTPUT:CONTROLLER is no port, the other actions of the entry still count
+        self.assertEqual(aggregate_flow_stats(flows, out_port=1), (400, 4, 3.5))
+        self.assertTrue(aggregate_flow_stats(flows, in_port=2, out_port=2) is None)
+        self.assertTrue(aggregate_flow_stats([]) is None)
+
+
+class testMetricSeries(unittest.TestCase):
+    """
+    Test the in-memory samples of a monitored counter.
+    """
+
+    def testRingBuffer(self):
+        s = MetricSeries(4)
+        self.assertTrue(s.latest() is None)
+        # counter starts at 0, is reset at t=103
+        for t, counter in enumerate([0, 10, 20, 0, 40, 50]):
+            s.append(100 + t, counter, t, None if t == 0 else 10.0)
+        # only the last 4 samples are kept
+        self.assertEqual(len(s), 4)
+        self.assertEqual([x["counter"] for x in s.samples()], [20, 0, 40, 50])
+        self.assertEqual(s.latest(), {"time": 105.0, "counter": 50, "rate": 10.0})
+        # the interval with the reset is left out of the average
+        self.assertEqual(s.average_rate(10, now=105.5), 25.0)
+        self.assertEqual(s.average_rate(2, now=105.5), 10.0)
+        self.assertTrue(s.average_rate(1, now=105.5) is None)
+
+
+class testMetricTable(unittest.TestCase):
+    """
+    Test the indexes of the monitored metrics.
+    """
+
+    def testIndexes(self):
+        t = MetricTable()
+        m1 = MonitoredMetric("vnf1", "intf1", "tx_packets", 1, 1)
+        m2 = MonitoredMetric("vnf1", "intf1", "rx_packets", 1, 1)
+        m3 = MonitoredMetric("vnf2", "intf1", "tx_packets", "2", 1)
+        f1 = MonitoredMetric("vnf1", "intf1", "tx_packets", 1, 1, cookie=10)
+        for m in [m1, m2, m3, f1]:
+            t.add(m)
+        self.assertEqual(len(t), 4)
+        self.assertTrue(t.get(("vnf1", "intf1", "tx_packets")) is m1)
+        self.assertTrue(t.get(("vnf1", "intf1", "tx_packets", 10)) is f1)
+        self.assertEqual(len(t.keys_of_vnf("vnf1")), 3)
+        snapshot = t.by_dpid()
+        self.assertEqual(sorted(snapshot.keys()), [1, 2])
+        self.assertEqual(set(snapshot[1]), {m1, m2, f1})
+        # adding a metric again replaces it
+        m1b = MonitoredMetric("vnf1", "intf1", "tx_packets", 1, 1)
+        t.add(m1b)
+        self.assertEqual(len(t), 4)
+        self.assertTrue(t.get(m1.key) is m1b)
+        self.assertEqual(len(t.by_dpid()[1]), 3)
+        # removing does not change a snapshot taken before
+        self.assertTrue(t.remove(m3.key) is m3)
+        self.assertTrue(t.remove(m3.key) is None)
+        self.assertEqual(sorted(t.by_dpid().keys()), [1])
+        self.assertEqual(snapshot[2], (m3,))
+        self.assertEqual(t.keys_of_vnf("vnf2"), [])
+        for key in t.keys_of_vnf("vnf1"):
+            t.remove(key)
+        self.assertEqual(len(t), 0)
+        self.assertEqual(t.by_dpid(), {})
+
+
+class testPollScheduler(unittest.TestCase):
+    """
+    Test the deadlines, back off and jitter of the polling.
+    """
+
+    def testDeadlines(self):
+        s = PollScheduler('test', interval=1.0, max_interval=10.0, jitter=0)
+        m = MonitoredMetric("vnf1", "intf1", "tx_packets", 1, 1)
+        metrics = {1: (m,)}
+        self.assertEqual(s.due(metrics, 100.0), {1: [m]})
+        # the next deadline does not depend on when the poll finished
+        s.polled(1, [m], 0.01, 100.3)
+        self.assertEqual(m.next_poll, 101.0)
+        self.assertEqual(s.due(metrics, 100.9), {})
+        self.assertAlmostEqual(s.next_wakeup(metrics, 100.9), 0.1)
+        # a deadline missed by more than one interval is not caught up
+        s.polled(1, [m], 0.01, 103.5)
+        self.assertEqual(s.missed_deadlines, 1)
+        self.assertEqual(m.next_poll, 104.5)
+        s.cycle_done(0.2)
+        self.assertEqual(s.get_stats()["cycles"], 1)
+        self.assertEqual(s.get_stats()["last_cycle_duration"], 0.2)
+        # switches that are no longer monitored are forgotten
+        s.due({}, 105.0)
+        self.assertEqual(s.get_stats()["latency"], {})
+        self.assertEqual(s.next_wakeup({}, 105.0), 1.0)
+
+    def testBackoff(self):
+        s = PollScheduler('test', interval=1.0, max_interval=10.0, jitter=0, latency_factor=10.0, alpha=0.5)
+        m1 = MonitoredMetric("vnf1", "intf1", "tx_packets", 1, 1)
+        m2 = MonitoredMetric("vnf2", "intf1", "tx_packets", 2, 1, interval=3.0)
+        s.due({1: (m1,), 2: (m2,)}, 100.0)
+        self.assertEqual(s.effective_interval(m1), 1.0)
+        self.assertEqual(s.effective_interval(m2), 3.0)
+        # slow switches are polled less often, up to max_interval
+        s.polled(1, [m1], 0.5, 100.5)
+        self.assertEqual(s.effective_interval(m1), 5.0)
+        self.assertEqual(m1.next_poll, 105.0)
+        s.polled(1, [m1], 3.5, 105.5)
+        self.assertEqual(s.effective_interval(m1), 10.0)
+        self.assertEqual(s.effective_interval(m2), 3.0)
+
+    def testJitter(self):
+        s = PollScheduler('test', interval=2.0, jitter=0.5)
+        metrics = dict((dpid, (MonitoredMetric("vnf%d" % dpid, "intf1", "tx_packets", dpid, 1),))
+                       for dpid in range(1, 21))
+        s.due(metrics, 100.0)
+        deadlines = [m.next_poll for ms in metrics.itervalues() for m in ms]
+        # the switches are spread over jitter * interval
+        self.assertTrue(all(100.0 <= d <= 101.0 for d in deadlines))
+        self.assertTrue(len(set(deadlines)) > 1)
+
+
+class FakeMonitorNet(object):
+    """
+    Network with the vnf interfaces and the stats replies of Ryu needed by the monitor.
+    """
+
+    def __init__(self):
+        self.vnf_interfaces = VnfInterfaceRegistry()
+        self.monitor_agent = None
+        # dpid -> list of port/flow stats entries
+        self.port_stats = dict()
+        self.flow_stats = dict()
+        # (prefix, dpid) of all requests
+        self.requests = []
+        # called before a request is answered
+        self.on_request = None
+
+    def addVnf(self, vnf_name, vnf_interface, dpid, port_nr):
+        self.vnf_interfaces.add(VnfInterface(vnf_name, vnf_interface, "%s-%s" % (vnf_name, vnf_interface),
+                                             "s%d" % dpid, port_nr, "s%d-eth%d" % (dpid, port_nr), dpid))
+
+    def getVnfInterface(self, vnf_name, vnf_interface=None):
+        return self.vnf_interfaces.get(vnf_name, vnf_interface)
+
+    def ryu_REST(self, prefix, dpid=None, data=None):
+        self.requests.append((prefix, dpid))
+        if self.on_request is not None:
+            self.on_request(prefix, dpid)
+        stats = self.port_stats if prefix == 'stats/port' else self.flow_stats
+        return json.dumps({str(dpid): stats.get(dpid, [])})
+
+
+class _SingleCycle(object):
+    """
+    Wakeup event that ends the polling loop of the monitor after one cycle.
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+
+    def clear(self):
+        pass
+
+    def wait(self, timeout=None):
+        self.monitor.start_monitoring = False
+
+
+class testDCNetworkMonitor(unittest.TestCase):
+    """
+    Test the polling of the monitor with the stats replies of a fake network.
+    The polling threads are stopped, each test runs the cycles itself.
+    """
+
+    def setUp(self):
+        self.net = FakeMonitorNet()
+        self.net.addVnf("vnf1", "intf1", 1, 1)
+        self.net.addVnf("vnf2", "intf1", 1, 2)
+        self.net.addVnf("vnf3", "intf1", 2, 1)
+        self.monitor = DCNetworkMonitor(self.net, push=False, sample_containers=False, interval=1.0, jitter=0)
+        self.monitor.stop()
+        self.net.requests = []
+        # record the pushes instead of sending them to a Pushgateway
+        self.pushes = []
+        self._gateway_functions = (monitoring.pushadd_to_gateway, monitoring.push_to_gateway,
+                                   monitoring.delete_from_gateway)
+        monitoring.pushadd_to_gateway = lambda gateway, job, registry: self.pushes.append(("POST", registry))
+        monitoring.push_to_gateway = lambda gateway, job, registry: self.pushes.append(("PUT", registry))
+        monitoring.delete_from_gateway = lambda gateway, job: self.pushes.append(("DELETE", None))
+
+    def tearDown(self):
+        (monitoring.pushadd_to_gateway, monitoring.push_to_gateway,
+         monitoring.delete_from_gateway) = self._gateway_functions
+
+    def _setPortStats(self, dpid, port_nr, rx_packets, duration_sec):
+        stats = [p for p in self.net.port_stats.get(dpid, []) if p["port_no"] != port_nr]
+        stats.append({"port_no": port_nr, "rx_packets": rx_packets, "tx_packets": 0,
+                      "rx_bytes": 0, "tx_bytes": 0, "duration_sec": duration_sec, "duration_nsec": 0})
+        self.net.port_stats[dpid] = stats
+
+    def _cycle(self, flow=False):
+        """
+        Run one polling cycle with all metrics due.
+        """
+        m = self.monitor
+        if flow:
+            table, lock, scheduler, poll = m.flow_metrics, m.monitor_flow_lock, m.flow_scheduler, m._poll_flow_stats
+        else:
+            table, lock, scheduler, poll = m.network_metrics, m.monitor_lock, m.network_scheduler, m._poll_port_stats
+        for metric in table:
+            metric.next_poll = 0
+        m.start_monitoring = True
+        m._poll_loop(table, lock, scheduler, _SingleCycle(m), poll)
+
+    def _value(self, vnf_name, metric='tx_packets', flow_id=None):
+        name = {'tx_packets': 'sonemu_tx_count_packets', 'rx_packets': 'sonemu_rx_count_packets',
+                'tx_bytes': 'sonemu_tx_count_bytes', 'rx_bytes': 'sonemu_rx_count_bytes'}[metric]
+        return self.monitor.registry.get_sample_value(
+            name, {'vnf_name': vnf_name, 'vnf_interface': 'intf1', 'flow_id': str(flow_id)})
+
+    def testNoLocksDuringRequests(self):
+        m = self.monitor
+        m.setup_metric("vnf1", "intf1", "tx_packets")
+        m.setup_metric("vnf2", "intf1", "tx_packets")
+        self._setPortStats(1, 1, 100, 1)
+        self._setPortStats(1, 2, 200, 1)
+        locked = []
+
+        def on_request(prefix, dpid):
+            locked.append(m.monitor_lock.locked())
+            # metrics can be changed while a switch is queried
+            self.assertTrue(m.stop_metric("vnf2", "intf1", "tx_packets") is not None)
+            self.assertTrue(m.setup_metric("vnf3", "intf1", "tx_packets").startswith("Started"))
+
+        self.net.on_request = on_request
+        self._cycle()
+        self.assertEqual(locked, [False])
+        self.assertEqual(self._value("vnf1"), 100)
+        # the metric stopped during the request is not set again
+        self.assertTrue(self._value("vnf2") is None)
+        self.assertEqual(len(m.network_metrics), 2)
+
+    def testRate(self):
+        m = self.monitor
+        m.setup_metric("vnf1", "intf1", "tx_packets")
+        m.setup_metric("vnf2", "intf1", "tx_packets")
+        # the first sample only sets the baseline, without waiting for a second one
+        self._setPortStats(1, 1, 100, 1)
+        self._setPortStats(1, 2, 0, 1)
+        start = time.time()
+        self._cycle()
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertTrue(m.query_metric("vnf1", "intf1", "tx_packets")["rate"] is None)
+        # one request per switch and cycle
+        self.assertEqual(self.net.requests, [('stats/port', 1)])
+        self._setPortStats(1, 1, 300, 3)
+        self._cycle()
+        self.assertEqual(m.query_metric("vnf1", "intf1", "tx_packets")["rate"], 100.0)
+        self.assertEqual(len(self.net.requests), 2)
+        # after a reset of the counter the next sample is a new baseline
+        self._setPortStats(1, 1, 50, 4)
+        self._cycle()
+        self.assertTrue(m.query_metric("vnf1", "intf1", "tx_packets")["rate"] is None)
+        self._setPortStats(1, 1, 100, 5)
+        self._cycle()
+        self.assertEqual(m.query_metric("vnf1", "intf1", "tx_packets")["rate"], 50.0)
+        self.assertEqual(m.query_metric("vnf1", "intf1", "tx_packets")["samples"], 4)
+
+    def testFlowStats(self):
+        m = self.monitor
+        m.setup_flow("vnf1", "intf1", "tx_packets", cookie=10)
+        m.setup_flow("vnf2", "intf1", "rx_bytes", cookie=10)
+        m.setup_flow("vnf3", "intf1", "tx_packets", cookie=11)
+
+        def flow(cookie, in_port, out_port, packets):
+            return {"cookie": cookie, "match": {"in_port": in_port}, "actions": ["OUTPUT:%d" % out_port],
+                    "packet_count": packets, "byte_count": packets * 100, "duration_sec": 1, "duration_nsec": 0}
+
+        self.net.flow_stats[1] = [flow(10, 1, 3, 5), flow(10, 1, 4, 7), flow(10, 3, 2, 10), flow(11, 1, 3, 100)]
+        self.net.flow_stats[2] = [flow(11, 1, 3, 2)]
+        self._cycle(flow=True)
+        # one request per switch, the counters of all matching entries of the cookie are summed up
+        self.assertEqual(sorted(self.net.requests), [('stats/flow', 1), ('stats/flow', 2)])
+        self.assertEqual(self._value("vnf1", "tx_packets", 10), 12)
+        self.assertEqual(self._value("vnf2", "rx_bytes", 10), 1000)
+        self.assertEqual(self._value("vnf3", "tx_packets", 11), 2)
+
+    def testStopMetric(self):
+        m = self.monitor
+        m.push = True
+        m.setup_metric("vnf1", "intf1", "tx_packets")
+        m.setup_metric("vnf1", "intf1", "rx_packets")
+        m.setup_metric("vnf2", "intf1", "tx_packets")
+        m.setup_flow("vnf1", "intf1", "tx_packets", cookie=10)
+        self._setPortStats(1, 1, 100, 1)
+        self._setPortStats(1, 2, 200, 1)
+        self.net.flow_stats[1] = [{"cookie": 10, "match": {"in_port": 1}, "actions": ["OUTPUT:2"],
+                                   "packet_count": 5, "byte_count": 500, "duration_sec": 1, "duration_nsec": 0}]
+        self._cycle()
+        self._cycle(flow=True)
+        self.assertEqual(self._value("vnf1", "tx_packets", 10), 5)
+        # only the label set of the stopped metric is removed
+        m.stop_metric("vnf1", "intf1", "tx_packets")
+        self.assertTrue(self._value("vnf1") is None)
+        self.assertEqual(self._value("vnf1", "rx_packets"), 0)
+        self.assertEqual(self._value("vnf2"), 200)
+        self.assertEqual(self._value("vnf1", "tx_packets", 10), 5)
+        # the next push replaces the job instead of deleting it
+        self.pushes = []
+        self._cycle()
+        self.assertEqual([method for method, _ in self.pushes], ["PUT"])
+        self._cycle()
+        self.assertEqual([method for method, _ in self.pushes], ["PUT", "POST"])
+        # stop all metrics and flows of a vnf
+        m.stop_metric("vnf1")
+        self.assertTrue(self._value("vnf1", "rx_packets") is None)
+        self.assertTrue(self._value("vnf1", "tx_packets", 10) is None)
+        self.assertEqual(self._value("vnf2"), 200)
+        self.assertEqual(len(m.network_metrics) + len(m.flow_metrics), 1)
+        # a metric that was never polled can be stopped as well
+        m.setup_metric("vnf3", "intf1", "tx_packets")
+        self.assertTrue(m.stop_metric("vnf3", "intf1", "tx_packets") is not None)
+
+    def _pushedFamilies(self, pushes):
+        return set(family.name for _, registry in pushes for family in registry.collect())
+
+    def testPushPerCycle(self):
+        m = self.monitor
+        m.push = True
+        for vnf_name in ["vnf1", "vnf2", "vnf3"]:
+            m.setup_metric(vnf_name, "intf1", "tx_packets")
+        self._setPortStats(1, 1, 100, 1)
+        self._setPortStats(1, 2, 100, 1)
+        self._setPortStats(2, 1, 100, 1)
+        self._cycle()
+        # three metrics on two switches, one push
+        self.assertEqual(len(self.net.requests), 2)
+        self.assertEqual([method for method, _ in self.pushes], ["POST"])
+        # delta pushes leave out the metric families that did not change
+        m.push_delta = True
+        self._cycle()
+        self.assertTrue("sonemu_tx_count_packets" in self._pushedFamilies(self.pushes[1:]))
+        n = len(self.pushes)
+        self._cycle()
+        self.assertFalse("sonemu_tx_count_packets" in self._pushedFamilies(self.pushes[n:]))
+        n = len(self.pushes)
+        self._setPortStats(2, 1, 200, 2)
+        self._cycle()
+        self.assertTrue("sonemu_tx_count_packets" in self._pushedFamilies(self.pushes[n:]))
+
+    def testPollErrors(self):
+        m = self.monitor
+        m.push = True
+        m.setup_metric("vnf1", "intf1", "tx_packets")
+        m.setup_metric("vnf3", "intf1", "tx_packets")
+        self._setPortStats(1, 1, 100, 1)
+        self._setPortStats(2, 1, 100, 1)
+
+        def on_request(prefix, dpid):
+            if dpid == 1:
+                raise ValueError("bad reply")
+
+        def push_failed(gateway, job, registry):
+            raise IOError("Pushgateway not reachable")
+
+        # a failing switch and a failing push do not stop the polling of the other switches
+        self.net.on_request = on_request
+        monitoring.pushadd_to_gateway = push_failed
+        self._cycle()
+        self.assertEqual(sorted(self.net.requests), [('stats/port', 1), ('stats/port', 2)])
+        self.assertTrue(self._value("vnf1") is None)
+        self.assertEqual(self._value("vnf3"), 100)
+        # the next cycle works again
+        self.net.on_request = None
+        monitoring.pushadd_to_gateway = lambda gateway, job, registry: self.pushes.append(("POST", registry))
+        self._setPortStats(2, 1, 200, 2)
+        self._cycle()
+        self.assertEqual(self._value("vnf1"), 100)
+        self.assertEqual(self._value("vnf3"), 200)
+        self.assertEqual([method for method, _ in self.pushes], ["POST"])
+
+    def testMetricsEndpoint(self):
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        s.close()
+        m = DCNetworkMonitor(self.net, push=False, sample_containers=False, metrics_port=port)
+        try:
+            m.setup_metric("vnf1", "intf1", "tx_packets")
+            self._setPortStats(1, 1, 100, 1)
+            m._poll_port_stats(1, tuple(m.network_metrics))
+            conn = httplib.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/metrics")
+            r = conn.getresponse()
+            body = r.read()
+            conn.close()
+        finally:
+            m.stop()
+        self.assertEqual(r.status, 200)
+        self.assertTrue('sonemu_tx_count_packets{' in body)
+        self.assertTrue('vnf_name="vnf1"' in body)
+
+
+# ovs-ofctl that logs its calls and, like older OVS versions, can not read del-flows from a file
+FAKE_OVS_OFCTL = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/calls.log"
+case "$*" in
+    *del-flows*" -") exit 1 ;;
+esac
+cat > /dev/null
+"""
+
+
+class testOfctlBatch(unittest.TestCase):
+    """
+    Test the flow programming with batched ovs-ofctl calls.
+    """
+
+    def setUp(self):
+        self.bindir = tempfile.mkdtemp()
+        path = os.path.join(self.bindir, "ovs-ofctl")
+        with open(path, "w") as f:
+            f.write(FAKE_OVS_OFCTL)
+        os.chmod(path, 0755)
+        self.old_path = os.environ["PATH"]
+        os.environ["PATH"] = self.bindir + os.pathsep + self.old_path
+
+    def tearDown(self):
+        os.environ["PATH"] = self.old_path
+        shutil.rmtree(self.bindir)
+
+    def getCalls(self):
+        with open(os.path.join(self.bindir, "calls.log")) as f:
+            return [line.split() for line in f]
+
+    def testFallback(self):
+        batches = [(("s1", "add-flow", ""), ["in_port=1,action=2", "in_port=2,action=1"]),
+                   (("s1", "add-flow", "-O OpenFlow13"), ["in_port=3,action=mod_vlan_vid:1,output=2"]),
+                   (("s1", "del-flows", "--strict"), ["priority=32768,in_port=1", "priority=32768,in_port=2"])]
+        self.assertTrue(_run_switch_batches(batches))
+        # one call per add batch in the given order, del-flows falls back to one
+        # strict call per entry, so only the installed entries are deleted
+        self.assertEqual(self.getCalls(), [
+            ["add-flows", "s1", "-"],
+            ["-O", "OpenFlow13", "add-flows", "s1", "-"],
+            ["--strict", "del-flows", "s1", "-"],
+            ["--strict", "del-flows", "s1", "priority=32768,in_port=1"],
+            ["--strict", "del-flows", "s1", "priority=32768,in_port=2"]])
+
+
+class testCgroupStats(unittest.TestCase):
+    """
+    Test reading the usage of a container from a (fake) cgroup tree.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def writeFile(self, path, data):
+        path = os.path.join(self.root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(data)
+
+    def testCgroupV1(self):
+        self.writeFile("cpuacct/docker/abc/cpuacct.usage", "1500000000\n")
+        self.writeFile("memory/docker/abc/memory.usage_in_bytes", "4096\n")
+        self.assertFalse(is_cgroup_v2(self.root))
+        self.assertEqual(find_cgroup_file("cpu", "abc", root=self.root),
+                         os.path.join(self.root, "cpuacct/docker/abc/cpuacct.usage"))
+        self.assertTrue(find_cgroup_file("memory", "xyz", root=self.root) is None)
+        r = CgroupReader("abc", root=self.root)
+        self.assertEqual(r.read(), (1500000000, 4096))
+        # the open files are read again
+        self.writeFile("cpuacct/docker/abc/cpuacct.usage", "2500000000\n")
+        self.assertEqual(r.read(), (2500000000, 4096))
+        r.close()
+
+    def testCgroupV2(self):
+        self.writeFile("cgroup.controllers", "cpu memory\n")
+        self.writeFile("system.slice/docker-abc.scope/cpu.stat", "usage_usec 1500\nuser_usec 1000\nsystem_usec 500\n")
+        self.writeFile("system.slice/docker-abc.scope/memory.current", "8192\n")
+        self.assertTrue(is_cgroup_v2(self.root))
+        self.assertEqual(find_cgroup_file("memory", "abc", root=self.root),
+                         os.path.join(self.root, "system.slice/docker-abc.scope/memory.current"))
+        r = CgroupReader("abc", root=self.root)
+        self.assertEqual(r.read(), (1500000, 8192))
+        r.close()
+        # no cgroup files for this container
+        r = CgroupReader("xyz", root=self.root)
+        self.assertEqual(r.read(), (None, None))
+        r.close()
+
+
+class FakeResponse(object):
+
+    status = 200
+
+    def read(self):
+        return "ok"
+
+
+class FakeConnection(object):
+    """
+    Keep-alive connection over a socket pair, closeByServer() closes
+    the server side like a server that drops idle connections.
+    If drop_next is set, the next request is closed without a reply
+    (the server closed the connection after the idle check).
+    """
+
+    def __init__(self):
+        self.sock = None
+        self.server = None
+        self.drop_next = False
+        self.requests = []
+
+    def request(self, method, path, body, headers):
+        self.requests.append((method, path))
+        if self.sock is None:
+            self.sock, self.server = socket.socketpair()
+
+    def getresponse(self):
+        if self.server is None or self.drop_next:
+            self.drop_next = False
+            raise httplib.BadStatusLine("")
+        return FakeResponse()
+
+    def closeByServer(self):
+        self.server.close()
+        self.server = None
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+
+class testRestClient(unittest.TestCase):
+    """
+    Test the pooled connections to Ryu's REST API.
+    """
+
+    def setUp(self):
+        self.conn = FakeConnection()
+        self.client = RestClient("127.0.0.1", 8080, max_idle=60.0)
+        self.client._create_connection = lambda: self.conn
+
+    def tearDown(self):
+        self.conn.close()
+
+    def testRetry(self):
+        c, conn = self.client, self.conn
+        self.assertEqual(c.request("GET", "/stats/switches"), (200, "ok"))
+        # the server closes the connection while a GET is sent, it is sent again on a fresh connection
+        conn.drop_next = True
+        self.assertEqual(c.request("GET", "/stats/switches"), (200, "ok"))
+        self.assertEqual(len(conn.requests), 3)
+        # a POST might have been processed by the server, it is not sent twice
+        conn.drop_next = True
+        self.assertEqual(c.request("POST", "/stats/flowentry/add", "{}"), (None, None))
+        self.assertEqual(len(conn.requests), 4)
+        # the failed connection is reconnected for the next request
+        self.assertEqual(c.request("POST", "/stats/flowentry/add", "{}"), (200, "ok"))
+
+    def testIdleConnectionClosed(self):
+        c, conn = self.client, self.conn
+        self.assertEqual(c.request("GET", "/stats/switches"), (200, "ok"))
+        sock = conn.sock
+        # the server closed the idle connection, a POST is sent on a fresh one
+        conn.closeByServer()
+        self.assertEqual(c.request("POST", "/stats/flowentry/add", "{}"), (200, "ok"))
+        self.assertEqual(len(conn.requests), 2)
+        self.assertTrue(conn.sock is not sock)
+        # connections that were idle too long are not reused either
+        sock = conn.sock
+        conn.last_used -= 61.0
+        self.assertEqual(c.request("POST", "/stats/flowentry/add", "{}"), (200, "ok"))
+        self.assertEqual(len(conn.requests), 3)
+        self.assertTrue(conn.sock is not sock)
+        # open connections are reused
+        sock = conn.sock
+        self.assertEqual(c.request("POST", "/stats/flowentry/add", "{}"), (200, "ok"))
+        self.assertTrue(conn.sock is sock)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,7 @@
 import time
 import os
+import json
+import tempfile
 import unittest
 from emuvim.test.base import SimpleTestTopology
 from emuvim.dcemulator.resourcemodel import BaseResourceModel, ResourceFlavor, NotEnoughResourcesAvailable, ResourceModelRegistrar
@@ -212,6 +214,113 @@ class testUpbSimpleCloudDcRM(SimpleTestTopology):
         rm.free(c1)
         self.assertTrue(rm.dc_alloc_cu == 0)
 
+    def testAllocationLog(self):
+        """
+        Test the delta format of the allocation log.
+        :return:
+        """
+        reg = ResourceModelRegistrar(dc_emulation_max_cpu=1.0, dc_emulation_max_mem=512)
+        rm = UpbSimpleCloudDcRM(max_cu=100, max_mu=100, log_format="delta")
+        reg.register("test_dc", rm)
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            c1 = createDummyContainerObject("c1", flavor="tiny")
+            rm.allocate(c1)
+            rm.write_allocation_log(c1, path)
+            rm.free(c1)
+            rm.write_free_log(c1, path)
+            # the records are written in the background until the registrar is closed
+            reg.close()
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+        finally:
+            os.remove(path)
+        self.assertEqual([r["action"] for r in records], ["allocate", "free"])
+        self.assertEqual(records[0]["container"]["name"], "c1")
+        self.assertEqual(records[0]["rm_counters"]["dc_alloc_cu"], 0.5)
+        self.assertEqual(records[1]["rm_counters"]["n_allocated"], 0)
+
+    def testCapacityChange(self):
+        """
+        Test that the limits follow the total capacity of all DCs.
+        :return:
+        """
+        reg = ResourceModelRegistrar(dc_emulation_max_cpu=1.0, dc_emulation_max_mem=512)
+        rm1 = UpbSimpleCloudDcRM(max_cu=100, max_mu=2048)
+        rm2 = UpbSimpleCloudDcRM(max_cu=100, max_mu=2048)
+        reg.register("test_dc1", rm1)
+        reg.register("test_dc2", rm2)
+        c1 = createDummyContainerObject("c1", flavor="small")
+        rm1.allocate(c1)
+        self.assertAlmostEqual(float(c1.cpu_quota) / c1.cpu_period, 1.0 / 200)
+        # a second DC gets more capacity: the CU of all DCs gets smaller
+        rm2.dc_max_cu = 300
+        self.assertEqual(reg.sum_max_cu, 400)
+        c2 = createDummyContainerObject("c2", flavor="small")
+        rm1.allocate(c2)
+        self.assertAlmostEqual(float(c2.cpu_quota) / c2.cpu_period, 1.0 / 400)
+        self.assertAlmostEqual(float(c1.cpu_quota) / c1.cpu_period, 1.0 / 400)
+        self.assertEqual(c1.mem_limit, c2.mem_limit)
+
+    def testReservation(self):
+        """
+        Test the admission of containers with reservations.
+        :return:
+        """
+        reg = ResourceModelRegistrar(dc_emulation_max_cpu=1.0, dc_emulation_max_mem=512)
+        rm = UpbSimpleCloudDcRM(max_cu=2, max_mu=2048)
+        reg.register("test_dc", rm)
+        # reserved resources block further reservations
+        r1 = rm.reserve("small")
+        r2 = rm.reserve("small")
+        self.assertEqual(rm.dc_reserved_cu, 2)
+        self.assertRaises(NotEnoughResourcesAvailable, rm.reserve, "tiny")
+        # an aborted reservation frees its resources
+        rm.abort(r2)
+        self.assertEqual(rm.dc_reserved_cu, 1)
+        # a committed reservation is allocated to the container
+        c1 = createDummyContainerObject("c1", flavor="small")
+        rm.commit(r1, c1)
+        self.assertEqual(rm.dc_reserved_cu, 0)
+        self.assertEqual(rm.dc_alloc_cu, 1)
+        # either all or none of the containers are reserved
+        self.assertRaises(NotEnoughResourcesAvailable, rm.reserve_many, ["tiny", "small"])
+        self.assertEqual(rm.dc_reserved_cu, 0)
+        self.assertEqual(len(rm.reserve_many(["tiny", "tiny"])), 2)
+        self.assertEqual(rm.dc_reserved_cu, 1)
+
+    def testBatchOverCapacity(self):
+        """
+        Start a batch that does not fit into the data center: the rejected
+        containers get an error result and no reservation is left behind.
+        :return:
+        """
+        # create network
+        self.createNet(nswitches=0, ndatacenter=1, nhosts=0, ndockers=0)
+        r = UpbSimpleCloudDcRM(max_cu=2, max_mu=2048)
+        self.dc[0].assignResourceModel(r)
+        self.startNet()
+        specs = [{"name": "vnf%d" % i, "flavor_name": "small"} for i in range(3)]
+        # atomic: none of the containers is started
+        results = self.dc[0].startComputeBatch(specs, atomic=True)
+        self.assertEqual([res.name for res in results], ["vnf0", "vnf1", "vnf2"])
+        self.assertTrue(all(res.compute is None and res.error for res in results))
+        self.assertEqual(r.dc_reserved_cu, 0)
+        self.assertEqual(r.dc_alloc_cu, 0)
+        self.assertEqual(len(self.dc[0].listCompute()), 0)
+        # not atomic: only the container that does not fit is rejected
+        results = self.dc[0].startComputeBatch(specs, atomic=False)
+        self.assertTrue(results[0].compute is not None and results[0].error is None)
+        self.assertTrue(results[1].compute is not None and results[1].error is None)
+        self.assertTrue(results[2].compute is None)
+        self.assertTrue("Not enough compute resources left" in results[2].error)
+        self.assertEqual(r.dc_reserved_cu, 0)
+        self.assertEqual(r.dc_alloc_cu, 2)
+        self.assertEqual(len(self.dc[0].listCompute()), 2)
+        # stop Mininet network
+        self.stopNet()
+
     @unittest.skipIf(os.environ.get("SON_EMU_IN_DOCKER") is not None,
                      "skipping test when running inside Docker container")
     def testInRealTopo(self):
@@ -307,6 +416,26 @@ class testUpbOverprovisioningCloudDcRM(SimpleTestTopology):
         self.assertAlmostEqual(float(c5.mem_limit/1024/1024), float(E_MEM) / MAX_MU * 128)
         self.assertAlmostEqual(rm.cpu_op_factor, 0.6)
 
+    def testBatchedLimitUpdates(self):
+        """
+        Test that the limit changes within the window are coalesced.
+        :return:
+        """
+        reg = ResourceModelRegistrar(dc_emulation_max_cpu=1.0, dc_emulation_max_mem=512)
+        rm = UpbOverprovisioningCloudDcRM(max_cu=3, max_mu=2048, limit_window=60)
+        reg.register("test_dc", rm)
+        containers = [createDummyContainerObject("c%d" % i, flavor="small") for i in range(6)]
+        for c in containers:
+            rm.allocate(c)
+        # nothing is applied before the window ends
+        self.assertEqual(containers[0].cpu_quota, -1)
+        rm.close()
+        # each container got only its final limit
+        for c in containers:
+            self.assertAlmostEqual(float(c.cpu_quota) / c.cpu_period, 1.0 / 3 * 0.5, places=5)
+        self.assertEqual(rm.limit_applier.applied, 6)
+        self.assertTrue(rm.limit_applier.coalesced > 0)
+
 
 class testUpbDummyRM(SimpleTestTopology):
     """
@@ -3,8 +3,16 @@ import requests
 import json
 import os
 import unittest
+import networkx as nx
+from collections import OrderedDict
 from emuvim.test.base import SimpleTestTopology
 from emuvim.api.sonata import SonataDummyGatekeeperEndpoint
+from emuvim.api.sonata import dummygatekeeper
+from emuvim.api.sonata.dummygatekeeper import FirstDcPlacement, LeastLoadedPlacement, BinPackingPlacement, \
+    DelayAwarePlacement, get_flavor_name, DEFAULT_FLAVOR
+from emuvim.dcemulator.resourcemodel import ResourceModelRegistrar
+from emuvim.dcemulator.resourcemodel.upb.simple import UpbSimpleCloudDcRM
+from emuvim.dcemulator.node import Datacenter, ComputeResult, start_compute_batch
 
 PACKAGE_PATH = "misc/sonata-demo-docker.son"
 
@@ -63,3 +71,197 @@ class testSonataDummyGatekeeper(SimpleTestTopology):
         self.stopNet()
 
 
+class testPlacement(unittest.TestCase):
+    """
+    Test the capacity aware placement algorithms with dummy data centers.
+    """
+
+    def _createDcs(self, *max_cus):
+        class DummyDatacenter(object):
+            def __init__(self, label, rm):
+                self.label = label
+                self.containers = {}
+                self.net = None
+                self.switch = None
+                self._rm = rm
+
+            def getResourceModel(self):
+                return self._rm
+
+        reg = ResourceModelRegistrar(dc_emulation_max_cpu=1.0, dc_emulation_max_mem=512)
+        dcs = dict()
+        for i, max_cu in enumerate(max_cus):
+            rm = UpbSimpleCloudDcRM(max_cu=max_cu, max_mu=1024)
+            dc = DummyDatacenter("dc%d" % i, rm)
+            reg.register(dc, rm)
+            dcs[dc.label] = dc
+        return dcs
+
+    def _place(self, algorithm, dcs, n_vnfs):
+        vnfds = dict(("vnf%d" % i, dict()) for i in range(n_vnfs))
+        algorithm().place(dict(), vnfds, dcs)
+        result = dict()
+        for vnfd in vnfds.itervalues():
+            result[vnfd["dc"].label] = result.get(vnfd["dc"].label, 0) + 1
+        return result
+
+    def testFirstDcPlacement(self):
+        # each DC fits two small VNFs (1 CU each), the first one is used until it is full
+        dcs = self._createDcs(2, 2)
+        first = list(dcs.itervalues())[0].label
+        result = self._place(FirstDcPlacement, dcs, 3)
+        self.assertEqual(result[first], 2)
+        self.assertEqual(sum(result.values()), 3)
+
+    def testLeastLoadedPlacement(self):
+        dcs = self._createDcs(4, 4)
+        result = self._place(LeastLoadedPlacement, dcs, 4)
+        self.assertEqual(sorted(result.values()), [2, 2])
+
+    def testBinPackingPlacement(self):
+        # the VNFs fit into the small DC, the big one stays free
+        dcs = self._createDcs(10, 3)
+        result = self._place(BinPackingPlacement, dcs, 3)
+        self.assertEqual(result, {"dc1": 3})
+
+    def testDelayAwarePlacement(self):
+        class DummyNet(object):
+            def __init__(self):
+                self.DCNetwork_graph = nx.MultiDiGraph()
+
+            def addLink(self, n1, n2, delay):
+                self.DCNetwork_graph.add_edge(n1, n2, delay=delay)
+                self.DCNetwork_graph.add_edge(n2, n1, delay=delay)
+
+        class DummySwitch(object):
+            def __init__(self, name):
+                self.name = name
+
+        # dc0 only fits one small VNF, dc1 is more loaded than dc2 but closer to dc0
+        dcs = self._createDcs(1, 10, 10)
+        net = DummyNet()
+        for dc in dcs.itervalues():
+            dc.net = net
+            dc.switch = DummySwitch("%s.s1" % dc.label)
+        dcs["dc1"].getResourceModel().dc_alloc_cu = 2
+        dcs["dc2"].getResourceModel().dc_alloc_cu = 1
+        net.addLink("dc0.s1", "s1", "2")
+        net.addLink("s1", "dc1.s1", "3")
+        net.addLink("dc0.s1", "dc2.s1", "50")
+        net.addLink("dc1.s1", "dc2.s1", "100")
+        nsd = {"network_functions": [{"vnf_id": "a_id", "vnf_name": "a"},
+                                     {"vnf_id": "b_id", "vnf_name": "b"}],
+               "virtual_links": [{"connection_points_reference": ["a_id:cp1", "b_id:cp1"]}]}
+        vnfds = OrderedDict([("a", dict()), ("b", dict())])
+        DelayAwarePlacement().place(nsd, vnfds, dcs)
+        # a goes to the least loaded DC, b as close as possible to it
+        self.assertEqual(vnfds["a"]["dc"].label, "dc0")
+        self.assertEqual(vnfds["b"]["dc"].label, "dc1")
+
+    def testFlavorName(self):
+        def vnfd(*reqs):
+            return {"virtual_deployment_units": [
+                {"resource_requirements": {"cpu": {"vcpus": c}, "memory": {"size": m, "size_unit": u}}}
+                for c, m, u in reqs]}
+        self.assertEqual(get_flavor_name(dict()), DEFAULT_FLAVOR)
+        self.assertEqual(get_flavor_name(vnfd((1, 256, "MB"))), "tiny")
+        self.assertEqual(get_flavor_name(vnfd((1, 2, "GB"))), "small")
+        self.assertEqual(get_flavor_name(vnfd((1, 1, "GB"), (1, 1, "GB"))), "medium")
+        self.assertEqual(get_flavor_name(vnfd((64, 1, "GB"))), "xlarge")
+
+
+class testServiceStart(unittest.TestCase):
+    """
+    Test the start of a service that can not be (completely) started.
+    """
+
+    def setUp(self):
+        self._gk_state = (dummygatekeeper.GK.dcs, dummygatekeeper.GK.placement)
+
+    def tearDown(self):
+        dummygatekeeper.GK.dcs, dummygatekeeper.GK.placement = self._gk_state
+        dummygatekeeper.GK.services.pop("test-service", None)
+
+    def _createService(self, n_vnfs):
+        vnfd = {"virtual_deployment_units": [{"resource_requirements": {
+            "cpu": {"vcpus": 1}, "memory": {"size": 2, "size_unit": "GB"}}}]}
+        service = dummygatekeeper.Service("test-service", None, None)
+        service.nsd = {"network_functions": [], "virtual_links": []}
+        for i in range(n_vnfs):
+            name = "vnf%d" % i
+            service.vnfds[name] = dict(vnfd, name=name)
+            service.remote_docker_image_urls[name] = "ubuntu:trusty"
+        service._check_docker_image_exists = lambda image: True
+        dummygatekeeper.GK.services[service.uuid] = service
+        dummygatekeeper.GK.placement = FirstDcPlacement
+        return service
+
+    def _instantiate(self):
+        client = dummygatekeeper.app.test_client()
+        r = client.post("/instantiations", data=json.dumps({"service_uuid": "test-service"}))
+        return r.status_code, json.loads(r.data)
+
+    def testServiceDoesNotFit(self):
+        class DummyNet(object):
+            def __init__(self):
+                self.rm_registrar = ResourceModelRegistrar(dc_emulation_max_cpu=1.0, dc_emulation_max_mem=512)
+
+            def getAllContainers(self):
+                return []
+
+            def startComputeBatch(self, specs, max_workers=4, atomic=False):
+                return start_compute_batch([(spec["datacenter"], spec) for spec in specs], atomic=atomic)
+
+        # each DC fits one small VNF, the service has three
+        net = DummyNet()
+        dcs = dict()
+        for label in ["dc1", "dc2"]:
+            dc = Datacenter(label)
+            dc.net = net
+            dc.assignResourceModel(UpbSimpleCloudDcRM(max_cu=1, max_mu=1024))
+            dcs[label] = dc
+        dummygatekeeper.GK.dcs = dcs
+        service = self._createService(3)
+        status, result = self._instantiate()
+        self.assertEqual(status, 500)
+        self.assertTrue(result["service_instance_uuid"] is None)
+        self.assertTrue("Not enough compute resources left" in result["error"])
+        self.assertEqual(service.instances, {})
+        # the resources of the service are not reserved any longer
+        for dc in dcs.itervalues():
+            self.assertEqual(dc.getResourceModel().dc_reserved_cu, 0)
+            self.assertEqual(dc.getResourceModel().dc_alloc_cu, 0)
+
+    def testStopStartedVnfs(self):
+        stopped = []
+
+        class DummyDatacenter(object):
+            def __init__(self, net):
+                self.label = "dc1"
+                self.containers = {}
+                self.net = net
+                self.switch = None
+
+            def getResourceModel(self):
+                return None
+
+            def stopCompute(self, name):
+                stopped.append(name)
+
+        class DummyCompute(object):
+            def __init__(self, name, datacenter):
+                self.name = name
+                self.datacenter = datacenter
+
+        class DummyNet(object):
+            def startComputeBatch(self, specs, max_workers=4, atomic=False):
+                # the first container is started, the creation of the others fails
+                return [ComputeResult(specs[0]["name"], DummyCompute(specs[0]["name"], specs[0]["datacenter"]), None)] + \
+                       [ComputeResult(spec["name"], None, "image not found") for spec in specs[1:]]
+
+        dummygatekeeper.GK.dcs = {"dc1": DummyDatacenter(DummyNet())}
+        service = self._createService(2)
+        status, result = self._instantiate()
+        self.assertEqual(status, 500)
+        self.assertEqual(len(stopped), 1)
+        self.assertEqual(service.instances, {})
@@ -0,0 +1,68 @@
+"""
+Benchmark of the decoding of Ryu's stats/port replies, as done once per
+polling cycle and switch by the DCNetworkMonitor.
+
+Compares the former ast.literal_eval parsing with the JSON based decoding
+of emuvim.dcemulator.ryustats for switches with 48 and 256 ports.
+
+Usage: python utils/benchmark/ryu_stats_decode.py [n_rounds]
+"""
+import os
+import sys
+import ast
+import json
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../src"))
+from emuvim.dcemulator import ryustats
+
+DPID = 1001
+# ports that are monitored, like in a DC with some vnfs
+MONITORED_PORTS = set([1, 2, 3, 4])
+
+
+def make_payload(n_ports):
+    """
+    Build a stats/port reply like Ryu's ofctl_rest (OpenFlow 1.3) does.
+    """
+    stats = []
+    for port_no in range(1, n_ports + 1) + ["LOCAL"]:
+        stats.append({
+            "port_no": port_no,
+            "rx_packets": random.randint(0, 2 ** 32), "tx_packets": random.randint(0, 2 ** 32),
+            "rx_bytes": random.randint(0, 2 ** 40), "tx_bytes": random.randint(0, 2 ** 40),
+            "rx_dropped": 0, "tx_dropped": 0, "rx_errors": 0, "tx_errors": 0,
+            "rx_frame_err": 0, "rx_over_err": 0, "rx_crc_err": 0, "collisions": 0,
+            "duration_sec": random.randint(0, 10 ** 5), "duration_nsec": random.randint(0, 10 ** 9)})
+    return json.dumps({str(DPID): stats})
+
+
+def literal_eval_lookup(payload):
+    port_stat_dict = ast.literal_eval(payload)
+    result = {}
+    for port_no in MONITORED_PORTS:
+        for port_stat in port_stat_dict[str(DPID)]:
+            if port_stat["port_no"] != "LOCAL" and int(port_stat["port_no"]) == port_no:
+                result[port_no] = port_stat
+    return result
+
+
+def ryustats_lookup(payload):
+    return ryustats.parse_port_stats(payload, DPID, ports=MONITORED_PORTS)
+
+
+def main(n_rounds=200):
+    print "%-8s %-8s %12s %12s %8s" % ("ports", "bytes", "literal_eval", "ryustats", "speedup")
+    for n_ports in [48, 256]:
+        payload = make_payload(n_ports)
+        # both have to find the same entries
+        assert literal_eval_lookup(payload) == ryustats_lookup(payload)
+        t_ast = min(timeit.repeat(lambda: literal_eval_lookup(payload), number=n_rounds, repeat=3)) / n_rounds
+        t_json = min(timeit.repeat(lambda: ryustats_lookup(payload), number=n_rounds, repeat=3)) / n_rounds
+        print "%-8d %-8d %10.3fms %10.3fms %7.1fx" % (
+            n_ports, len(payload), t_ast * 1000, t_json * 1000, t_ast / t_json)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])